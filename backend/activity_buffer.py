@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import atexit
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import bindparam, insert, update
+from sqlalchemy.exc import IntegrityError
+
+from db import db_session
+from models import FeatureUsage, User
+
+ACTIVITY_FLUSH_SECONDS = float(os.getenv("ACTIVITY_FLUSH_SECONDS", "10"))
+# Flush early once this many usage rows are waiting
+ACTIVITY_MAX_PENDING = int(os.getenv("ACTIVITY_MAX_PENDING", "500"))
+# Upper bound on rows kept after failed flushes, so a DB outage can't grow memory forever
+ACTIVITY_MAX_BACKLOG = int(os.getenv("ACTIVITY_MAX_BACKLOG", "10000"))
+
+
+# Core executemany rather than an ORM bulk update: rows for deleted users simply match
+# nothing, where the ORM raises StaleDataError and would keep the batch requeued forever
+_HEARTBEAT_UPDATE = (
+    update(User.__table__)
+    .where(User.__table__.c.id == bindparam("user_id"))
+    .values(last_heartbeat=bindparam("seen"))
+)
+
+
+def _utcnow() -> datetime:
+    # Naive UTC for compatibility with TIMESTAMP WITHOUT TIME ZONE
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class ActivityBuffer:
+    """
+    Write-behind buffer for heartbeats and feature usage.
+    Heartbeats are coalesced per user; both are written in bulk by a background thread.
+    """
+
+    def __init__(self, flush_interval: float = ACTIVITY_FLUSH_SECONDS):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending_heartbeats: Dict[int, datetime] = {}
+        self._pending_usage: List[Dict[str, Any]] = []
+        # Last heartbeat seen by this process for every user, flushed or not
+        self._last_seen: Dict[int, datetime] = {}
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="activity-flush", daemon=True)
+                self._thread.start()
+
+    def record_heartbeat(self, user_id: int) -> None:
+        now = _utcnow()
+        with self._lock:
+            self._pending_heartbeats[user_id] = now
+            self._last_seen[user_id] = now
+        self._ensure_started()
+
+    def record_usage(self, user_id: int, feature_type: str, details: str, pdf_filename: Optional[str] = None) -> None:
+        row = {
+            "user_id": user_id,
+            "timestamp": _utcnow(),
+            "feature_type": feature_type,
+            "details": details,
+            "pdf_filename": pdf_filename,
+        }
+        with self._lock:
+            self._pending_usage.append(row)
+            backlog = len(self._pending_usage)
+        self._ensure_started()
+        if backlog >= ACTIVITY_MAX_PENDING:
+            self._wakeup.set()
+
+    def active_since(self, cutoff: datetime) -> Dict[int, datetime]:
+        with self._lock:
+            # Forget users that dropped out of every window we care about
+            for user_id in [uid for uid, seen in self._last_seen.items() if seen < cutoff - timedelta(hours=1)]:
+                del self._last_seen[user_id]
+            return {uid: seen for uid, seen in self._last_seen.items() if seen >= cutoff}
+
+    def flush(self) -> None:
+        # One flush at a time, so a requeue can't reorder rows behind a concurrent flush
+        with self._flush_lock:
+            with self._lock:
+                heartbeats, self._pending_heartbeats = self._pending_heartbeats, {}
+                usage, self._pending_usage = self._pending_usage, []
+            if not heartbeats and not usage:
+                return
+            try:
+                with db_session() as session:
+                    if heartbeats:
+                        session.execute(
+                            _HEARTBEAT_UPDATE,
+                            [{"user_id": uid, "seen": seen} for uid, seen in heartbeats.items()],
+                        )
+                    if usage:
+                        session.execute(insert(FeatureUsage), usage)
+            except IntegrityError as exc:
+                # A bad row (e.g. a deleted user) must not keep the whole batch stuck
+                print(f"[Activity] Batch rejected, writing rows individually: {exc}")
+                self._flush_individually(heartbeats, usage)
+                return
+            except Exception as exc:
+                print(f"[Activity] Flush failed, will retry: {exc}")
+                self._requeue(heartbeats, usage)
+                return
+            print(f"[Activity] Flushed {len(heartbeats)} heartbeats, {len(usage)} usage events")
+
+    def _flush_individually(self, heartbeats: Dict[int, datetime], usage: List[Dict[str, Any]]) -> None:
+        for uid, seen in heartbeats.items():
+            try:
+                with db_session() as session:
+                    session.execute(_HEARTBEAT_UPDATE, [{"user_id": uid, "seen": seen}])
+            except Exception as exc:
+                print(f"[Activity] Dropping heartbeat for user {uid}: {exc}")
+        for row in usage:
+            try:
+                with db_session() as session:
+                    session.execute(insert(FeatureUsage), [row])
+            except Exception as exc:
+                print(f"[Activity] Dropping {row['feature_type']} event for user {row['user_id']}: {exc}")
+
+    def _requeue(self, heartbeats: Dict[int, datetime], usage: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            for uid, seen in heartbeats.items():
+                # Keep whichever heartbeat is newer
+                if uid not in self._pending_heartbeats or self._pending_heartbeats[uid] < seen:
+                    self._pending_heartbeats[uid] = seen
+            combined = usage + self._pending_usage
+            if len(combined) > ACTIVITY_MAX_BACKLOG:
+                dropped = len(combined) - ACTIVITY_MAX_BACKLOG
+                print(f"[Activity] Backlog full, dropping {dropped} oldest usage events")
+                combined = combined[dropped:]
+            self._pending_usage = combined
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def shutdown(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+        self.flush()
+
+
+activity_buffer = ActivityBuffer()
+atexit.register(activity_buffer.shutdown)
@@ -4,16 +4,13 @@ os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'  # Allow HTTPS and HTTP
 os.environ['OAUTHLIB_RELAX_TOKEN_SCOPE'] = '1'   # Allow scopes to change (e.g. if user granted more previously)
 
 import base64
-import csv
 import hashlib
-import io
 import json
 import secrets
-import time
 from datetime import datetime, timezone, timedelta
 from typing import Any, Dict, Optional
 
-from flask import Flask, request, jsonify, session, redirect, url_for, Response, stream_with_context
+from flask import Flask, request, jsonify, session, redirect, url_for, Response, send_file
 from flask_cors import CORS
 from flask_session import Session
 from dotenv import load_dotenv
@@ -22,18 +19,16 @@ import PyPDF2
 import requests
 from groq import Groq
 from openai import OpenAI
-from sqlalchemy import func
-from google.oauth2.credentials import Credentials as GoogleUserCredentials  # type: ignore[import-not-found]
-from google.auth.transport.requests import Request as GoogleAuthRequest  # type: ignore[import-not-found]
-from googleapiclient.discovery import build as gdrive_build  # type: ignore[import-not-found]
+from sqlalchemy import func, or_
 
 from db import init_db, db_session
 from models import DailyUploadStat, LoginEvent, PdfUpload, PhotoCaptureEvent, User, FeatureUsage, Note
 from services.google_drive import (
-    download_file,
     ensure_user_folder,
     ensure_subfolder,
     find_named_file,
+    build_drive_client,
+    credentials_of,
     get_drive_service,
     upload_pdf as drive_upload_pdf,
     upload_text_file,
@@ -41,7 +36,10 @@ from services.google_drive import (
     save_user_json,
     list_folder_files,
     read_text_file,
+    iter_file,
 )
+from services.drive_pool import drive_pool
+from services.user_drive import build_detached_client, user_drive_cache
 from services.location import lookup_location
 from utils import (
     decode_user_cookie,
@@ -58,18 +56,28 @@ from utils import (
     update_heartbeat,
     record_feature_usage,
     check_duplicate_pdf,
+    user_uploaded_pdf,
     get_active_users,
     update_streaming_state,
-    update_streaming_frame,
     get_streaming_state,
-    pop_streaming_command,
+    poll_streaming_state,
 )
 from ocr_helper import extract_text_from_pdf_stream
+from frame_bus import frame_bus
+from login_log import DEFAULT_LOGIN_CSV_NAME, LOGIN_CSV_HEADER, LOGIN_SEGMENT_FOLDER, build_login_row, enqueue_login_row
+from doc_index import build_document_index, chunk_text, get_text_index
+from doc_store import get_document, register_document
+from pdf_store import discard_pdf, pdf_path, spool_upload
+from text_cache import text_cache
+from page_cache import discard_document
+from jobs import job_queue
+from summarizer import condense
+from response_cache import RESPONSE_CACHE_ENABLED, make_key as make_response_key, response_cache
+from context_packer import context_budget, history_budget, pack_context, trim_history
+import file_proxy
+from llm_router import LLMRouter, Provider, extra_providers, router_client
 
 import traceback  # Import traceback module
-import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 
 # Define IST timezone
 IST = timezone(timedelta(hours=5, minutes=30))
@@ -97,6 +105,8 @@ DRIVE_ONLY_MODE = os.getenv('DRIVE_ONLY_MODE', 'false').lower() == 'true'
 DRIVE_USER_MODE = os.getenv('DRIVE_USER_MODE', 'false').lower() == 'true'
 ADMIN_EMAIL = os.getenv('ADMIN_EMAIL', '').lower().strip()
 print(f"[Config] ADMIN_EMAIL set to: '{ADMIN_EMAIL}'")
+# MJPEG viewers re-send the last frame this often when no new frame arrives
+STREAM_KEEPALIVE_SECONDS = float(os.getenv('STREAM_KEEPALIVE_SECONDS', '5'))
 
 # Detect environment
 IS_PRODUCTION = os.getenv('RENDER') == 'true' or os.getenv('RAILWAY_PUBLIC_DOMAIN') is not None or os.getenv('SPACE_ID') is not None
@@ -123,8 +133,8 @@ CORS(app,
          "http://127.0.0.1:3000"
      ],
      methods=["GET", "POST", "OPTIONS", "PUT", "DELETE"],
-     allow_headers=["Content-Type", "Authorization"],
-     expose_headers=["Content-Type", "Set-Cookie"],
+     allow_headers=["Content-Type", "Authorization", "Range"],
+     expose_headers=["Content-Type", "Set-Cookie", "Accept-Ranges", "Content-Range", "Content-Length"],
      max_age=3600
 )
 
@@ -232,66 +242,76 @@ if DEEPSEEK_API_KEY:
     except Exception as e:
         print(f"[Init] Failed to initialize DeepSeek client: {e}")
 
-# LLM Provider Selection
+# LLM Provider Selection: the preferred provider goes first, the others are failover targets
 LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'groq').lower()
 print(f"[Init] Selected LLM Provider: {LLM_PROVIDER}")
+_llm_providers = []
+if _groq_client:
+    _llm_providers.append(Provider('groq', router_client(_groq_client), GROQ_MODEL))
+if _deepseek_client:
+    _llm_providers.append(Provider('deepseek', router_client(_deepseek_client), DEEPSEEK_MODEL))
+_llm_providers.extend(extra_providers())
+llm_router = LLMRouter(_llm_providers, preferred=LLM_PROVIDER)
+print(f"[Init] LLM providers: {[p.key for p in _llm_providers]} (hedging: {llm_router.hedge})")
 
 # RAG Helper Functions
-def chunk_text(text, chunk_size=1000, overlap=200):
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunks.append(text[start:end])
-        start += (chunk_size - overlap)
-    return chunks
-
-def retrieve_relevant_chunks(query, text, top_k=3):
+# Chunks scoring below this fraction of the best chunk's score are left out of the prompt
+RAG_MIN_RELATIVE_SCORE = float(os.getenv('RAG_MIN_RELATIVE_SCORE', '0.2'))
+# Candidates ranked per query; the context packer keeps as many as fit its token budget
+RAG_CANDIDATES = int(os.getenv('RAG_CANDIDATES', '12'))
+
+
+def rank_chunks(query, text, top_k=RAG_CANDIDATES, doc_id=None):
+    """(chunk position, score) pairs, best first. Scores are 0.0 when retrieval fell back to the opening chunks."""
     if not text:
         return []
-    chunks = chunk_text(text)
-    if not chunks:
-        return []
-    
+
+    fallback = [(i, 0.0) for i in range(min(top_k, len(chunk_text(text))))]
     try:
-        vectorizer = TfidfVectorizer()
-        tfidf_matrix = vectorizer.fit_transform(chunks + [query])
-        # Scipy sparse matrices support slicing, but type checkers often miss this
-        cosine_sim = cosine_similarity(tfidf_matrix[-1], tfidf_matrix[:-1]) # type: ignore
-        
-        # Get top_k indices
-        related_docs_indices = cosine_sim.argsort()[0][-top_k:][::-1]
-        return [chunks[i] for i in related_docs_indices]
+        # Reuse the index fitted at upload time when the document is in the server-side store
+        document = get_document(doc_id)
+        index = document.index if document else get_text_index(text)
+        if index is None:
+            return fallback
+        return index.search(query, top_k=top_k)
     except Exception as e:
         print(f"[RAG] Error retrieving chunks: {e}")
-        # Fallback to returning first few chunks if vectorization fails
-        return chunks[:top_k]
+        # Fallback to the first few chunks if vectorization fails
+        return fallback
 
-# Unified chat helper: Groq or DeepSeek
 
-def llm_chat(messages, max_tokens=None, temperature=0.2, context_text=None):
-    client = None
-    model = None
-    
-    if LLM_PROVIDER == 'deepseek':
-        if not _deepseek_client:
-             raise RuntimeError("DEEPSEEK_API_KEY is not set on the server, but LLM_PROVIDER is 'deepseek'")
-        client = _deepseek_client
-        model = DEEPSEEK_MODEL
-    else:
-        if not _groq_client:
-            raise RuntimeError("GROQ_API_KEY is not set on the server")
-        client = _groq_client
-        model = GROQ_MODEL
-    
+def drop_low_relevance(ranked):
+    """Keep the best chunk plus any within RAG_MIN_RELATIVE_SCORE of it; unscored results are kept as is."""
+    if not ranked:
+        return []
+    best = ranked[0][1]
+    if best <= 0:
+        return list(ranked)
+    return [(position, score) for position, score in ranked if score >= best * RAG_MIN_RELATIVE_SCORE]
+
+
+def current_llm_model() -> str:
+    """Model of the preferred provider; failover may answer with another one."""
+    primary = llm_router.primary
+    if primary:
+        return primary.model
+    return DEEPSEEK_MODEL if LLM_PROVIDER == 'deepseek' else GROQ_MODEL
+
+# Unified chat helper: routed across Groq, DeepSeek and any extra OpenAI-compatible providers
+
+def _chat_request(messages, max_tokens, temperature, context_text, doc_id):
+    """Build completion kwargs (without the model), augmenting the last user message with RAG context."""
+    model = current_llm_model()
+
     # If context is provided, inject it into the system prompt or user message
     if context_text:
         # Check if the last message is from user
         if messages and messages[-1]['role'] == 'user':
             user_query = messages[-1]['content']
             
-            # Retrieve relevant chunks
-            relevant_chunks = retrieve_relevant_chunks(user_query, context_text)
+            # Rank chunks, then fill the model's context budget with the best of them
+            ranked = drop_low_relevance(rank_chunks(user_query, context_text, doc_id=doc_id))
+            relevant_chunks, context_tokens = pack_context(context_text, ranked, context_budget(model))
             context_str = "\n\n".join(relevant_chunks)
             
             # Augment the user query with context
@@ -303,19 +323,66 @@ Given the context information and not prior knowledge, answer the query.
 Query: {user_query}
 """
             messages[-1]['content'] = augmented_query
-            print(f"[RAG] Augmented query with {len(relevant_chunks)} chunks")
+            print(f"[RAG] Augmented query with {len(relevant_chunks)} passages (~{context_tokens} tokens)")
 
     # If max_tokens is not specified, let provider use its default (no limit)
     kwargs = {
-        "model": model,
         "messages": messages,
         "temperature": temperature
     }
     if max_tokens is not None:
         kwargs["max_tokens"] = max_tokens
-    
-    resp = client.chat.completions.create(**kwargs)
-    return resp.choices[0].message.content
+    return kwargs
+
+
+def llm_chat(messages, max_tokens=None, temperature=0.2, context_text=None, doc_id=None):
+    return llm_router.complete(_chat_request(messages, max_tokens, temperature, context_text, doc_id))
+
+
+def llm_answer(messages, max_tokens=None, temperature=0.2):
+    """Like llm_chat, but returns (text, model that answered) for caching under the right model."""
+    text, provider = llm_router.complete_with_provider(_chat_request(messages, max_tokens, temperature, None, None))
+    return text, provider.model
+
+
+def llm_chat_stream(messages, max_tokens=None, temperature=0.2, context_text=None, doc_id=None, on_model=None):
+    """
+    Like llm_chat, but yields the completion's text deltas as the provider produces them.
+    on_model(model) is called with the answering provider's model before the first delta.
+    """
+    kwargs = _chat_request(messages, max_tokens, temperature, context_text, doc_id)
+    on_provider = (lambda provider: on_model(provider.model)) if on_model else None
+    yield from llm_router.stream(kwargs, on_provider=on_provider)
+
+
+def ndjson_completion_response(deltas, on_complete=None, cached_text=None):
+    """
+    Stream a completion as NDJSON: {"delta": text} events, then {"done": true, "cached": bool},
+    or {"error": message}. deltas() is called lazily; on_complete(full_text) runs after the last token.
+    """
+    def generate():
+        if cached_text is not None:
+            yield json.dumps({"delta": cached_text}) + "\n"
+            yield json.dumps({"done": True, "cached": True}) + "\n"
+            return
+        parts = []
+        try:
+            for delta in deltas():
+                parts.append(delta)
+                yield json.dumps({"delta": delta}) + "\n"
+            if on_complete:
+                on_complete("".join(parts))
+        except Exception as exc:
+            print(f"[Stream] Completion failed: {exc}")
+            yield json.dumps({"error": str(exc)}) + "\n"
+            return
+        yield json.dumps({"done": True, "cached": False}) + "\n"
+
+    response = Response(generate(), mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Ask nginx-style proxies not to buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 # OAuth scopes (use full URIs to avoid scope-change warnings)
 SCOPES = [
@@ -334,30 +401,39 @@ def get_user_drive_service():
     if not creds_dict:
         return None
     try:
-        creds = GoogleUserCredentials(
-            token=creds_dict.get('token'),
-            refresh_token=creds_dict.get('refresh_token'),
-            token_uri=creds_dict.get('token_uri'),
-            client_id=creds_dict.get('client_id'),
-            client_secret=creds_dict.get('client_secret'),
-            scopes=creds_dict.get('scopes'),
-        )
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(GoogleAuthRequest())
-            session['google_creds'] = {
-                'token': creds.token,
-                'refresh_token': creds.refresh_token,
-                'token_uri': creds.token_uri,
-                'client_id': creds.client_id,
-                'client_secret': creds.client_secret,
-                'scopes': creds.scopes,
-            }
-        return gdrive_build('drive', 'v3', credentials=creds, cache_discovery=False)
+        # Cached per user and token; tokens are refreshed in the background, never on this thread
+        service, newer_creds = user_drive_cache.get(creds_dict)
+        if newer_creds:
+            session['google_creds'] = newer_creds
+        return service
     except Exception as exc:
         print(f"[Drive] Failed to build user drive service: {exc}")
         return None
 
 
+def user_drive_credentials(drive_service) -> Optional[Dict[str, Any]]:
+    """
+    The session's OAuth credentials when drive_service is the user's own client, else None.
+    Background work builds its own client from these; request-thread clients never leave the request.
+    """
+    if not DRIVE_USER_MODE or drive_service is None or drive_service is get_drive_service():
+        return None
+    creds_dict = session.get('google_creds')
+    return dict(creds_dict) if creds_dict else None
+
+
+def worker_drive_service(drive_credentials: Optional[Dict[str, Any]]):
+    """
+    Drive client for a background thread, built on that thread: the user's own client from
+    copied credentials, else a fresh service-account client. Never a request thread's client.
+    """
+    if drive_credentials:
+        return build_detached_client(drive_credentials)
+    service = get_drive_service()
+    credentials = credentials_of(service)
+    return build_drive_client(credentials) if credentials is not None else service
+
+
 def get_client_ip() -> Optional[str]:
     forwarded = request.headers.get('X-Forwarded-For', '')
     if forwarded:
@@ -495,170 +571,25 @@ def ensure_current_user() -> Optional[User]:
 
 def append_login_csv_if_possible(user: User, drive_service, location: Optional[Dict[str, Any]], ip_address: Optional[str], user_agent: Optional[str], photo_link: Optional[str] = None, event_type: str = "LOGIN") -> None:
     drive_folder_id = getattr(user, 'drive_folder_id', None)
-    login_csv_file_id = getattr(user, 'login_csv_file_id', None)
-    login_csv_file_name = getattr(user, 'login_csv_file_name', 'login_history.csv')
 
     if not drive_service or not drive_folder_id:
         print(f"[CSV] Skipping: drive_service={'Yes' if drive_service else 'No'}, drive_folder_id={drive_folder_id}")
         return
 
-    # Try to find existing file if ID is missing (common in Drive-only mode)
-    if not login_csv_file_id:
-        found = find_named_file(drive_service, drive_folder_id, login_csv_file_name)
-        if found:
-            login_csv_file_id = found['id']
-
-    existing_content = ""
-    if login_csv_file_id:
-        try:
-            existing_bytes = download_file(drive_service, login_csv_file_id)
-            existing_content = existing_bytes.decode('utf-8')
-        except Exception as exc:
-            print(f"[Drive] Failed to download login CSV: {exc}")
-            existing_content = ""
-
-    rows = []
-    header = []
-    
-    # Define IST timezone
-    IST = timezone(timedelta(hours=5, minutes=30))
-    
-    if existing_content:
-        reader = csv.reader(existing_content.splitlines())
-        rows = list(reader)
-        if rows:
-            header = rows[0]
-            
-            # Check if we need to migrate from 'timestamp' to 'date, time'
-            if 'timestamp' in header:
-                print("[CSV] Migrating CSV from timestamp to date/time format...")
-                try:
-                    timestamp_idx = header.index('timestamp')
-                    # Create new header
-                    new_header = ['date', 'time'] + [h for h in header if h != 'timestamp']
-                    
-                    new_rows = [new_header]
-                    for row in rows[1:]:
-                        if len(row) <= timestamp_idx:
-                            continue
-                            
-                        ts_str = row[timestamp_idx]
-                        date_str = ""
-                        time_str = ""
-                        
-                        # Try to parse timestamp
-                        try:
-                            if ts_str:
-                                dt = datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
-                                dt_ist = dt.astimezone(IST)
-                                date_str = dt_ist.strftime('%Y-%m-%d')
-                                time_str = dt_ist.strftime('%H:%M:%S')
-                        except Exception as e:
-                            print(f"[CSV] Failed to parse timestamp {ts_str}: {e}")
-                            
-                        # Construct new row
-                        new_row = [date_str, time_str] + [val for i, val in enumerate(row) if i != timestamp_idx]
-                        new_rows.append(new_row)
-                    
-                    # Replace rows and header with migrated version
-                    rows = new_rows
-                    header = new_header
-                except Exception as e:
-                    print(f"[CSV] Migration failed: {e}")
-                    # Fallback: just append to old format if migration fails? 
-                    # Or better, proceed and let the new row logic handle it (it will use new header logic)
-                    pass
-
-    # Define default header for new files (or if migration happened)
-    if not rows or (rows and 'date' not in rows[0]):
-        header = [
-            'date',
-            'time',
-            'event_type',
-            'ip',
-            'city',
-            'region',
-            'country',
-            'google_maps_link',
-            'timezone',
-            'user_agent',
-            'photo_link'
-        ]
-        rows = [header]
-    else:
-        header = rows[0]
-
-    loc = extract_location_for_csv(location)
-    lat = loc.get('latitude', '')
-    lon = loc.get('longitude', '')
-    
-    maps_link = ""
-    if lat and lon:
-        maps_link = f"https://www.google.com/maps?q={lat},{lon}"
-
-    # Helper to get value for a column
-    def get_col_value(col_name: str) -> str:
-        now_ist = datetime.now(IST)
-        
-        if col_name == 'date':
-            return now_ist.strftime('%Y-%m-%d')
-        if col_name == 'time':
-            return now_ist.strftime('%H:%M:%S')
-        if col_name == 'timestamp':
-            # Fallback for old files if migration failed
-            return now_ist.isoformat()
-        if col_name == 'event_type':
-            return event_type
-        if col_name == 'ip':
-            return ip_address or ''
-        if col_name == 'city':
-            return loc.get('city', '')
-        if col_name == 'region':
-            return loc.get('region', '')
-        if col_name == 'country':
-            return loc.get('country', '')
-        if col_name == 'google_maps_link':
-            return maps_link
-        if col_name == 'latitude':
-            return maps_link
-        if col_name == 'longitude':
-            return ""
-        if col_name == 'timezone':
-            return loc.get('timezone', '')
-        if col_name == 'user_agent':
-            return (user_agent or '').replace('\n', ' ')
-        if col_name == 'photo_link':
-            return photo_link or ''
-        return ''
-
-    # Construct the new row based on the ACTUAL header of the file
-    new_row = [get_col_value(col) for col in header]
-    rows.append(new_row)
-
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerows(rows)
-
+    row = build_login_row(extract_location_for_csv(location), ip_address, user_agent, photo_link, event_type)
+    user_id = getattr(user, 'id', None)
     try:
-        print(f"[CSV] Uploading CSV to {drive_folder_id} (ID: {login_csv_file_id or 'New'})")
-        metadata = upload_text_file(
-            drive_service,
+        # Journalled locally; the login log flusher appends it to Drive in batches
+        enqueue_login_row(
+            user_drive_credentials(drive_service),
             drive_folder_id,
-            login_csv_file_name,
-            output.getvalue(),
-            existing_file_id=login_csv_file_id,
+            row,
+            user_id=user_id if isinstance(user_id, int) and not DRIVE_ONLY_MODE else None,
+            csv_file_id=getattr(user, 'login_csv_file_id', None),
+            csv_file_name=getattr(user, 'login_csv_file_name', None) or DEFAULT_LOGIN_CSV_NAME,
         )
-        if DRIVE_ONLY_MODE:
-            pass  # No DB to update
-        else:
-            user_id = getattr(user, 'id', None)
-            file_id = metadata.get('id') if metadata else None
-            if isinstance(user_id, int) and isinstance(file_id, str):
-                update_login_csv_metadata(user_id, file_id, metadata.get('webViewLink'))
     except Exception as exc:
-        print(f"[Drive] Failed to upload login CSV: {exc}")
-        import traceback
-        traceback.print_exc()
+        print(f"[CSV] Failed to queue login row: {exc}")
 
 
 @app.route('/api/login-verification', methods=['POST'])
@@ -806,7 +737,7 @@ def admin_repair_login_csv():
         if found:
             existing_id = found['id']
 
-    csv_content = 'timestamp,event_type,ip,city,region,country,google_maps_link,timezone,user_agent,photo_link\n'
+    csv_content = ','.join(LOGIN_CSV_HEADER) + '\n'
     try:
         metadata = upload_text_file(
             drive_service,
@@ -878,114 +809,110 @@ def require_admin() -> Optional[User]:
     return user
 
 
-def build_admin_user_payloads() -> Dict[str, Any]:
-    users_payload = []
-    total_uploads = 0
-    total_users = 0
+def build_admin_totals() -> Dict[str, int]:
+    with db_session() as session:
+        total_users = session.query(func.count(User.id)).scalar() or 0
+        total_uploads = session.query(func.count(PdfUpload.id)).scalar() or 0
+    return {
+        "totalUsers": int(total_users),
+        "totalUploads": int(total_uploads),
+    }
 
-    # Get drive service for direct photo lookup
-    drive_service = get_drive_service()
+
+def build_admin_user_payloads(limit: Optional[int] = None, offset: int = 0) -> Dict[str, Any]:
+    """
+    Admin user listing in a fixed number of queries regardless of user count:
+    one page of users, grouped upload counts, a windowed query for each user's
+    30 most recent daily stats and a windowed query for each user's latest photo.
+    """
+    users_payload = []
 
     with db_session() as session:
-        users = session.query(User).order_by(User.created_at.desc()).all()
-        for user in users:
-            user_id = getattr(user, 'id', None)
-            if not isinstance(user_id, int):
-                continue
+        users_query = session.query(User).order_by(User.created_at.desc(), User.id.desc())
+        if offset:
+            users_query = users_query.offset(offset)
+        if limit is not None:
+            users_query = users_query.limit(limit)
+        users = users_query.all()
+
+        # Only restrict the aggregates to the page's ids when paginating (keeps the IN list bounded)
+        user_ids = [user.id for user in users]
+        paginated = limit is not None or bool(offset)
+
+        def for_page(query, column):
+            return query.filter(column.in_(user_ids)) if paginated else query
+
+        upload_counts: Dict[int, int] = {}
+        daily_stats_by_user: Dict[int, Dict[str, int]] = {}
+        photo_by_user: Dict[int, Any] = {}
+
+        if user_ids:
+            count_rows = for_page(
+                session.query(PdfUpload.user_id, func.count(PdfUpload.id)),
+                PdfUpload.user_id,
+            ).group_by(PdfUpload.user_id).all()
+            upload_counts = {user_id: int(count or 0) for user_id, count in count_rows}
+
+            ranked_stats = for_page(
+                session.query(
+                    DailyUploadStat.user_id.label('user_id'),
+                    DailyUploadStat.date.label('date'),
+                    DailyUploadStat.upload_count.label('upload_count'),
+                    func.row_number().over(
+                        partition_by=DailyUploadStat.user_id,
+                        order_by=DailyUploadStat.date.desc(),
+                    ).label('rn'),
+                ),
+                DailyUploadStat.user_id,
+            ).subquery()
+            stats_rows = session.query(ranked_stats).filter(ranked_stats.c.rn <= 30).all()
+            for row in stats_rows:
+                if row.date:
+                    daily_stats_by_user.setdefault(row.user_id, {})[row.date.isoformat()] = int(row.upload_count or 0)
+
+            ranked_photos = for_page(
+                session.query(
+                    PhotoCaptureEvent.user_id.label('user_id'),
+                    PhotoCaptureEvent.drive_file_id.label('drive_file_id'),
+                    PhotoCaptureEvent.drive_web_view_link.label('drive_web_view_link'),
+                    func.row_number().over(
+                        partition_by=PhotoCaptureEvent.user_id,
+                        order_by=(PhotoCaptureEvent.captured_at.desc(), PhotoCaptureEvent.id.desc()),
+                    ).label('rn'),
+                )
+                # Live recordings are logged as captures too; the admin view shows the latest photo
+                .filter(or_(PhotoCaptureEvent.context.is_(None), PhotoCaptureEvent.context != 'live_video')),
+                PhotoCaptureEvent.user_id,
+            ).subquery()
+            photo_rows = session.query(ranked_photos).filter(ranked_photos.c.rn == 1).all()
+            photo_by_user = {row.user_id: row for row in photo_rows}
 
-            uploads_count = (
-                session.query(func.count(PdfUpload.id))
-                .filter(PdfUpload.user_id == user_id)
-                .scalar()
-            ) or 0
-            total_uploads += uploads_count
-            total_users += 1
-
-            daily_stats_rows = (
-                session.query(DailyUploadStat)
-                .filter(DailyUploadStat.user_id == user_id)
-                .order_by(DailyUploadStat.date.desc())
-                .limit(30)
-                .all()
-            )
-            daily_stats: Dict[str, int] = {}
-            for row in daily_stats_rows:
-                date_value = getattr(row, 'date', None)
-                count_value = getattr(row, 'upload_count', 0)
-                if date_value:
-                    daily_stats[date_value.isoformat()] = int(count_value or 0)
-
-            # Fetch last photo link
+        for user in users:
+            user_id = user.id
             last_photo_link = None
-            
-            # 1. Try to fetch latest photo directly from Drive (Photos or Captures/Photos)
-            if drive_service:
-                try:
-                    drive_folder_id = getattr(user, 'drive_folder_id', None)
-                    if drive_folder_id:
-                        candidates = []
-                        
-                        # Check "Photos" folder (Login verifications)
-                        photos_folder = find_named_file(drive_service, drive_folder_id, "Photos")
-                        if photos_folder:
-                            p_files = list_folder_files(drive_service, photos_folder['id'], page_size=1).get('files', [])
-                            if p_files:
-                                candidates.append(p_files[0])
-                                
-                        # Check "Captures" -> "Photos" (Live captures)
-                        captures_folder = find_named_file(drive_service, drive_folder_id, "Captures")
-                        if captures_folder:
-                            c_photos_folder = find_named_file(drive_service, captures_folder['id'], "Photos")
-                            if c_photos_folder:
-                                c_files = list_folder_files(drive_service, c_photos_folder['id'], page_size=1).get('files', [])
-                                if c_files:
-                                    candidates.append(c_files[0])
-                        
-                        # Pick the latest one
-                        if candidates:
-                            # Sort by modifiedTime desc
-                            candidates.sort(key=lambda x: x.get('modifiedTime', ''), reverse=True)
-                            latest = candidates[0]
-                            
-                            if latest.get('id'):
-                                last_photo_link = f"{BACKEND_URL}/api/admin/file/proxy/{latest['id']}"
-                            else:
-                                last_photo_link = latest.get('webViewLink')
-                                
-                except Exception as e:
-                    print(f"[DEBUG] Drive photo fetch failed for user {user_id}: {e}")
-
-            # 2. Fallback to DB if Drive didn't yield anything
-            if not last_photo_link:
-                try:
-                    photo = (
-                        session.query(PhotoCaptureEvent)
-                        .filter(PhotoCaptureEvent.user_id == user_id)
-                        .order_by(PhotoCaptureEvent.captured_at.desc())
-                        .first()
-                    )
-                    if photo:
-                        # Use proxy endpoint if file ID is available
-                        file_id = getattr(photo, 'drive_file_id', None)
-                        print(f"[DEBUG] User {user_id} last photo: ID={file_id}, Link={getattr(photo, 'drive_web_view_link', 'None')}")
-                        if file_id:
-                            last_photo_link = f"{BACKEND_URL}/api/admin/file/proxy/{file_id}"
-                        else:
-                            last_photo_link = getattr(photo, 'drive_web_view_link', None)
-                    else:
-                        print(f"[DEBUG] User {user_id} has no photos")
-                except Exception as e:
-                    print(f"[DEBUG] Error fetching photo for user {user_id}: {e}")
-                    pass
+            photo = photo_by_user.get(user_id)
+            if photo is not None:
+                # Use proxy endpoint if file ID is available
+                if photo.drive_file_id:
+                    last_photo_link = f"{BACKEND_URL}/api/admin/file/proxy/{photo.drive_file_id}"
+                else:
+                    last_photo_link = photo.drive_web_view_link
 
             session.expunge(user)
-            users_payload.append(serialize_user_for_admin(user, daily_stats, uploads_count, last_photo_link))
+            users_payload.append(serialize_user_for_admin(
+                user,
+                daily_stats_by_user.get(user_id, {}),
+                upload_counts.get(user_id, 0),
+                last_photo_link,
+            ))
 
     return {
         "users": users_payload,
-        "summary": {
-            "totalUsers": total_users,
-            "totalUploads": total_uploads,
+        "summary": build_admin_totals(),
+        "pagination": {
+            "limit": limit,
+            "offset": offset,
+            "returned": len(users_payload),
         },
     }
 
@@ -1060,8 +987,7 @@ def heartbeat():
         update_heartbeat(user_id)
         
         # Check for streaming command (and clear it if present)
-        command = pop_streaming_command(user_id)
-        stream_state = get_streaming_state(user_id)
+        command, stream_state = poll_streaming_state(user_id)
         
         if command:
             return jsonify({
@@ -1129,6 +1055,8 @@ def admin_stream_control():
         update_streaming_state(user_id, True, facing_mode)
     elif action == 'stop':
         update_streaming_state(user_id, False)
+        # Drop the last frame so viewers don't keep showing a stopped stream
+        frame_bus.clear(int(user_id))
     elif action == 'switch':
         # Toggle facing mode
         current = get_streaming_state(user_id)
@@ -1188,14 +1116,13 @@ def upload_capture():
         filename = f"{capture_type}_{timestamp}.{ext}"
         mimetype = 'image/png' if capture_type == 'photo' else 'video/webm'
         
-        file_bytes = file.read()
-        
         print(f"[Capture] Uploading {capture_type} to {target_folder['id']}")
+        # Stream from the spooled upload; large recordings go up in resumable chunks
         metadata = drive_upload_pdf(
             drive_service,
             target_folder['id'],
             filename,
-            file_bytes,
+            file.stream,
             mimetype=mimetype,
         )
         
@@ -1247,7 +1174,8 @@ def stream_upload():
     if not frame_data:
         return jsonify({"error": "No data"}), 400
         
-    update_streaming_frame(user_id, frame_data)
+    # Frames only go to the in-process bus; the DB keeps just the stream state
+    frame_bus.publish(user_id, frame_data)
     return jsonify({"status": "ok"})
 
 
@@ -1260,34 +1188,25 @@ def stream_view(user_id: int):
     if not admin:
         return jsonify({"error": "Forbidden"}), 403
         
-    state = get_streaming_state(user_id)
-    if not state or not state.get('lastFrame'):
-        # Return placeholder or 404
+    if frame_bus.latest(user_id) is None:
         return "No stream available", 404
-        
-    # Return the last frame as an image
-    # For MJPEG, we would need a generator loop.
-    # Since the frontend sets src to this URL, it expects an image.
-    # If we want live video, we should use multipart/x-mixed-replace.
-    
-    # Let's try to implement MJPEG stream
+
     def generate():
-        while True:
-            current_state = get_streaming_state(user_id)
-            if not current_state or not current_state.get('lastFrame'):
-                time.sleep(0.1)
-                continue
-                
-            frame_b64 = current_state['lastFrame']
-            try:
-                frame_bytes = base64.b64decode(frame_b64)
+        last_seq = 0
+        last_frame = b''
+        # One subscription for the whole view; closed when the client disconnects
+        with frame_bus.subscribe(user_id) as frames:
+            while True:
+                # Viewers sleep on the bus until the uploader publishes a newer frame
+                current = frames.wait(last_seq, timeout=STREAM_KEEPALIVE_SECONDS)
+                if current is not None:
+                    last_seq, last_frame = current
+                elif not last_frame:
+                    continue
+                # On timeout the previous frame is re-sent, which also notices closed connections
                 yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            except Exception:
-                pass
-            
-            time.sleep(0.05) # Limit to ~20fps check
-            
+                       b'Content-Type: image/jpeg\r\n\r\n' + last_frame + b'\r\n')
+
     return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 
@@ -1676,6 +1595,7 @@ def google_callback():
                     'client_id': credentials.client_id,
                     'client_secret': credentials.client_secret,
                     'scopes': credentials.scopes,
+                    'expiry': credentials.expiry.isoformat() if getattr(credentials, 'expiry', None) else None,
                 }
                 print('[CALLBACK] Stored user OAuth Drive credentials in session')
             except Exception as exc:
@@ -1750,6 +1670,180 @@ def logout():
     return response
 
 # ------------------------- PDF Processing -------------------------
+def run_pdf_extraction(pdf_file_path: str, sha_hash: str, size_bytes: int, filename: str, user, open_drive_service, drive_folder_id: Optional[str]):
+    """
+    Extraction, caching, indexing and Drive/DB bookkeeping for one uploaded PDF.
+    Runs on the job queue; yields the progress events clients read from /api/jobs/<id>.
+    open_drive_service() builds the job's own Drive client (or returns None) on the worker thread.
+    """
+    try:
+        drive_service = open_drive_service()
+    except Exception as exc:
+        print(f"[Drive] Could not build a Drive client for the extraction job: {exc}")
+        drive_service = None
+
+    # Initial status
+    yield {"status": "progress", "percent": 0, "message": "Uploading PDF to internet..."}
+
+    text_cache_upload = None
+    try:
+        # Content-addressed text cache: local disk, then the shared DB tier, then the user's Drive TextCache
+        yield {"status": "progress", "percent": 5, "message": "Checking for cached text..."}
+        drive_lookup = None
+        if drive_service and drive_folder_id:
+            drive_lookup = lambda sha: read_drive_text_cache(drive_service, drive_folder_id, sha)
+        cached_text = text_cache.get(sha_hash, fallback=drive_lookup)
+        if cached_text:
+            print(f"[Cache] Hit for {filename} ({sha_hash})")
+
+        text = ""
+        if cached_text:
+            text = cached_text
+            yield {"status": "progress", "percent": 80, "message": "Loaded text from cache."}
+        else:
+            yield {"status": "progress", "percent": 15, "message": "Processing the type of PDF..."}
+
+            # Extract text (with OCR fallback)
+            try:
+                # Pass _groq_client for Vision LLM fallback
+                # extract_text_from_pdf_stream is now a generator
+                for update in extract_text_from_pdf_stream(pdf_file_path, groq_client=_groq_client, doc_sha=sha_hash):
+                    if update["status"] == "progress":
+                        yield update
+                    elif update["status"] == "complete":
+                        text = update["text"]
+                    elif update["status"] == "error":
+                        print(f"[PDF] Extraction error: {update['message']}")
+                        # Don't fail completely, try fallback
+                        break
+            except Exception as e:
+                print(f"[PDF] Extraction failed: {e}")
+                # Fallback to basic extraction if helper fails
+                with open(pdf_file_path, 'rb') as pdf_stream:
+                    reader = PyPDF2.PdfReader(pdf_stream)
+                    text_parts = []
+                    for page in reader.pages:
+                        text_parts.append(page.extract_text() or "")
+                    text = "\n".join(text_parts)
+            
+            # Save to Cache
+            if text:
+                yield {"status": "progress", "percent": 90, "message": "Caching extracted text..."}
+                text_cache.put(sha_hash, text)
+                # The full text is cached now; per-page OCR results were only needed to resume
+                discard_document(sha_hash)
+                # Without a database the per-user Drive TextCache is the only shared tier.
+                # The write runs on the Drive pool, alongside the PDF upload below.
+                if DRIVE_ONLY_MODE and drive_service and drive_folder_id:
+                    text_cache_upload = drive_pool.submit(drive_service, write_drive_text_cache, drive_folder_id, sha_hash, text)
+
+        # Register the text server-side so AI endpoints can be called with just the doc_id,
+        # and fit the chat retrieval index once per document instead of on every chat turn
+        if text:
+            yield {"status": "progress", "percent": 92, "message": "Indexing document for chat..."}
+            register_document(sha_hash, text, filename)
+            build_document_index(sha_hash, text)
+
+        yield {"status": "progress", "percent": 95, "message": "Finalizing upload..."}
+        
+        # The book viewer (pdf.js) fetches the original PDF by range from this URL
+        pdf_url = f"/api/pdf/{sha_hash}"
+
+        # Check for duplicates (DB mode only)
+        if not DRIVE_ONLY_MODE:
+            duplicate = check_duplicate_pdf(sha_hash)
+            if duplicate:
+                # If duplicate found, return existing info
+                print(f"[PDF] Duplicate found: {duplicate.filename}")
+                yield {
+                    "status": "success",
+                    "message": "Duplicate PDF found. Using existing file.",
+                    "is_duplicate": True,
+                    "text_length": len(text),
+                    "pdf_text": text,
+                    "pdf_url": pdf_url,
+                    "doc_id": sha_hash,
+                    "drive_file_id": duplicate.drive_file_id,
+                    "drive_web_view_link": duplicate.drive_web_view_link,
+                }
+                return
+
+        drive_metadata: Optional[Dict[str, Any]] = None
+        if DRIVE_ONLY_MODE and (not drive_service or not drive_folder_id):
+            discard_pdf(pdf_file_path)
+            yield {
+                "error": "Drive integration not configured",
+                "details": {
+                    "serviceReady": bool(drive_service is not None),
+                    "driveFolderId": drive_folder_id,
+                }
+            }
+            return
+
+        if drive_service and drive_folder_id:
+            try:
+                # Ensure PDFs subfolder
+                pdfs_folder = ensure_subfolder(drive_service, drive_folder_id, "PDFs")
+                target_folder_id = pdfs_folder['id']
+
+                print(f"[Drive] Uploading to folder: {target_folder_id}")
+                with open(pdf_file_path, 'rb') as pdf_handle:
+                    drive_metadata = drive_upload_pdf(
+                        drive_service,
+                        target_folder_id,
+                        filename,
+                        pdf_handle,
+                    )
+                print(f"[Drive] Uploaded PDF {filename} -> {drive_metadata.get('id')}")
+            except Exception as exc:
+                print(f"[Drive] Failed to upload PDF: {exc}")
+                if DRIVE_ONLY_MODE:
+                    discard_pdf(pdf_file_path)
+                    yield {"error": f"Drive upload failed: {exc}"}
+                    return
+
+        user_id = getattr(user, 'id', None)
+        if isinstance(user_id, int):
+            try:
+                record_pdf_upload(
+                    user,
+                    filename,
+                    drive_metadata or {},
+                    sha_hash,
+                    size_bytes,
+                )
+            except Exception as exc:
+                print(f"[DB] Failed to record PDF upload: {exc}")
+        
+        if text_cache_upload is not None:
+            try:
+                text_cache_upload.result()
+                print(f"[Cache] Saved text for {filename}")
+            except Exception as e:
+                print(f"[Cache] Failed to save text: {e}")
+
+        print(f"[PDF] Uploaded PDF: {len(text)} characters")
+        
+        yield {"status": "progress", "percent": 100, "message": "Upload successful!"}
+        
+        yield {
+            "status": "success",
+            "message": "PDF uploaded successfully", 
+            "text_length": len(text),
+            "pdf_text": text,  # Send text to frontend
+            "pdf_url": pdf_url,  # Range-capable download for the book viewer
+            "doc_id": sha_hash,  # Key of the server-side retrieval index
+            "drive_file_id": (drive_metadata or {}).get('id'),
+            "drive_web_view_link": (drive_metadata or {}).get('webViewLink'),
+        }
+        
+    except Exception as e:
+        print(f"[ERROR] PDF upload failed: {e}")
+        # Failed jobs don't leave their spooled PDF for eviction to find
+        discard_pdf(pdf_file_path)
+        yield {"error": f"Failed to read PDF: {str(e)}"}
+
+
 @app.route('/api/upload-pdf', methods=['POST'])
 def upload_pdf():
     if 'file' not in request.files:
@@ -1762,195 +1856,143 @@ def upload_pdf():
     if not file.filename.lower().endswith('.pdf'):  # type: ignore
         return jsonify({"error": "Invalid file type"}), 400
 
-    # Read file into memory to allow streaming response
-    file_bytes = file.read()
-    if not file_bytes:
+    # Before spooling: nothing from an anonymous request reaches the PDF store
+    user_info = decode_user_cookie()
+    if not user_info:
+        return jsonify({"error": "Authentication required"}), 401
+
+    # Spool to disk (hashing as we go) so the PDF is never held in memory as a whole
+    try:
+        pdf_file_path, sha_hash, size_bytes = spool_upload(file.stream)
+    except Exception as e:
+        print(f"[ERROR] Failed to spool upload: {e}")
+        return jsonify({"error": f"Failed to read PDF: {str(e)}"}), 500
+    if not size_bytes:
+        discard_pdf(pdf_file_path)
         return jsonify({"error": "Empty file"}), 400
         
     filename = file.filename or 'uploaded.pdf'
 
+    # Drive credentials may come from the session, so resolve them while the request is still here
+    user, drive_service, folder_info = ensure_user_context(user_info)
+    if folder_info and folder_info.get('id'):
+        drive_folder_id = folder_info['id']
+    else:
+        drive_folder_id = getattr(user, 'drive_folder_id', None)
+
+    # The request's Drive client is thread-local, so the job builds its own from the credentials
+    drive_credentials = user_drive_credentials(drive_service)
+
+    def open_drive_service():
+        return worker_drive_service(drive_credentials) if drive_service is not None else None
+
+    # Extraction runs on the job queue so OCR never holds a request thread; the client follows
+    # the job's events and the job keeps going if the client disconnects
+    job = job_queue.submit(
+        "pdf_extraction",
+        user_info.get('email'),
+        lambda: run_pdf_extraction(pdf_file_path, sha_hash, size_bytes, filename, user, open_drive_service, drive_folder_id),
+    )
+    session['pdf_doc_id'] = sha_hash
+    remember_session_pdf(sha_hash)
+
+    return jsonify({
+        "job_id": job.id,
+        "doc_id": sha_hash,
+        "status_url": f"/api/jobs/{job.id}",
+        "events_url": f"/api/jobs/{job.id}/events",
+    }), 202
+
+
+def get_owned_job(job_id: str):
+    """The job if it exists and belongs to the cookie's user, else an error response tuple."""
+    user_info = decode_user_cookie()
+    if not user_info:
+        return None, (jsonify({"error": "Authentication required"}), 401)
+    job = job_queue.get(job_id)
+    if job is None or job.owner != user_info.get('email'):
+        return None, (jsonify({"error": "Job not found"}), 404)
+    return job, None
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id: str):
+    """
+    Poll a job. ?after=N returns only events from index N on (use the previous "next");
+    ?wait=S holds the request up to S seconds (max 10) until a new event arrives.
+    """
+    job, error = get_owned_job(job_id)
+    if error:
+        return error
+    after = max(0, request.args.get('after', default=0, type=int))
+    wait_seconds = min(max(0.0, request.args.get('wait', default=0, type=float)), 10.0)
+    if wait_seconds:
+        job.events_after(after, timeout=wait_seconds)
+    return jsonify(job.snapshot(after))
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id: str):
+    """Stream a job's events as NDJSON until it finishes. Reconnect with ?after=N to resume."""
+    job, error = get_owned_job(job_id)
+    if error:
+        return error
+    after = max(0, request.args.get('after', default=0, type=int))
+
     def generate():
-        # Initial status
-        yield json.dumps({"status": "progress", "percent": 0, "message": "Uploading PDF to internet..."}) + "\n"
-        
-        try:
-            # Context setup
-            user_info = decode_user_cookie()
-            if not user_info:
-                yield json.dumps({"error": "Authentication required"}) + "\n"
+        position = after
+        while True:
+            events, done = job.events_after(position, timeout=STREAM_KEEPALIVE_SECONDS)
+            for event in events:
+                yield json.dumps(event) + "\n"
+            position += len(events)
+            if done and not events:
                 return
+            if not events:
+                # Keep-alive so proxies don't drop an idle stream during long OCR pages
+                yield "\n"
 
-            user, drive_service, folder_info = ensure_user_context(user_info)
-            drive_folder_id = None
-            if folder_info and folder_info.get('id'):
-                drive_folder_id = folder_info['id']
-            else:
-                drive_folder_id = getattr(user, 'drive_folder_id', None)
+    return Response(generate(), mimetype='application/x-ndjson')
 
-            # Calculate hash early for cache lookup
-            sha_hash = hashlib.sha256(file_bytes).hexdigest()
-            
-            # Check Drive Cache
-            cached_text = None
-            if drive_service and drive_folder_id:
-                try:
-                    yield json.dumps({"status": "progress", "percent": 5, "message": "Checking for cached text..."}) + "\n"
-                    # Ensure TextCache folder exists
-                    cache_folder = ensure_subfolder(drive_service, drive_folder_id, "TextCache")
-                    cache_filename = f"{sha_hash}.txt"
-                    
-                    # Check if file exists
-                    cached_file = find_named_file(drive_service, cache_folder['id'], cache_filename)
-                    
-                    if cached_file:
-                        yield json.dumps({"status": "progress", "percent": 10, "message": "Found cached text! Downloading..."}) + "\n"
-                        cached_text = read_text_file(drive_service, cached_file['id'])
-                        print(f"[Cache] Hit for {filename} ({sha_hash})")
-                except Exception as e:
-                    print(f"[Cache] Error checking cache: {e}")
-
-            text = ""
-            if cached_text:
-                text = cached_text
-                yield json.dumps({"status": "progress", "percent": 80, "message": "Loaded text from cache."}) + "\n"
-            else:
-                yield json.dumps({"status": "progress", "percent": 15, "message": "Processing the type of PDF..."}) + "\n"
-
-                # Extract text (with OCR fallback)
-                try:
-                    # Pass _groq_client for Vision LLM fallback
-                    # extract_text_from_pdf_stream is now a generator
-                    for update in extract_text_from_pdf_stream(file_bytes, groq_client=_groq_client):
-                        if update["status"] == "progress":
-                            yield json.dumps(update) + "\n"
-                        elif update["status"] == "complete":
-                            text = update["text"]
-                        elif update["status"] == "error":
-                            print(f"[PDF] Extraction error: {update['message']}")
-                            # Don't fail completely, try fallback
-                            break
-                except Exception as e:
-                    print(f"[PDF] Extraction failed: {e}")
-                    # Fallback to basic extraction if helper fails
-                    pdf_stream = io.BytesIO(file_bytes)
-                    reader = PyPDF2.PdfReader(pdf_stream)
-                    text_parts = []
-                    for page in reader.pages:
-                        text_parts.append(page.extract_text() or "")
-                    text = "\n".join(text_parts)
-                
-                # Save to Cache
-                if text and drive_service and drive_folder_id:
-                    try:
-                        yield json.dumps({"status": "progress", "percent": 90, "message": "Caching extracted text..."}) + "\n"
-                        cache_folder = ensure_subfolder(drive_service, drive_folder_id, "TextCache")
-                        cache_filename = f"{sha_hash}.txt"
-                        upload_text_file(
-                            drive_service, 
-                            cache_folder['id'], 
-                            cache_filename, 
-                            text, 
-                            mimetype="text/plain"
-                        )
-                        print(f"[Cache] Saved text for {filename}")
-                    except Exception as e:
-                        print(f"[Cache] Failed to save text: {e}")
 
-            # Store in server-side session as backup
-            # Note: This might not persist if headers are already sent and session cookie needs update
-            # But usually session ID is stable.
-            session['pdf_text'] = text
-            
-            yield json.dumps({"status": "progress", "percent": 95, "message": "Finalizing upload..."}) + "\n"
-            
-            # Return the original PDF bytes for the book viewer (required for pdf.js)
-            pdf_b64 = base64.b64encode(file_bytes).decode('utf-8')
-
-            # sha_hash is already calculated above
-
-            # Check for duplicates (DB mode only)
-            if not DRIVE_ONLY_MODE:
-                duplicate = check_duplicate_pdf(sha_hash)
-                if duplicate:
-                    # If duplicate found, return existing info
-                    print(f"[PDF] Duplicate found: {duplicate.filename}")
-                    yield json.dumps({
-                        "status": "success",
-                        "message": "Duplicate PDF found. Using existing file.",
-                        "is_duplicate": True,
-                        "text_length": len(text),
-                        "pdf_text": text,
-                        "pdf_base64": pdf_b64,
-                        "drive_file_id": duplicate.drive_file_id,
-                        "drive_web_view_link": duplicate.drive_web_view_link,
-                    }) + "\n"
-                    return
+# PDFs uploaded in this session that /api/pdf serves without a database lookup
+SESSION_PDF_LIMIT = 20
 
-            size_bytes = len(file_bytes)
 
-            drive_metadata: Optional[Dict[str, Any]] = None
-            if DRIVE_ONLY_MODE and (not drive_service or not drive_folder_id):
-                yield json.dumps({
-                    "error": "Drive integration not configured",
-                    "details": {
-                        "serviceReady": bool(drive_service is not None),
-                        "driveFolderId": drive_folder_id,
-                    }
-                }) + "\n"
-                return
+def remember_session_pdf(sha_hash: str) -> None:
+    recent = [doc for doc in session.get('pdf_doc_ids', []) if doc != sha_hash]
+    session['pdf_doc_ids'] = (recent + [sha_hash])[-SESSION_PDF_LIMIT:]
 
-            if drive_service and drive_folder_id:
-                try:
-                    # Ensure PDFs subfolder
-                    pdfs_folder = ensure_subfolder(drive_service, drive_folder_id, "PDFs")
-                    target_folder_id = pdfs_folder['id']
 
-                    print(f"[Drive] Uploading to folder: {target_folder_id}")
-                    drive_metadata = drive_upload_pdf(
-                        drive_service,
-                        target_folder_id,
-                        filename,
-                        file_bytes,
-                    )
-                    print(f"[Drive] Uploaded PDF {file.filename} -> {drive_metadata.get('id')}")
-                except Exception as exc:
-                    print(f"[Drive] Failed to upload PDF: {exc}")
-                    if DRIVE_ONLY_MODE:
-                        yield json.dumps({"error": f"Drive upload failed: {exc}"}) + "\n"
-                        return
+def can_read_pdf(user_info: Dict[str, Any], sha_hash: str) -> bool:
+    """Uploaded in this session, or (with a database) uploaded by this user at any time."""
+    if sha_hash == session.get('pdf_doc_id') or sha_hash in session.get('pdf_doc_ids', []):
+        return True
+    if DRIVE_ONLY_MODE or not user_info.get('email'):
+        return False
+    try:
+        return user_uploaded_pdf(user_info['email'], sha_hash)
+    except Exception as exc:
+        print(f"[PDF] Ownership lookup failed: {exc}")
+        return False
 
-            user_id = getattr(user, 'id', None)
-            if isinstance(user_id, int):
-                try:
-                    record_pdf_upload(
-                        user,
-                        filename,
-                        drive_metadata or {},
-                        sha_hash,
-                        size_bytes,
-                    )
-                except Exception as exc:
-                    print(f"[DB] Failed to record PDF upload: {exc}")
-            
-            print(f"[PDF] Uploaded PDF: {len(text)} characters")
-            
-            yield json.dumps({"status": "progress", "percent": 100, "message": "Upload successful!"}) + "\n"
-            
-            yield json.dumps({
-                "status": "success",
-                "message": "PDF uploaded successfully", 
-                "text_length": len(text),
-                "pdf_text": text,  # Send text to frontend
-                "pdf_base64": pdf_b64,  # Also send as Base64
-                "drive_file_id": (drive_metadata or {}).get('id'),
-                "drive_web_view_link": (drive_metadata or {}).get('webViewLink'),
-            }) + "\n"
-            
-        except Exception as e:
-            print(f"[ERROR] PDF upload failed: {e}")
-            yield json.dumps({"error": f"Failed to read PDF: {str(e)}"}) + "\n"
 
-    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+@app.route('/api/pdf/<sha_hash>', methods=['GET'])
+def serve_pdf(sha_hash: str):
+    """Serve an uploaded PDF from the local store. Supports Range requests for pdf.js."""
+    user_info = decode_user_cookie()
+    if not user_info:
+        return jsonify({"error": "Authentication required"}), 401
+
+    path = pdf_path(sha_hash)
+    # Someone else's PDF looks the same as a missing one
+    if not path or not can_read_pdf(user_info, sha_hash):
+        return jsonify({"error": "PDF not found"}), 404
+
+    # conditional=True lets werkzeug answer Range / If-None-Match with 206 / 304
+    response = send_file(path, mimetype='application/pdf', conditional=True, etag=sha_hash, max_age=3600)
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
 
 @app.route('/api/delete-pdf', methods=['POST'])
 def delete_pdf():
@@ -1964,6 +2006,7 @@ def delete_pdf():
         # Clear server-side PDF session data
         if 'pdf_text' in session:
             del session['pdf_text']
+        session.pop('pdf_doc_id', None)
         
         print(f"[PDF] Deleted PDF from server: {filename}")
         return jsonify({
@@ -2085,7 +2128,10 @@ def admin_get_users():
                 'totalUploads': None,
             }
         })
-    payload = build_admin_user_payloads()
+    limit_param = request.args.get('limit', type=int)
+    limit = max(1, min(limit_param, 500)) if limit_param else None
+    offset = max(0, request.args.get('offset', type=int) or 0)
+    payload = build_admin_user_payloads(limit=limit, offset=offset)
     return jsonify(payload)
 
 
@@ -2118,7 +2164,7 @@ def admin_get_user_uploads(user_id: int):
                     listing = list_folder_files(drive_service, folder_meta['id'], page_size=200).get('files', [])
                     for f in listing:
                         name = f.get('name', '')
-                        if name in ('user.json', 'login_history.csv'):
+                        if name in ('user.json', 'login_history.csv', LOGIN_SEGMENT_FOLDER):
                             continue
                         if f.get('mimeType') == 'application/vnd.google-apps.folder':
                             continue
@@ -2168,12 +2214,16 @@ def admin_summary():
                 folder_meta = ensure_user_folder(drive_service, info.get('email', ''), info.get('name'))
                 if folder_meta and folder_meta.get('id'):
                     folder_link = folder_meta.get('link')
-                    state = load_user_json(drive_service, folder_meta['id']) or {}
-                    photo_enabled = bool(state.get('photo_capture_enabled', False))
-                    listing = list_folder_files(drive_service, folder_meta['id'], page_size=100).get('files', [])
+                    # Independent reads, fetched concurrently
+                    state, listing_resp = drive_pool.run_all(drive_service, [
+                        (load_user_json, (folder_meta['id'],)),
+                        (lambda svc, folder_id: list_folder_files(svc, folder_id, page_size=100), (folder_meta['id'],)),
+                    ])
+                    photo_enabled = bool((state or {}).get('photo_capture_enabled', False))
+                    listing = listing_resp.get('files', [])
                     for f in listing:
                         name = f.get('name', '')
-                        if name in ('user.json', 'login_history.csv'):
+                        if name in ('user.json', 'login_history.csv', LOGIN_SEGMENT_FOLDER):
                             continue
                         if f.get('mimeType') == 'application/vnd.google-apps.folder':
                                                        continue
@@ -2204,8 +2254,7 @@ def admin_summary():
             }
         })
     # Normal DB-backed summary
-    global_payload = build_admin_user_payloads()
-    totals = global_payload.get('summary', {})
+    totals = build_admin_totals()
     recent_logins = fetch_login_events_payload(getattr(admin, 'id', 0), limit=10).get('logins', [])
     recent_uploads = fetch_upload_events_payload(getattr(admin, 'id', 0), limit=10).get('uploads', [])
     return jsonify({
@@ -2227,6 +2276,113 @@ def admin_summary():
         }
     })
 
+
+@app.route('/api/admin/cache-stats', methods=['GET'])
+def admin_cache_stats():
+    admin = require_admin()
+    if not admin:
+        return jsonify({"error": "Forbidden"}), 403
+    return jsonify({
+        "textCache": text_cache.stats(),
+        "responseCache": response_cache.stats(),
+    })
+
+
+@app.route('/api/admin/llm-stats', methods=['GET'])
+def admin_llm_stats():
+    admin = require_admin()
+    if not admin:
+        return jsonify({"error": "Forbidden"}), 403
+    return jsonify(llm_router.stats())
+
+def proxy_drive_file(drive_service, meta: Dict[str, Any]) -> Response:
+    """Stream a Drive file (or a cached thumbnail with ?w=) with ETag and Cache-Control."""
+    width = request.args.get('w', type=int)
+    if width is not None:
+        width = max(16, min(width, file_proxy.THUMB_MAX_WIDTH))
+        if not file_proxy.can_downscale(meta):
+            width = None
+    etag = file_proxy.etag_for(meta, width)
+    cache_control = f"private, max-age={file_proxy.PROXY_CACHE_MAX_AGE}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        return response
+
+    mimetype = meta.get('mimeType') or 'application/octet-stream'
+    response = None
+    if width:
+        thumb = file_proxy.thumbnail(drive_service, meta, width)
+        if thumb:
+            response = Response(thumb[0], mimetype=thumb[1])
+    if response is None:
+        size = int(meta['size']) if meta.get('size') else None
+        byte_range = request.range.range_for_length(size) if (request.range and size is not None) else None
+        if byte_range:
+            start, stop = byte_range
+            body = iter_file(drive_service, meta['id'], start, stop - 1, meta.get('modifiedTime'), size)
+            response = Response(body, status=206, mimetype=mimetype)
+            response.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{size}"
+            response.headers['Content-Length'] = str(stop - start)
+        else:
+            body = iter_file(drive_service, meta['id'], modified_time=meta.get('modifiedTime'), size=size)
+            response = Response(body, mimetype=mimetype)
+            if size is not None:
+                response.headers['Content-Length'] = str(size)
+                response.headers['Accept-Ranges'] = 'bytes'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def proxy_file_metadata(drive_service, file_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        meta = file_proxy.file_metadata(drive_service, file_id)
+    except Exception as exc:
+        print(f"[Proxy] Metadata lookup for {file_id} failed: {exc}")
+        return None
+    if meta.get('mimeType') == 'application/vnd.google-apps.folder':
+        return None
+    return meta
+
+
+@app.route('/api/admin/file/proxy/<file_id>', methods=['GET'])
+def admin_file_proxy(file_id: str):
+    admin = require_admin()
+    if not admin:
+        return jsonify({"error": "Forbidden"}), 403
+    # Photos live in every user's folder, which only the service account can read
+    drive_service = get_drive_service() or get_user_drive_service()
+    if not drive_service:
+        return jsonify({"error": "Drive service unavailable"}), 503
+    meta = proxy_file_metadata(drive_service, file_id)
+    if not meta:
+        return jsonify({"error": "File not found"}), 404
+    return proxy_drive_file(drive_service, meta)
+
+
+@app.route('/api/file/proxy/<file_id>', methods=['GET'])
+def user_file_proxy(file_id: str):
+    """Serve a file from the signed-in user's own Drive folder (e.g. their profile picture)."""
+    user_info = decode_user_cookie()
+    if not user_info:
+        return jsonify({"error": "Authentication required"}), 401
+    drive_service = (get_user_drive_service() if DRIVE_USER_MODE else None) or get_drive_service()
+    if not drive_service:
+        return jsonify({"error": "Drive service unavailable"}), 503
+    try:
+        folder = ensure_user_folder(drive_service, user_info.get('email', ''), user_info.get('name'))
+    except Exception as exc:
+        print(f"[Proxy] Failed to resolve user folder: {exc}")
+        folder = None
+    meta = proxy_file_metadata(drive_service, file_id)
+    # Same 404 for missing and foreign files so ids can't be probed
+    if not meta or not folder or not file_proxy.file_in_folder(drive_service, meta, folder['id']):
+        return jsonify({"error": "File not found"}), 404
+    return proxy_drive_file(drive_service, meta)
+
+
 @app.route('/api/admin/photo-capture', methods=['POST'])
 def admin_toggle_own_photo_capture():
     admin = require_admin()
@@ -2339,7 +2495,7 @@ def admin_drive_list():
         visible = []
         for f in listing:
             name = f.get('name', '')
-            if name in ('user.json', 'login_history.csv'):
+            if name in ('user.json', 'login_history.csv', LOGIN_SEGMENT_FOLDER):
                 continue
             visible.append(f)
         return jsonify({
@@ -2416,14 +2572,141 @@ def capture_photo():
     })
 
 
+def read_drive_text_cache(drive_service, drive_folder_id: str, sha_hash: str) -> Optional[str]:
+    """Text saved in the user's Drive TextCache folder, if any."""
+    cache_folder = ensure_subfolder(drive_service, drive_folder_id, "TextCache")
+    cached_file = find_named_file(drive_service, cache_folder['id'], f"{sha_hash}.txt")
+    if not cached_file:
+        return None
+    return read_text_file(drive_service, cached_file['id'], cached_file.get('modifiedTime'), int(cached_file.get('size') or 0) or None)
+
+
+def write_drive_text_cache(drive_service, drive_folder_id: str, sha_hash: str, text: str) -> Dict[str, Any]:
+    cache_folder = ensure_subfolder(drive_service, drive_folder_id, "TextCache")
+    return upload_text_file(drive_service, cache_folder['id'], f"{sha_hash}.txt", text, mimetype="text/plain")
+
+
+def load_document_from_drive(doc_id: str) -> Optional[str]:
+    """Recover server-extracted text from the user's Drive TextCache after the store evicted it."""
+    user_info = decode_user_cookie()
+    if not user_info:
+        return None
+    try:
+        user, drive_service, folder_info = ensure_user_context(user_info)
+        drive_folder_id = (folder_info or {}).get('id') or getattr(user, 'drive_folder_id', None)
+        if not drive_service or not drive_folder_id:
+            return None
+        text = read_drive_text_cache(drive_service, drive_folder_id, doc_id)
+        if text:
+            print(f"[DocStore] Reloaded {doc_id[:12]} from Drive TextCache")
+        return text
+    except Exception as exc:
+        print(f"[DocStore] Drive reload failed for {doc_id[:12]}: {exc}")
+        return None
+
+
+def load_stored_document(doc_id: str):
+    """Server-side document by id, refilled from the text cache (and Drive) after an eviction."""
+    document = get_document(doc_id)
+    if document is None:
+        # text_cache validates doc_id as a SHA-256 before touching disk, DB or Drive
+        cached_text = text_cache.get(doc_id, fallback=load_document_from_drive)
+        if cached_text:
+            document = register_document(doc_id, cached_text)
+    return document
+
+
+def resolve_document(data: Dict[str, Any], *text_keys: str):
+    """
+    Find the document text for an AI request.
+    Order: server-side store by doc_id (refilled from the text cache on a miss), inline text, session.
+    Returns (text, doc_id). doc_id is only set when the text came from the store, or when
+    the requested document could not be found or isn't the caller's (text is then empty).
+    """
+    doc_id = data.get('doc_id')
+    if doc_id:
+        # Same ownership rule as /api/pdf: someone else's document reads as a missing one
+        readable = can_read_pdf(decode_user_cookie() or {}, doc_id)
+        document = load_stored_document(doc_id) if readable else None
+        if document is not None:
+            return document.text, doc_id
+
+    for key in (text_keys or ('pdf_text',)):
+        if data.get(key):
+            return data[key], None
+
+    if doc_id:
+        # Asked for a specific document we no longer have; don't substitute the session's
+        return '', doc_id
+
+    session_doc_id = session.get('pdf_doc_id')
+    document = load_stored_document(session_doc_id) if session_doc_id else None
+    if document is not None:
+        return document.text, session_doc_id
+    # Sessions from before uploads ran as background jobs kept the text itself
+    return session.get('pdf_text', ''), None
+
+
+def document_missing_response(doc_id: Optional[str]):
+    if doc_id:
+        # The frontend resends the request with inline pdf_text on this code
+        return jsonify({"error": "Document not found on server", "code": "document_not_found"}), 404
+    return jsonify({"error": "No PDF loaded"}), 400
+
+
+def completion_key(doc_id, pdf_text, feature, params, model):
+    doc_key = doc_id or hashlib.sha256(pdf_text.encode('utf-8', 'surrogatepass')).hexdigest()
+    return make_response_key(doc_key, feature, params, model)
+
+
+def lookup_completion(data, doc_id, pdf_text, feature, params):
+    """Return (cache key, model, cached text or None). "refresh": true (or ?refresh=1) skips the lookup."""
+    model = current_llm_model()
+    key = completion_key(doc_id, pdf_text, feature, params, model)
+    force = bool((data or {}).get('refresh')) or request.args.get('refresh') == '1'
+    cached = response_cache.get(key) if RESPONSE_CACHE_ENABLED and not force else None
+    return key, model, cached
+
+
+def store_completion(key, model, answered_model, doc_id, pdf_text, feature, params, text):
+    """
+    Cache a completion under the model that actually answered. After a failover that is not
+    the preferred model the lookup used, so the entry gets its own key.
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        return
+    if answered_model and answered_model != model:
+        key, model = completion_key(doc_id, pdf_text, feature, params, answered_model), answered_model
+    response_cache.put(key, text, feature, model)
+
+
+def cached_completion(data, doc_id, pdf_text, feature, params, generate, parse=None):
+    """
+    Return (value, from_cache). generate() returns (cleaned completion, model that answered);
+    parse() validates it (raising on bad output, which is then not cached) and builds the value.
+    """
+    key, model, cached = lookup_completion(data, doc_id, pdf_text, feature, params)
+    if cached is not None:
+        try:
+            return (parse(cached) if parse else cached), True
+        except Exception as exc:
+            print(f"[ResponseCache] Discarding unusable cached {feature}: {exc}")
+    text, answered_model = generate()
+    value = parse(text) if parse else text
+    store_completion(key, model, answered_model, doc_id, pdf_text, feature, params, text)
+    return value, False
+
+
 @app.route('/api/chat', methods=['POST'])
 def chat_endpoint():
     data = request.get_json()
     message = data.get('message')
     history = data.get('history', [])
     
-    # Get PDF text from request (preferred) or session (fallback)
-    pdf_text = data.get('pdf_text') or session.get('pdf_text', '')
+    # Get PDF text from the server-side store (doc_id), request body or session
+    pdf_text, doc_id = resolve_document(data)
+    if not pdf_text and doc_id:
+        return document_missing_response(doc_id)
     
     if not message:
         return jsonify({"error": "Message is required"}), 400
@@ -2433,26 +2716,33 @@ def chat_endpoint():
         {"role": "system", "content": "You are a helpful AI study assistant. Use the provided context to answer the user's questions accurately."}
     ]
     
-    # Add history (limit to last 10 messages to save tokens)
+    # Add as much recent history as fits the model's history token budget
     # History is expected to be a list of {role, content} objects
-    for h in history[-10:]:
-        role = h.get('role')
-        content = h.get('content')
-        if role and content:
-            messages.append({"role": role, "content": content})
-        
+    if isinstance(history, list):
+        messages.extend(trim_history(history, history_budget(current_llm_model())))
+
     messages.append({"role": "user", "content": message})
     
     try:
+        user = ensure_current_user()
+        user_id = getattr(user, 'id', None) if user and not DRIVE_ONLY_MODE else None
+
+        if data.get('stream'):
+            # NDJSON token stream; usage is recorded once the answer has finished
+            def on_complete(_text):
+                if isinstance(user_id, int):
+                    record_feature_usage(user_id, "chat", message[:50], "current_session.pdf")
+            return ndjson_completion_response(
+                lambda: llm_chat_stream(messages, context_text=pdf_text, doc_id=doc_id),
+                on_complete=on_complete,
+            )
+
         # Use RAG-enabled chat
-        response_text = llm_chat(messages, context_text=pdf_text)
+        response_text = llm_chat(messages, context_text=pdf_text, doc_id=doc_id)
         
         # Record usage
-        user = ensure_current_user()
-        if user and not DRIVE_ONLY_MODE:
-             user_id = getattr(user, 'id', None)
-             if isinstance(user_id, int):
-                 record_feature_usage(user_id, "chat", message[:50], "current_session.pdf")
+        if isinstance(user_id, int):
+            record_feature_usage(user_id, "chat", message[:50], "current_session.pdf")
 
         return jsonify({"response": response_text})
     except Exception as e:
@@ -2462,10 +2752,10 @@ def chat_endpoint():
 @app.route('/api/generate-mindmap', methods=['POST'])
 def generate_mindmap():
     data = request.get_json()
-    pdf_text = data.get('text') or data.get('pdf_text') or session.get('pdf_text', '')
+    pdf_text, doc_id = resolve_document(data, 'text', 'pdf_text')
     
     if not pdf_text:
-        return jsonify({"error": "No PDF loaded"}), 400
+        return document_missing_response(doc_id)
         
     try:
         # Limit text for mindmap generation (take first 50k chars)
@@ -2497,11 +2787,13 @@ def generate_mindmap():
         {clean_text}
         """
         
-        messages = [{"role": "user", "content": prompt}]
-        mermaid_code = llm_chat(messages, temperature=0.1)
-        
-        # Clean up response if it contains markdown blocks
-        mermaid_code = mermaid_code.replace("```mermaid", "").replace("```", "").strip()
+        def generate():
+            messages = [{"role": "user", "content": prompt}]
+            code, model = llm_answer(messages, temperature=0.1)
+            # Clean up response if it contains markdown blocks
+            return code.replace("```mermaid", "").replace("```", "").strip(), model
+
+        mermaid_code, from_cache = cached_completion(data, doc_id, pdf_text, "mindmap", {"chars": 50000}, generate)
         
         # Record usage
         user = ensure_current_user()
@@ -2510,7 +2802,7 @@ def generate_mindmap():
              if isinstance(user_id, int):
                  record_feature_usage(user_id, "mindmap", "generated", "current_session.pdf")
 
-        return jsonify({"mermaid_code": mermaid_code})
+        return jsonify({"mermaid_code": mermaid_code, "cached": from_cache})
     except Exception as e:
         print(f"[Mindmap] Error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -2639,54 +2931,77 @@ def get_books():
 @app.route('/api/summarize', methods=['POST'])
 def summarize_endpoint():
     data = request.get_json()
-    pdf_text = data.get('pdf_text') or session.get('pdf_text', '')
+    pdf_text, doc_id = resolve_document(data)
     
     if not pdf_text:
-        return jsonify({"error": "No PDF loaded"}), 400
+        return document_missing_response(doc_id)
         
     try:
-        # Use RAG to get key sections or just summarize the beginning if too long
-        # For summary, we usually want the whole thing, but token limits apply.
-        # Strategy: Chunk, summarize chunks, then summarize summaries.
-        # For simplicity in this demo: Truncate to 100k chars (Llama 3.3 supports 128k context).
-        context = pdf_text[:100000]
+        def summary_messages():
+            # Long documents are condensed map-reduce style (sections summarized concurrently,
+            # then merged) so the final prompt covers the whole text, not just its first 100k chars
+            context = condense(
+                pdf_text,
+                lambda msgs, max_tokens: llm_chat(msgs, max_tokens=max_tokens, temperature=0.2),
+                model=current_llm_model(),
+            )
         
-        prompt = f"""
-        Analyze the following text and provide a comprehensive, intelligent summary.
-        Format the output as clean HTML (without ```html code blocks).
-        
-        Structure & Styling requirements:
-        - Use <h3 style="color: #2c3e50; font-family: 'Segoe UI', sans-serif; border-bottom: 2px solid #3498db; padding-bottom: 5px;"> for main section headings.
-        - Use <h4 style="color: #16a085; font-family: 'Segoe UI', sans-serif; margin-top: 15px;"> for sub-points or key concepts.
-        - Use <ul style="list-style-type: disc; padding-left: 20px; color: #34495e;"> for lists.
-        - Use <li style="margin-bottom: 5px;"> for list items.
-        - Use <p style="color: #2c3e50; line-height: 1.6;"> for explanatory text.
-        - Use <strong> for key terms.
-        - Do NOT use <h1> or <h2> tags.
-        - Do NOT include <html>, <head>, or <body> tags.
-        
-        Content requirements:
-        - Capture the core arguments and evidence.
-        - Highlight key definitions and terminology.
-        - Maintain a professional and academic tone.
-        - If the text is technical, explain complex terms simply.
+            prompt = f"""
+            Analyze the following text and provide a comprehensive, intelligent summary.
+            Format the output as clean HTML (without ```html code blocks).
         
-        Text:
-        {context}
-        """
+            Structure & Styling requirements:
+            - Use <h3 style="color: #2c3e50; font-family: 'Segoe UI', sans-serif; border-bottom: 2px solid #3498db; padding-bottom: 5px;"> for main section headings.
+            - Use <h4 style="color: #16a085; font-family: 'Segoe UI', sans-serif; margin-top: 15px;"> for sub-points or key concepts.
+            - Use <ul style="list-style-type: disc; padding-left: 20px; color: #34495e;"> for lists.
+            - Use <li style="margin-bottom: 5px;"> for list items.
+            - Use <p style="color: #2c3e50; line-height: 1.6;"> for explanatory text.
+            - Use <strong> for key terms.
+            - Do NOT use <h1> or <h2> tags.
+            - Do NOT include <html>, <head>, or <body> tags.
         
-        messages = [{"role": "user", "content": prompt}]
+            Content requirements:
+            - Capture the core arguments and evidence.
+            - Highlight key definitions and terminology.
+            - Maintain a professional and academic tone.
+            - If the text is technical, explain complex terms simply.
+        
+            Text:
+            {context}
+            """
+        
+            return [{"role": "user", "content": prompt}]
+
+        user = ensure_current_user()
+        user_id = getattr(user, 'id', None) if user and not DRIVE_ONLY_MODE else None
+        params = {"max_tokens": 4000}
+
+        if data.get('stream'):
+            key, model, cached = lookup_completion(data, doc_id, pdf_text, "summary", params)
+            answered = {}
+
+            def on_complete(text):
+                store_completion(key, model, answered.get("model"), doc_id, pdf_text, "summary", params, text)
+                if isinstance(user_id, int):
+                    record_feature_usage(user_id, "summarize", "generated", "current_session.pdf")
+            return ndjson_completion_response(
+                lambda: llm_chat_stream(
+                    summary_messages(), max_tokens=4000, on_model=lambda m: answered.update(model=m)
+                ),
+                on_complete=on_complete,
+                cached_text=cached,
+            )
+
         # Increase max_tokens for summary to avoid truncation
-        summary = llm_chat(messages, max_tokens=4000)
+        summary, from_cache = cached_completion(
+            data, doc_id, pdf_text, "summary", params, lambda: llm_answer(summary_messages(), max_tokens=4000)
+        )
         
         # Record usage
-        user = ensure_current_user()
-        if user and not DRIVE_ONLY_MODE:
-             user_id = getattr(user, 'id', None)
-             if isinstance(user_id, int):
-                 record_feature_usage(user_id, "summarize", "generated", "current_session.pdf")
+        if isinstance(user_id, int):
+            record_feature_usage(user_id, "summarize", "generated", "current_session.pdf")
 
-        return jsonify({"summary": summary})
+        return jsonify({"summary": summary, "cached": from_cache})
     except Exception as e:
         print(f"[Summarize] Error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -2695,10 +3010,10 @@ def summarize_endpoint():
 def quiz_endpoint():
     data = request.get_json()
     count = data.get('count', 5)
-    pdf_text = data.get('pdf_text') or session.get('pdf_text', '')
+    pdf_text, doc_id = resolve_document(data)
     
     if not pdf_text:
-        return jsonify({"error": "No PDF loaded"}), 400
+        return document_missing_response(doc_id)
         
     try:
         # Randomly sample a chunk to generate quiz from, or use the beginning
@@ -2740,10 +3055,10 @@ def quiz_endpoint():
 def flashcards_endpoint():
     data = request.get_json()
     count = data.get('count', 10)
-    pdf_text = data.get('pdf_text') or session.get('pdf_text', '')
+    pdf_text, doc_id = resolve_document(data)
     
     if not pdf_text:
-        return jsonify({"error": "No PDF loaded"}), 400
+        return document_missing_response(doc_id)
         
     try:
         context = pdf_text[:15000] # Use first 15k chars
@@ -2758,14 +3073,15 @@ def flashcards_endpoint():
         {context}
         """
         
-        messages = [{"role": "user", "content": prompt}]
-        response = llm_chat(messages, temperature=0.3)
-        
-        # Clean JSON
-        response = response.replace("```json", "").replace("```", "").strip()
-        
-        import json
-        cards_data = json.loads(response)
+        def generate():
+            messages = [{"role": "user", "content": prompt}]
+            response, model = llm_answer(messages, temperature=0.3)
+            # Clean JSON
+            return response.replace("```json", "").replace("```", "").strip(), model
+
+        cards_data, from_cache = cached_completion(
+            data, doc_id, pdf_text, "flashcards", {"count": count, "chars": 15000}, generate, parse=json.loads
+        )
         
         # Record usage
         user = ensure_current_user()
@@ -2774,7 +3090,7 @@ def flashcards_endpoint():
              if isinstance(user_id, int):
                  record_feature_usage(user_id, "flashcards", f"{count} cards", "current_session.pdf")
 
-        return jsonify({"flashcards": cards_data})
+        return jsonify({"flashcards": cards_data, "cached": from_cache})
     except Exception as e:
         print(f"[Flashcards] Error: {e}")
         return jsonify({"error": str(e)}), 500
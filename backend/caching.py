@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import IO, Any, Callable, Generic, Hashable, Iterator, List, Optional, Tuple, TypeVar, Union
+
+V = TypeVar("V")
+
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class SizedLRUCache(Generic[V]):
+    """Thread-safe in-process LRU bounded by the total estimated size of its values."""
+
+    def __init__(self, name: str, max_bytes: int):
+        self.name = name
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[V, int]]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Hashable, value: V, nbytes: int) -> None:
+        with self._lock:
+            existing = self._entries.pop(key, None)
+            if existing is not None:
+                self._total_bytes -= existing[1]
+            if nbytes > self.max_bytes:
+                print(f"[{self.name}] Entry {_short(key)} ({nbytes} bytes) exceeds cache size, not cached")
+                return
+            self._entries[key] = (value, nbytes)
+            self._total_bytes += nbytes
+            while self._total_bytes > self.max_bytes and self._entries:
+                evicted_key, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_bytes
+                print(f"[{self.name}] Evicted {_short(evicted_key)} ({evicted_bytes} bytes)")
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            self._total_bytes -= entry[1]
+            return entry[0]
+
+    def stats(self) -> Tuple[int, int]:
+        with self._lock:
+            return len(self._entries), self._total_bytes
+
+
+def _short(key: Any) -> str:
+    return str(key)[:16]
+
+
+def is_sha256(value: Optional[str]) -> bool:
+    """True for a lowercase hex SHA-256 digest, the only form content-addressed names may take."""
+    return bool(_SHA256_RE.match(value or ""))
+
+
+@contextmanager
+def atomic_write(destination: Union[str, Callable[[], str]], directory: Optional[str] = None, mode: str = "wb",
+                 encoding: Optional[str] = None) -> Iterator[IO[Any]]:
+    """
+    Yields a temp file next to the destination; it replaces the destination only if the block
+    finishes without raising, so readers never see a partial file. destination may be a
+    callable evaluated after the block, for names derived from the content (pass directory then).
+    """
+    directory = directory or os.path.dirname(destination)  # type: ignore[arg-type]
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix=".part", dir=directory)
+    try:
+        with os.fdopen(fd, mode, encoding=encoding) as out:
+            yield out
+        os.replace(tmp_path, destination() if callable(destination) else destination)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class DiskLRU:
+    """
+    Size bound for an on-disk cache directory, evicting the least recently used entries
+    (by mtime; readers refresh it with touch). Entries are files ending in suffix, or with
+    directories=True whole subdirectories. A running byte total means the directory is only
+    scanned once it crosses max_bytes; eviction then goes down to 90% to leave headroom.
+    """
+
+    def __init__(self, name: str, directory: str, max_bytes: int, suffix: str = "",
+                 directories: bool = False, min_age_seconds: float = 0.0):
+        self.name = name
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.directories = directories
+        # Entries written more recently than this are never evicted
+        self.min_age_seconds = min_age_seconds
+        self._total_bytes: Optional[int] = None
+        # When the last prune stopped at an entry too young to evict: the time it ages out.
+        # Until then (or until something is removed) a rescan could not free anything.
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def touch(path: str) -> None:
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def added(self, nbytes: int) -> None:
+        """Account for a newly written entry (or page of one), pruning if that crosses the limit."""
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += nbytes
+                if self._total_bytes <= self.max_bytes or time.time() < self._blocked_until:
+                    return
+            self._prune_locked()
+
+    def removed(self, nbytes: int) -> None:
+        """Account for an entry deleted outside of pruning."""
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes = max(0, self._total_bytes - nbytes)
+            self._blocked_until = 0.0
+
+    def prune(self) -> None:
+        with self._lock:
+            self._prune_locked()
+
+    def _entry_size(self, path: str) -> int:
+        if self.directories:
+            return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+        return os.stat(path).st_size
+
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if self.directories:
+                if not os.path.isdir(path):
+                    continue
+            elif not name.endswith(self.suffix) or name.endswith(".part"):
+                continue
+            try:
+                entries.append((os.stat(path).st_mtime, self._entry_size(path), path))
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def _prune_locked(self) -> None:
+        try:
+            entries = self._scan()
+        except OSError as exc:
+            print(f"[{self.name}] Prune scan failed: {exc}")
+            return
+
+        total = sum(size for _, size, _ in entries)
+        self._blocked_until = 0.0
+        if total > self.max_bytes:
+            target = int(self.max_bytes * 0.9)
+            cutoff = time.time() - self.min_age_seconds
+            for mtime, size, path in sorted(entries):
+                if total <= target:
+                    break
+                if mtime > cutoff:
+                    self._blocked_until = mtime + self.min_age_seconds
+                    break
+                try:
+                    if self.directories:
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+                    total -= size
+                    print(f"[{self.name}] Evicted {os.path.basename(path)}")
+                except OSError:
+                    pass
+        self._total_bytes = total
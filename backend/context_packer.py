@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import re
+from typing import Any, Dict, List, Sequence, Tuple
+
+from doc_index import CHUNK_OVERLAP, CHUNK_SIZE
+
+# Prompt sizing for chat: retrieved context and conversation history are each filled up to a
+# token budget instead of a fixed number of chunks or messages.
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "2000"))
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "1500"))
+# Per-model overrides, e.g. {"llama-3.1-8b-instant": {"context": 1000, "history": 800}}
+_MODEL_BUDGETS: Dict[str, Dict[str, int]] = {}
+try:
+    _MODEL_BUDGETS = json.loads(os.getenv("LLM_TOKEN_BUDGETS") or "{}")
+except ValueError:
+    print("[Context] Ignoring LLM_TOKEN_BUDGETS: not valid JSON")
+
+# Words, numbers and single punctuation marks, roughly how BPE tokenizers split text
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+# Chat APIs add a few tokens of framing per message
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def count_tokens(text: str) -> int:
+    """
+    Local approximation of a BPE token count: long words split into ~4-character pieces.
+    Within about 10-15% of the Llama/DeepSeek tokenizers on English prose.
+    """
+    if not text:
+        return 0
+    return sum(math.ceil(len(piece) / 4) if len(piece) > 4 else 1 for piece in _TOKEN_RE.findall(text))
+
+
+def context_budget(model: str) -> int:
+    return int(_MODEL_BUDGETS.get(model, {}).get("context", RAG_CONTEXT_TOKENS))
+
+
+def history_budget(model: str) -> int:
+    return int(_MODEL_BUDGETS.get(model, {}).get("history", CHAT_HISTORY_TOKENS))
+
+
+def _chunk_span(position: int, text_length: int) -> Tuple[int, int]:
+    start = position * (CHUNK_SIZE - CHUNK_OVERLAP)
+    return start, min(start + CHUNK_SIZE, text_length)
+
+
+def _merge_spans(spans: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Sort spans and coalesce any that overlap or touch."""
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def pack_context(text: str, ranked: Sequence[Tuple[int, float]], budget: int) -> Tuple[List[str], int]:
+    """
+    Fill `budget` tokens with the best-ranked chunks of text. Chosen chunk windows are kept
+    as coalesced spans, so text shared by overlapping chunks is sent (and counted) once.
+    Returns the passages in document order and the tokens they use.
+    """
+    spans: List[Tuple[int, int]] = []
+    used = 0
+    span_tokens: Dict[Tuple[int, int], int] = {}
+
+    def tokens_of(span: Tuple[int, int]) -> int:
+        if span not in span_tokens:
+            span_tokens[span] = count_tokens(text[span[0]:span[1]])
+        return span_tokens[span]
+
+    for position, _ in ranked:
+        start, end = _chunk_span(position, len(text))
+        if start >= end:
+            continue
+        candidate = _merge_spans(spans + [(start, end)])
+        total = sum(tokens_of(span) for span in candidate)
+        if total > budget:
+            continue
+        spans, used = candidate, total
+    return [text[start:end] for start, end in spans], used
+
+
+def trim_history(history: Sequence[Dict[str, Any]], budget: int) -> List[Dict[str, str]]:
+    """Most recent {role, content} messages that fit in `budget` tokens, oldest first."""
+    kept: List[Dict[str, str]] = []
+    used = 0
+    for message in reversed(history):
+        if not isinstance(message, dict):
+            continue
+        role, content = message.get("role"), message.get("content")
+        if not role or not content:
+            continue
+        cost = count_tokens(str(content)) + _MESSAGE_OVERHEAD_TOKENS
+        if used + cost > budget:
+            break
+        kept.append({"role": role, "content": content})
+        used += cost
+    kept.reverse()
+    return kept
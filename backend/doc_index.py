@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import hashlib
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+
+from caching import SizedLRUCache
+from retrieval import ChunkRetriever, top_k as select_top_k
+
+# "tfidf" (lexical, fitted per document) or "embedding" (dense vectors from retrieval.py)
+RAG_RETRIEVER = os.getenv("RAG_RETRIEVER", "tfidf").lower()
+# Lexical hybrid: share of TF-IDF cosine vs. BM25 (scaled to the best chunk) in a chunk's score
+RAG_TFIDF_WEIGHT = float(os.getenv("RAG_TFIDF_WEIGHT", "0.5"))
+RAG_BM25_WEIGHT = float(os.getenv("RAG_BM25_WEIGHT", "0.5"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Chunk i covers text[i * (CHUNK_SIZE - CHUNK_OVERLAP):][:CHUNK_SIZE]
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+
+def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + chunk_size
+        chunks.append(text[start:end])
+        start += (chunk_size - overlap)
+    return chunks
+
+
+class DocumentIndex:
+    """
+    Index over the chunks of one document, built once at upload time. Only the configured
+    retriever's structures are built: with RAG_RETRIEVER=tfidf, TF-IDF cosine and BM25 share
+    one tokenisation and are mixed with RAG_TFIDF_WEIGHT / RAG_BM25_WEIGHT; with
+    RAG_RETRIEVER=embedding, dense vectors from retrieval.py.
+    """
+
+    def __init__(self, doc_id: str, text: str):
+        self.doc_id = doc_id
+        self.chunks: List[str] = chunk_text(text)
+        self.vectorizer: Optional[CountVectorizer] = None
+        self.tfidf: Optional[TfidfTransformer] = None
+        self.matrix = None
+        self.bm25 = None
+        self.retriever: Optional[ChunkRetriever] = None
+        if RAG_RETRIEVER == "embedding":
+            self.retriever = ChunkRetriever(self.chunks)
+        else:
+            self._fit_lexical()
+        self.nbytes = self._estimate_nbytes()
+
+    def _fit_lexical(self) -> None:
+        self.vectorizer = CountVectorizer()
+        counts = self.vectorizer.fit_transform(self.chunks).tocsr()
+        # stop_words_ is only kept for introspection and can be as large as the corpus vocabulary
+        if hasattr(self.vectorizer, "stop_words_"):
+            self.vectorizer.stop_words_ = None
+        self.tfidf = TfidfTransformer()
+        # Rows are L2-normalised, so a sparse dot product with the query is the cosine score
+        self.matrix = self.tfidf.fit_transform(counts).tocsr().astype(np.float32)
+        self.bm25 = _bm25_weights(counts)
+
+    def _estimate_nbytes(self) -> int:
+        chunk_bytes = sum(len(c) for c in self.chunks)
+        if self.retriever is not None:
+            return chunk_bytes + self.retriever.nbytes
+        matrix_bytes = sum(m.data.nbytes + m.indices.nbytes + m.indptr.nbytes for m in (self.matrix, self.bm25))
+        vocab = self.vectorizer.vocabulary_
+        # Rough per-entry cost of the vocabulary dict (key str + int value + slot)
+        vocab_bytes = sum(len(term) for term in vocab) + len(vocab) * 100
+        idf_bytes = self.tfidf.idf_.nbytes
+        return matrix_bytes + vocab_bytes + idf_bytes + chunk_bytes
+
+    def scores(self, query: str) -> np.ndarray:
+        """Hybrid lexical score of every chunk, in [0, 1] when the weights sum to 1. Lexical indexes only."""
+        if self.vectorizer is None:
+            raise RuntimeError("scores() needs the lexical index; this one was built for RAG_RETRIEVER=embedding")
+        query_counts = self.vectorizer.transform([query])
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        if RAG_TFIDF_WEIGHT:
+            query_vec = self.tfidf.transform(query_counts)
+            scores += RAG_TFIDF_WEIGHT * (self.matrix @ query_vec.T).toarray().ravel()
+        if RAG_BM25_WEIGHT:
+            # BM25 counts each distinct query term once
+            query_terms = (query_counts > 0).astype(np.float32)
+            bm25 = (self.bm25 @ query_terms.T).toarray().ravel()
+            best = bm25.max() if bm25.size else 0.0
+            if best > 0:
+                scores += RAG_BM25_WEIGHT * (bm25 / best)
+        return scores
+
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[int, float]]:
+        """(chunk position, score) pairs, best first."""
+        if not self.chunks:
+            return []
+        if self.retriever is not None:
+            return self.retriever.search(query, top_k=top_k)
+        scores = self.scores(query)
+        best = select_top_k(scores, top_k)
+        return [(int(i), float(scores[i])) for i in best]
+
+    def query(self, query: str, top_k: int = 3) -> List[str]:
+        return [self.chunks[i] for i, _ in self.search(query, top_k=top_k)]
+
+
+def _bm25_weights(counts, k1: float = BM25_K1, b: float = BM25_B):
+    """
+    Per (chunk, term) BM25 contribution, precomputed so a query is one sparse dot product
+    with its term-presence vector.
+    """
+    counts = counts.tocsr().astype(np.float32)
+    n_docs = counts.shape[0]
+    doc_len = np.asarray(counts.sum(axis=1)).ravel()
+    avg_len = doc_len.mean() if n_docs else 0.0
+    df = np.bincount(counts.indices, minlength=counts.shape[1])
+    idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+    # Length norm for the row each stored value belongs to
+    row_of_value = np.repeat(np.arange(n_docs), np.diff(counts.indptr))
+    norm = k1 * (1 - b + b * doc_len / avg_len) if avg_len else np.full(n_docs, k1, dtype=np.float32)
+    tf = counts.data
+    weights = counts.copy()
+    weights.data = (idf[counts.indices] * tf * (k1 + 1) / (tf + norm[row_of_value])).astype(np.float32)
+    return weights
+
+
+_index_cache: SizedLRUCache[DocumentIndex] = SizedLRUCache("RAG", int(os.getenv("RAG_INDEX_CACHE_MB", "256")) * 1024 * 1024)
+
+
+def build_document_index(doc_id: str, text: str) -> Optional[DocumentIndex]:
+    """Fit and cache the index for a document. Returns None if the text has no usable terms."""
+    if not text:
+        return None
+    try:
+        index = DocumentIndex(doc_id, text)
+    except ValueError as exc:
+        # CountVectorizer raises on an empty vocabulary (e.g. only stop words or symbols)
+        print(f"[RAG] Could not index {doc_id[:12]}: {exc}")
+        return None
+    _index_cache.put(doc_id, index, index.nbytes)
+    return index
+
+
+def get_document_index(doc_id: Optional[str], text: Optional[str] = None) -> Optional[DocumentIndex]:
+    """
+    Look up a cached index, rebuilding it from text after an eviction or restart.
+    Only pass text that the server itself extracted for doc_id.
+    """
+    if not doc_id:
+        return None
+    index = _index_cache.get(doc_id)
+    if index is None and text:
+        index = build_document_index(doc_id, text)
+    return index
+
+
+def get_text_index(text: str) -> Optional[DocumentIndex]:
+    """Index for client-supplied text, keyed by the text's own hash so it can't shadow a document id."""
+    if not text:
+        return None
+    text_key = "text:" + hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()
+    return get_document_index(text_key, text)
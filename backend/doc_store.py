@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import os
+from typing import Optional
+
+from caching import SizedLRUCache
+from doc_index import DocumentIndex, get_document_index
+
+
+class StoredDocument:
+    """Extracted text of one uploaded PDF, keyed by the PDF's SHA-256."""
+
+    def __init__(self, doc_id: str, text: str, filename: Optional[str] = None):
+        self.doc_id = doc_id
+        self.text = text
+        self.filename = filename
+
+    @property
+    def index(self) -> Optional[DocumentIndex]:
+        # The index lives in its own LRU; refit from the stored text if it was evicted
+        return get_document_index(self.doc_id, self.text)
+
+    @property
+    def nbytes(self) -> int:
+        # CPython stores text as 1-4 bytes per character; assume the common ASCII/Latin-1 case plus overhead
+        return len(self.text) + 256
+
+
+_documents: SizedLRUCache[StoredDocument] = SizedLRUCache("DocStore", int(os.getenv("DOC_STORE_MB", "512")) * 1024 * 1024)
+
+
+def register_document(doc_id: str, text: str, filename: Optional[str] = None) -> StoredDocument:
+    """Store server-extracted text so AI endpoints can look it up by document id."""
+    document = StoredDocument(doc_id, text, filename)
+    _documents.put(doc_id, document, document.nbytes)
+    return document
+
+
+def get_document(doc_id: Optional[str]) -> Optional[StoredDocument]:
+    if not doc_id:
+        return None
+    return _documents.get(doc_id)
+
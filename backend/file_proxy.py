@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional, Set, Tuple
+
+from caching import DiskLRU, atomic_write
+from services.google_drive import download_file, get_file_metadata
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+# Drive files (user photos, profile pictures) served through /api/file/proxy and
+# /api/admin/file/proxy. Browsers revalidate with the ETag; downscaled thumbnails are
+# kept on disk so the admin photo grid never re-fetches full-size images.
+PROXY_CACHE_MAX_AGE = int(os.getenv("PROXY_CACHE_MAX_AGE", "3600"))
+# Metadata (and so the ETag) is reused this long before Drive is asked again
+PROXY_META_TTL = float(os.getenv("PROXY_META_TTL", "60"))
+THUMB_CACHE_DIR = os.getenv("THUMB_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "studyai_thumb_cache")
+THUMB_CACHE_MAX_BYTES = int(os.getenv("THUMB_CACHE_MAX_MB", "64")) * 1024 * 1024
+THUMB_MAX_WIDTH = int(os.getenv("THUMB_MAX_WIDTH", "1024"))
+# Profile pictures sit at <user>/Profile Pictures/, captures at <user>/Captures/Photos/
+PROXY_MAX_FOLDER_DEPTH = 3
+
+PROXY_FIELDS = "id, name, mimeType, size, modifiedTime, parents"
+
+_meta_cache: Dict[str, Tuple[Dict[str, Any], float]] = {}
+_meta_lock = threading.Lock()
+# (folder id, file id) pairs already confirmed, so ownership checks cost one walk per file
+_owned: Set[Tuple[str, str]] = set()
+_thumbs = DiskLRU("Proxy", THUMB_CACHE_DIR, THUMB_CACHE_MAX_BYTES, suffix=".thumb")
+
+
+def file_metadata(service, file_id: str) -> Dict[str, Any]:
+    now = time.monotonic()
+    with _meta_lock:
+        cached = _meta_cache.get(file_id)
+        if cached and cached[1] > now:
+            return cached[0]
+    meta = get_file_metadata(service, file_id, fields=PROXY_FIELDS)
+    with _meta_lock:
+        if len(_meta_cache) > 4096:
+            _meta_cache.clear()
+        _meta_cache[file_id] = (meta, now + PROXY_META_TTL)
+    return meta
+
+
+def etag_for(meta: Dict[str, Any], width: Optional[int]) -> str:
+    revision = hashlib.sha256(f"{meta.get('id')}:{meta.get('modifiedTime')}".encode("utf-8")).hexdigest()[:20]
+    return f"{revision}-w{width}" if width else revision
+
+
+def file_in_folder(service, meta: Dict[str, Any], folder_id: str) -> bool:
+    """True if the file sits in folder_id or one of its subfolders (up to PROXY_MAX_FOLDER_DEPTH)."""
+    key = (folder_id, meta.get("id", ""))
+    with _meta_lock:
+        if key in _owned:
+            return True
+    parents = list(meta.get("parents") or [])
+    for _ in range(PROXY_MAX_FOLDER_DEPTH):
+        if folder_id in parents:
+            with _meta_lock:
+                if len(_owned) > 4096:
+                    _owned.clear()
+                _owned.add(key)
+            return True
+        next_parents = []
+        for parent_id in parents:
+            try:
+                next_parents.extend(file_metadata(service, parent_id).get("parents") or [])
+            except Exception:
+                # Folders above the user's (e.g. the Drive root) may not be readable
+                continue
+        if not next_parents:
+            return False
+        parents = next_parents
+    return False
+
+
+def can_downscale(meta: Dict[str, Any]) -> bool:
+    return PIL_AVAILABLE and str(meta.get("mimeType", "")).startswith("image/")
+
+
+def _thumb_path(meta: Dict[str, Any], width: int) -> str:
+    return os.path.join(THUMB_CACHE_DIR, f"{etag_for(meta, width)}.thumb")
+
+
+def thumbnail(service, meta: Dict[str, Any], width: int) -> Optional[Tuple[bytes, str]]:
+    """(image bytes, mimetype) scaled to at most width pixels wide, from the disk cache when possible."""
+    if not can_downscale(meta):
+        return None
+    path = _thumb_path(meta, width)
+    try:
+        with open(path, "rb") as fh:
+            data = fh.read()
+        DiskLRU.touch(path)
+        return data, _thumb_mimetype(data)
+    except FileNotFoundError:
+        pass
+    except OSError as exc:
+        print(f"[Proxy] Could not read thumbnail {path}: {exc}")
+
+    original = download_file(service, meta["id"], meta.get("modifiedTime"), _int_or_none(meta.get("size")))
+    data = _downscale(original, width)
+    if data is None:
+        return None
+    try:
+        with atomic_write(path) as out:
+            out.write(data)
+        _thumbs.added(len(data))
+    except OSError as exc:
+        print(f"[Proxy] Could not store thumbnail for {meta.get('id')}: {exc}")
+    return data, _thumb_mimetype(data)
+
+
+def _downscale(data: bytes, width: int) -> Optional[bytes]:
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.thumbnail((width, width * 4))
+            out = io.BytesIO()
+            # Keep transparency as PNG; everything else becomes a compact JPEG
+            if image.mode in ("RGBA", "LA", "P"):
+                image.save(out, format="PNG", optimize=True)
+            else:
+                image.convert("RGB").save(out, format="JPEG", quality=82, optimize=True)
+            return out.getvalue()
+    except Exception as exc:
+        print(f"[Proxy] Downscale failed: {exc}")
+        return None
+
+
+def _thumb_mimetype(data: bytes) -> str:
+    return "image/png" if data.startswith(b"\x89PNG") else "image/jpeg"
+
+
+def _int_or_none(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import itertools
+import os
+import threading
+from abc import ABC, abstractmethod
+import time
+from typing import Dict, Optional, Tuple
+
+# A frame is (sequence number, raw JPEG bytes). Sequence numbers only grow per channel,
+# so a viewer asks for "anything newer than the last seq I showed".
+Frame = Tuple[int, bytes]
+
+FRAME_BUS_URL = os.getenv("FRAME_BUS_URL", "")
+# Frames older than this are treated as a dead stream
+FRAME_TTL_SECONDS = int(os.getenv("FRAME_TTL_SECONDS", "30"))
+
+
+class FrameSubscription(ABC):
+    """One viewer's wake-ups for one channel. Use as a context manager so it is closed."""
+
+    @abstractmethod
+    def wait(self, after_seq: int, timeout: float) -> Optional[Frame]:
+        """Block until a frame newer than after_seq is published, or return None on timeout."""
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "FrameSubscription":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class FrameBus(ABC):
+    """Latest-frame pub/sub for live streams. Subclasses hold the frames."""
+
+    @abstractmethod
+    def publish(self, channel: int, frame: bytes) -> int:
+        ...
+
+    @abstractmethod
+    def latest(self, channel: int) -> Optional[Frame]:
+        ...
+
+    @abstractmethod
+    def subscribe(self, channel: int) -> FrameSubscription:
+        """Subscription a viewer keeps for as long as it follows the channel."""
+
+    @abstractmethod
+    def clear(self, channel: int) -> None:
+        ...
+
+    def wait_for_frame(self, channel: int, after_seq: int, timeout: float) -> Optional[Frame]:
+        """One-off wait; viewers that loop should hold a subscription instead."""
+        with self.subscribe(channel) as subscription:
+            return subscription.wait(after_seq, timeout)
+
+
+class _Channel:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.entry: Optional[Tuple[int, bytes, float]] = None
+
+
+class InMemoryFrameBus(FrameBus):
+    """Single-process bus: one slot per channel, each with its own condition so a frame only wakes its viewers."""
+
+    def __init__(self, ttl_seconds: int = FRAME_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._channels: Dict[int, _Channel] = {}
+        self._channels_lock = threading.Lock()
+        self._seq = itertools.count(1)
+
+    def _channel(self, channel: int) -> _Channel:
+        with self._channels_lock:
+            slot = self._channels.get(channel)
+            if slot is None:
+                slot = self._channels[channel] = _Channel()
+            return slot
+
+    def publish(self, channel: int, frame: bytes) -> int:
+        slot = self._channel(channel)
+        with slot.cond:
+            seq = next(self._seq)
+            slot.entry = (seq, frame, time.monotonic())
+            slot.cond.notify_all()
+            return seq
+
+    def _current(self, slot: _Channel) -> Optional[Frame]:
+        if slot.entry is None:
+            return None
+        seq, frame, published_at = slot.entry
+        if time.monotonic() - published_at > self.ttl_seconds:
+            return None
+        return seq, frame
+
+    def latest(self, channel: int) -> Optional[Frame]:
+        slot = self._channel(channel)
+        with slot.cond:
+            return self._current(slot)
+
+    def subscribe(self, channel: int) -> FrameSubscription:
+        return _InMemorySubscription(self, self._channel(channel))
+
+    def clear(self, channel: int) -> None:
+        slot = self._channel(channel)
+        with slot.cond:
+            slot.entry = None
+            slot.cond.notify_all()
+
+
+class _InMemorySubscription(FrameSubscription):
+    def __init__(self, bus: InMemoryFrameBus, slot: _Channel):
+        self._bus = bus
+        self._slot = slot
+
+    def wait(self, after_seq: int, timeout: float) -> Optional[Frame]:
+        deadline = time.monotonic() + timeout
+        with self._slot.cond:
+            while True:
+                current = self._bus._current(self._slot)
+                if current is not None and current[0] > after_seq:
+                    return current
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._slot.cond.wait(remaining)
+
+
+class RedisFrameBus(FrameBus):
+    """
+    Bus shared between worker processes through any Redis-protocol server.
+    The frame and its seq are stored under one key; a pub/sub message wakes viewers.
+    """
+
+    def __init__(self, url: str, ttl_seconds: int = FRAME_TTL_SECONDS):
+        import redis  # Optional dependency, only needed when FRAME_BUS_URL is set
+
+        self.ttl_seconds = ttl_seconds
+        self._client = redis.Redis.from_url(url)
+
+    @staticmethod
+    def _frame_key(channel: int) -> str:
+        return f"stream:frame:{channel}"
+
+    @staticmethod
+    def _notify_key(channel: int) -> str:
+        return f"stream:notify:{channel}"
+
+    def publish(self, channel: int, frame: bytes) -> int:
+        seq = int(self._client.incr("stream:seq"))
+        pipe = self._client.pipeline()
+        pipe.hset(self._frame_key(channel), mapping={"seq": seq, "frame": frame})
+        pipe.expire(self._frame_key(channel), self.ttl_seconds)
+        pipe.publish(self._notify_key(channel), seq)
+        pipe.execute()
+        return seq
+
+    def latest(self, channel: int) -> Optional[Frame]:
+        values = self._client.hmget(self._frame_key(channel), "seq", "frame")
+        if not values or values[0] is None or values[1] is None:
+            return None
+        return int(values[0]), values[1]
+
+    def subscribe(self, channel: int) -> FrameSubscription:
+        return _RedisSubscription(self, channel)
+
+    def clear(self, channel: int) -> None:
+        self._client.delete(self._frame_key(channel))
+
+
+class _RedisSubscription(FrameSubscription):
+    """Subscribes once; every wait reuses the same pub/sub connection."""
+
+    def __init__(self, bus: RedisFrameBus, channel: int):
+        self._bus = bus
+        self._channel = channel
+        self._pubsub = bus._client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(bus._notify_key(channel))
+
+    def _newer(self, after_seq: int) -> Optional[Frame]:
+        current = self._bus.latest(self._channel)
+        if current is not None and current[0] > after_seq:
+            return current
+        return None
+
+    def wait(self, after_seq: int, timeout: float) -> Optional[Frame]:
+        # Checked after subscribing, so a frame published in between isn't missed
+        current = self._newer(after_seq)
+        if current is not None:
+            return current
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            if self._pubsub.get_message(timeout=remaining) is None:
+                continue
+            # Notifications that piled up while the viewer was sending count as one
+            while self._pubsub.get_message(timeout=0) is not None:
+                pass
+            current = self._newer(after_seq)
+            if current is not None:
+                return current
+
+    def close(self) -> None:
+        self._pubsub.close()
+
+
+def _create_frame_bus() -> FrameBus:
+    if FRAME_BUS_URL:
+        try:
+            bus = RedisFrameBus(FRAME_BUS_URL)
+            print(f"[FrameBus] Using Redis backend at {FRAME_BUS_URL.split('@')[-1]}")
+            return bus
+        except Exception as exc:
+            print(f"[FrameBus] Redis backend unavailable ({exc}), falling back to in-memory")
+    return InMemoryFrameBus()
+
+
+frame_bus: FrameBus = _create_frame_bus()
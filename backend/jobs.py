@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Long-running work (PDF extraction) runs here instead of on gunicorn's request threads.
+# Clients follow a job by polling or streaming its progress events; the job keeps running
+# if they disconnect.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Finished jobs stay readable this long so a reconnecting client can fetch the result
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+
+Event = Dict[str, Any]
+
+
+class Job:
+    """Progress events and final state of one background task."""
+
+    def __init__(self, job_id: str, owner: Optional[str], kind: str):
+        self.id = job_id
+        self.owner = owner
+        self.kind = kind
+        self.state = "queued"  # queued, running, succeeded, failed
+        self.events: List[Event] = []
+        self.result: Optional[Event] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._cond = threading.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.state in ("succeeded", "failed")
+
+    def add_event(self, event: Event) -> None:
+        with self._cond:
+            self.events.append(event)
+            self._cond.notify_all()
+
+    def finish(self, state: str, result: Optional[Event] = None) -> None:
+        with self._cond:
+            self.state = state
+            self.result = result
+            self.finished_at = time.time()
+            self._cond.notify_all()
+
+    def events_after(self, after: int, timeout: float = 0) -> Tuple[List[Event], bool]:
+        """Events from index `after` on, waiting up to timeout for new ones. Also returns done."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while len(self.events) <= after and not self.done:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self.events[after:], self.done
+
+    def snapshot(self, after: int = 0) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "job_id": self.id,
+                "kind": self.kind,
+                "state": self.state,
+                "events": self.events[after:],
+                "next": len(self.events),
+            }
+
+
+class JobQueue:
+    """Runs event-generator functions on a small worker pool and keeps their jobs by id."""
+
+    def __init__(self, workers: int = JOB_WORKERS, ttl_seconds: int = JOB_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, owner: Optional[str], run: Callable[[], Iterator[Event]]) -> Job:
+        """
+        Queue run(), a generator of event dicts. An event with status "success" becomes the
+        job result; an event with an "error" key fails the job.
+        """
+        job = Job(secrets.token_urlsafe(16), owner, kind)
+        with self._lock:
+            self._expire_locked()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, run)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job: Job, run: Callable[[], Iterator[Event]]) -> None:
+        job.state = "running"
+        result: Optional[Event] = None
+        failed = False
+        try:
+            for event in run():
+                job.add_event(event)
+                if event.get("status") == "success":
+                    result = event
+                elif event.get("error"):
+                    failed = True
+                    result = event
+        except Exception as exc:
+            print(f"[Jobs] {job.kind} job {job.id} crashed: {exc}")
+            failed = True
+            result = {"error": str(exc)}
+            job.add_event(result)
+        if result is None:
+            failed = True
+            result = {"error": "Job finished without a result"}
+            job.add_event(result)
+        job.finish("failed" if failed else "succeeded", result)
+
+    def _expire_locked(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        for job_id in [jid for jid, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+
+job_queue = JobQueue()
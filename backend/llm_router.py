@@ -0,0 +1,318 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+import groq
+import openai
+
+# Routes chat completions across every configured provider (Groq, DeepSeek, extra
+# OpenAI-compatible endpoints). The preferred provider goes first; rate limits, 5xx and
+# connection errors fail over to the next one, and rolling latency per provider/model
+# drives optional hedging.
+LLM_STATS_WINDOW = int(os.getenv("LLM_STATS_WINDOW", "200"))
+# Send a second request to the next provider if the first is slower than its p95
+LLM_HEDGE = os.getenv("LLM_HEDGE", "false").lower() == "true"
+# Successful samples needed before the p95 is trusted as a hedge delay
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", "8"))
+# A rate-limited provider moves to the back of the order for this long (or its Retry-After)
+LLM_COOLDOWN_SECONDS = float(os.getenv("LLM_COOLDOWN_SECONDS", "30"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "120"))
+
+# Completion time grows with answer length, so latency (and the hedge threshold) is tracked
+# per max_tokens bucket: a 4000-token summary is never compared against short chat replies
+_MAX_TOKENS_BUCKETS = (256, 1024, 4096)
+
+_CONNECTION_ERRORS = (groq.APIConnectionError, openai.APIConnectionError, ConnectionError, TimeoutError)
+
+
+@dataclass
+class Provider:
+    name: str
+    client: Any
+    model: str
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}/{self.model}"
+
+
+class RollingStats:
+    """Latency and outcome of the last `window` calls."""
+
+    def __init__(self, window: int = LLM_STATS_WINDOW):
+        self._samples: Deque[Tuple[float, bool]] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self._samples.append((seconds, ok))
+
+    def _latencies(self) -> List[float]:
+        with self._lock:
+            return sorted(seconds for seconds, ok in self._samples if ok)
+
+    def percentile(self, fraction: float, min_samples: int = 1) -> Optional[float]:
+        latencies = self._latencies()
+        if len(latencies) < max(1, min_samples):
+            return None
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = list(self._samples)
+        errors = sum(1 for _, ok in samples if not ok)
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "calls": len(samples),
+            "errorRate": round(errors / len(samples), 3) if samples else 0.0,
+            "p50Ms": round(p50 * 1000) if p50 is not None else None,
+            "p95Ms": round(p95 * 1000) if p95 is not None else None,
+        }
+
+
+def request_class(request: Dict[str, Any]) -> str:
+    """Latency class of a completion request, from its max_tokens."""
+    max_tokens = request.get("max_tokens")
+    if max_tokens is None:
+        return "unbounded"
+    for bucket in _MAX_TOKENS_BUCKETS:
+        if max_tokens <= bucket:
+            return f"max{bucket}"
+    return "long"
+
+
+def status_code(exc: Exception) -> Optional[int]:
+    """HTTP status of a Groq/OpenAI SDK error, if it carries one."""
+    status = getattr(exc, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Rate limits, server errors and connection failures are worth trying elsewhere."""
+    status = status_code(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(exc, _CONNECTION_ERRORS)
+
+
+def _retry_after(exc: Exception) -> float:
+    response = getattr(exc, "response", None)
+    try:
+        return max(1.0, float(response.headers.get("retry-after")))
+    except (AttributeError, TypeError, ValueError):
+        return LLM_COOLDOWN_SECONDS
+
+
+class LLMRouter:
+    """Failover (and optional hedging) over an ordered list of providers."""
+
+    def __init__(self, providers: List[Provider], preferred: str = "", hedge: bool = LLM_HEDGE):
+        self.providers = providers
+        self.preferred = preferred
+        self.hedge = hedge
+        # (provider/model, kind): "complete:<request class>" times the full answer,
+        # "first_token" a stream's first token, "stream" counts failures after it
+        self._stats: Dict[Tuple[str, str], RollingStats] = {}
+        self._cooldown_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def primary(self) -> Optional[Provider]:
+        for provider in self.providers:
+            if provider.name == self.preferred:
+                return provider
+        return self.providers[0] if self.providers else None
+
+    def _tracker(self, provider: Provider, kind: str) -> RollingStats:
+        with self._lock:
+            tracker = self._stats.get((provider.key, kind))
+            if tracker is None:
+                tracker = self._stats[(provider.key, kind)] = RollingStats()
+            return tracker
+
+    def candidates(self) -> List[Provider]:
+        """Preferred provider first, then the rest in configured order; rate-limited ones go last."""
+        if not self.providers:
+            raise RuntimeError("No LLM provider is configured (set GROQ_API_KEY or DEEPSEEK_API_KEY)")
+        primary = self.primary
+        ordered = [primary] + [p for p in self.providers if p is not primary]
+        now = time.monotonic()
+        with self._lock:
+            cooling = {name for name, until in self._cooldown_until.items() if until > now}
+        return [p for p in ordered if p.name not in cooling] + [p for p in ordered if p.name in cooling]
+
+    def _failed(self, provider: Provider, kind: str, seconds: float, exc: Exception) -> None:
+        self._tracker(provider, kind).record(seconds, False)
+        if status_code(exc) == 429:
+            with self._lock:
+                self._cooldown_until[provider.name] = time.monotonic() + _retry_after(exc)
+
+    def _call(self, provider: Provider, request: Dict[str, Any], kind: str) -> str:
+        started = time.monotonic()
+        try:
+            resp = provider.client.chat.completions.create(model=provider.model, **request)
+        except Exception as exc:
+            self._failed(provider, kind, time.monotonic() - started, exc)
+            raise
+        self._tracker(provider, kind).record(time.monotonic() - started, True)
+        return resp.choices[0].message.content
+
+    def complete(self, request: Dict[str, Any]) -> str:
+        """
+        Completion text for `request` (chat.completions kwargs without the model). Retryable
+        errors move on to the next provider; anything else is raised as is.
+        """
+        return self.complete_with_provider(request)[0]
+
+    def complete_with_provider(self, request: Dict[str, Any]) -> Tuple[str, Provider]:
+        """Like complete, plus the provider that answered (not the preferred one after a failover)."""
+        candidates = self.candidates()
+        kind = f"complete:{request_class(request)}"
+        if self.hedge and len(candidates) > 1:
+            return self._complete_hedged(candidates, request, kind)
+        last_exc: Optional[Exception] = None
+        for provider in candidates:
+            try:
+                return self._call(provider, request, kind), provider
+            except Exception as exc:
+                if not is_retryable(exc):
+                    raise
+                print(f"[LLM] {provider.key} failed ({status_code(exc) or type(exc).__name__}), trying next provider")
+                last_exc = exc
+        raise last_exc
+
+    def _hedge_delay(self, provider: Provider, kind: str) -> Optional[float]:
+        return self._tracker(provider, kind).percentile(0.95, LLM_HEDGE_MIN_SAMPLES)
+
+    def _complete_hedged(self, candidates: List[Provider], request: Dict[str, Any], kind: str) -> Tuple[str, Provider]:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=LLM_HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+        queue = list(candidates)
+        first = queue.pop(0)
+        pending = {self._executor.submit(self._call, first, request, kind): first}
+        hedge_delay = self._hedge_delay(first, kind)
+        last_exc: Optional[Exception] = None
+        while pending:
+            # Only the first request is hedged; later ones are plain failover
+            timeout = hedge_delay if queue and len(pending) == 1 and first in pending.values() else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                backup = queue.pop(0)
+                print(f"[LLM] {first.key} slower than p95 ({hedge_delay:.2f}s), hedging with {backup.key}")
+                pending[self._executor.submit(self._call, backup, request, kind)] = backup
+                continue
+            for future in done:
+                provider = pending.pop(future)
+                exc = future.exception()
+                if exc is None:
+                    # The other request keeps running; its latency still feeds the stats
+                    return future.result(), provider
+                if not is_retryable(exc):
+                    # Same as the unhedged path: a bad request or auth error is not the backup's to answer
+                    raise exc
+                print(f"[LLM] {provider.key} failed ({status_code(exc) or type(exc).__name__})")
+                last_exc = exc
+            if not pending and queue:
+                provider = queue.pop(0)
+                pending[self._executor.submit(self._call, provider, request, kind)] = provider
+        raise last_exc
+
+    def stream(self, request: Dict[str, Any], on_provider: Optional[Callable[[Provider], None]] = None) -> Iterator[str]:
+        """
+        Yield completion text deltas. Failover only happens before the first token: once text
+        has reached the client, a failure is raised rather than restarting on another provider.
+        on_provider(provider) is called with the provider that answers, before its first delta.
+        """
+        last_exc: Optional[Exception] = None
+        for provider in self.candidates():
+            started = time.monotonic()
+            first_token = False
+            try:
+                # Groq and the OpenAI SDK share the same streaming chunk shape
+                for chunk in provider.client.chat.completions.create(model=provider.model, stream=True, **request):
+                    if not chunk.choices:
+                        continue
+                    delta = getattr(chunk.choices[0].delta, "content", None)
+                    if delta:
+                        if not first_token:
+                            first_token = True
+                            self._tracker(provider, "first_token").record(time.monotonic() - started, True)
+                            if on_provider:
+                                on_provider(provider)
+                        yield delta
+                if not first_token:
+                    self._tracker(provider, "first_token").record(time.monotonic() - started, True)
+                return
+            except Exception as exc:
+                if first_token:
+                    self._tracker(provider, "stream").record(time.monotonic() - started, False)
+                    raise
+                self._failed(provider, "first_token", time.monotonic() - started, exc)
+                if not is_retryable(exc):
+                    raise
+                print(f"[LLM] {provider.key} stream failed ({status_code(exc) or type(exc).__name__}), trying next provider")
+                last_exc = exc
+        raise last_exc
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            trackers = dict(self._stats)
+            cooling = {name: round(until - now) for name, until in self._cooldown_until.items() if until > now}
+        primary = self.primary
+        result: Dict[str, Any] = {
+            "preferred": primary.key if primary else None,
+            "hedging": self.hedge,
+            "providers": {},
+        }
+        for provider in self.providers:
+            entry: Dict[str, Any] = {
+                kind: tracker.stats() for (key, kind), tracker in sorted(trackers.items()) if key == provider.key
+            }
+            if provider.name in cooling:
+                entry["cooldownSeconds"] = cooling[provider.name]
+            result["providers"][provider.key] = entry
+        return result
+
+
+def extra_providers() -> List[Provider]:
+    """
+    OpenAI-compatible endpoints from LLM_EXTRA_PROVIDERS, a JSON list of
+    {"name", "base_url", "model", "api_key"} objects (api_key may be omitted for local servers).
+    """
+    try:
+        entries = json.loads(os.getenv("LLM_EXTRA_PROVIDERS") or "[]")
+    except ValueError:
+        print("[LLM] Ignoring LLM_EXTRA_PROVIDERS: not valid JSON")
+        return []
+    providers = []
+    for entry in entries:
+        try:
+            client = openai.OpenAI(
+                api_key=entry.get("api_key") or "none",
+                base_url=entry["base_url"],
+                timeout=LLM_REQUEST_TIMEOUT,
+                max_retries=0,
+            )
+            providers.append(Provider(entry.get("name") or entry["base_url"], client, entry["model"]))
+        except Exception as exc:
+            print(f"[LLM] Skipping extra provider {entry!r}: {exc}")
+    return providers
+
+
+def router_client(client: Any) -> Any:
+    """
+    A copy of an SDK client without its built-in retries, so a rate-limited or failing
+    provider hands over to the next one immediately instead of backing off in place.
+    """
+    return client.with_options(max_retries=0, timeout=LLM_REQUEST_TIMEOUT)
@@ -0,0 +1,416 @@
+from __future__ import annotations
+
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from caching import atomic_write
+from services.google_drive import (
+    build_drive_client,
+    credentials_of,
+    delete_file,
+    download_file,
+    ensure_subfolder,
+    find_named_file,
+    get_drive_service,
+    list_folder_files,
+    upload_text_file,
+)
+from services.user_drive import build_detached_client
+from utils import update_login_csv_metadata
+
+# Login rows are appended to a local journal on the request path and shipped to Drive in batches.
+# Each batch becomes one small segment CSV under LoginHistory/; segments are periodically folded
+# into login_history.csv, so the per-user CSV is rewritten once per many logins instead of once per login.
+LOGIN_LOG_DIR = os.getenv("LOGIN_LOG_DIR") or os.path.join(tempfile.gettempdir(), "studyai_login_log")
+LOGIN_LOG_FLUSH_SECONDS = float(os.getenv("LOGIN_LOG_FLUSH_SECONDS", "30"))
+LOGIN_LOG_COMPACT_SEGMENTS = int(os.getenv("LOGIN_LOG_COMPACT_SEGMENTS", "20"))
+# ...or once the oldest segment is this old, so quiet deployments don't leave the main CSV stale
+LOGIN_LOG_COMPACT_AGE_SECONDS = float(os.getenv("LOGIN_LOG_COMPACT_AGE_SECONDS", "900"))
+LOGIN_LOG_MAX_CREDENTIALS = int(os.getenv("LOGIN_LOG_MAX_CREDENTIALS", "256"))
+# Failed uploads (and compactions) are retried on this many flushes, then set aside in dead.jsonl
+LOGIN_LOG_MAX_ATTEMPTS = int(os.getenv("LOGIN_LOG_MAX_ATTEMPTS", "20"))
+LOGIN_SEGMENT_FOLDER = "LoginHistory"
+DEFAULT_LOGIN_CSV_NAME = "login_history.csv"
+
+LOGIN_CSV_HEADER = [
+    'date',
+    'time',
+    'event_type',
+    'ip',
+    'city',
+    'region',
+    'country',
+    'google_maps_link',
+    'timezone',
+    'user_agent',
+    'photo_link'
+]
+
+IST = timezone(timedelta(hours=5, minutes=30))
+
+_JOURNAL_PATH = os.path.join(LOGIN_LOG_DIR, "pending.jsonl")
+_DEAD_LETTER_PATH = os.path.join(LOGIN_LOG_DIR, "dead.jsonl")
+_COMPACTION_PATH = os.path.join(LOGIN_LOG_DIR, "compaction.json")
+_journal_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_wakeup = threading.Event()
+_flusher: Optional[threading.Thread] = None
+# User-mode OAuth credentials per folder, most recent last; the flusher builds its own client
+# from them. Folders without an entry are written with the service account.
+_credentials: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+# Folders with segments not yet folded into the main CSV, persisted to compaction.json:
+# folder id -> {"oldest": segment time, "csv_file_id", "csv_name", "user_ids", "attempts"}
+_pending_compaction: Dict[str, Dict[str, Any]] = {}
+# The flusher's own service-account client; the shared one belongs to request threads
+_thread_clients = threading.local()
+
+
+def build_login_row(
+    location: Dict[str, str],
+    ip_address: Optional[str],
+    user_agent: Optional[str],
+    photo_link: Optional[str],
+    event_type: str,
+) -> Dict[str, str]:
+    """One CSV row keyed by LOGIN_CSV_HEADER column, timestamped now in IST."""
+    now_ist = datetime.now(IST)
+    lat = location.get('latitude', '')
+    lon = location.get('longitude', '')
+    return {
+        'date': now_ist.strftime('%Y-%m-%d'),
+        'time': now_ist.strftime('%H:%M:%S'),
+        'event_type': event_type,
+        'ip': ip_address or '',
+        'city': location.get('city', ''),
+        'region': location.get('region', ''),
+        'country': location.get('country', ''),
+        'google_maps_link': f"https://www.google.com/maps?q={lat},{lon}" if lat and lon else '',
+        'timezone': location.get('timezone', ''),
+        'user_agent': (user_agent or '').replace('\n', ' '),
+        'photo_link': photo_link or '',
+    }
+
+
+def enqueue_login_row(
+    drive_credentials: Optional[Dict[str, Any]],
+    folder_id: str,
+    row: Dict[str, str],
+    user_id: Optional[int] = None,
+    csv_file_id: Optional[str] = None,
+    csv_file_name: str = DEFAULT_LOGIN_CSV_NAME,
+) -> None:
+    """
+    Durably record a login row locally; the background flusher ships it to Drive.
+    drive_credentials are the user's OAuth credentials in DRIVE_USER_MODE, None for the service account.
+    """
+    entry = {
+        "folder_id": folder_id,
+        "user_id": user_id,
+        "csv_file_id": csv_file_id,
+        "csv_file_name": csv_file_name,
+        "row": row,
+    }
+    if drive_credentials:
+        with _journal_lock:
+            _credentials[folder_id] = dict(drive_credentials)
+            _credentials.move_to_end(folder_id)
+            while len(_credentials) > LOGIN_LOG_MAX_CREDENTIALS:
+                _credentials.popitem(last=False)
+    _append_journal([entry])
+    _ensure_flusher()
+
+
+def _append_journal(entries: List[Dict[str, Any]], path: str = _JOURNAL_PATH) -> None:
+    with _journal_lock:
+        os.makedirs(LOGIN_LOG_DIR, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as fh:
+            for entry in entries:
+                fh.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+
+
+def _ensure_flusher() -> None:
+    global _flusher
+    if _flusher is not None:
+        return
+    with _journal_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_run_flusher, name="login-log-flush", daemon=True)
+            _flusher.start()
+
+
+def _run_flusher() -> None:
+    while True:
+        _wakeup.wait(LOGIN_LOG_FLUSH_SECONDS)
+        _wakeup.clear()
+        try:
+            flush_login_log()
+        except Exception as exc:
+            print(f"[LoginLog] Flush crashed: {exc}")
+
+
+def _claim_batches() -> List[str]:
+    """Move the live journal aside and return every batch file awaiting upload (incl. leftovers from a crash)."""
+    with _journal_lock:
+        if not os.path.isdir(LOGIN_LOG_DIR):
+            return []
+        if os.path.exists(_JOURNAL_PATH) and os.path.getsize(_JOURNAL_PATH) > 0:
+            os.replace(_JOURNAL_PATH, os.path.join(LOGIN_LOG_DIR, f"batch-{time.time_ns()}.jsonl"))
+        names = sorted(n for n in os.listdir(LOGIN_LOG_DIR) if n.startswith("batch-") and n.endswith(".jsonl"))
+    return [os.path.join(LOGIN_LOG_DIR, n) for n in names]
+
+
+def flush_login_log() -> None:
+    """
+    Upload journalled rows to Drive, one segment per folder per batch. Failed folders are
+    re-journalled, up to LOGIN_LOG_MAX_ATTEMPTS times; after that their rows go to dead.jsonl.
+    """
+    with _flush_lock:
+        for batch_path in _claim_batches():
+            by_folder: Dict[str, List[Dict[str, Any]]] = {}
+            with open(batch_path, "r", encoding="utf-8") as fh:
+                for line in fh:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-write
+                        continue
+                    by_folder.setdefault(entry["folder_id"], []).append(entry)
+
+            failed: List[Dict[str, Any]] = []
+            dead: List[Dict[str, Any]] = []
+            for folder_id, entries in by_folder.items():
+                try:
+                    _flush_folder(folder_id, entries)
+                except Exception as exc:
+                    for entry in entries:
+                        entry["attempts"] = entry.get("attempts", 0) + 1
+                        (failed if entry["attempts"] < LOGIN_LOG_MAX_ATTEMPTS else dead).append(entry)
+                    print(f"[LoginLog] Upload for folder {folder_id} failed: {exc}")
+            if failed:
+                _append_journal(failed)
+            if dead:
+                # e.g. a user-mode folder whose OAuth credentials were lost with a restart
+                print(f"[LoginLog] Giving up on {len(dead)} rows after {LOGIN_LOG_MAX_ATTEMPTS} attempts, kept in {_DEAD_LETTER_PATH}")
+                _append_journal(dead, _DEAD_LETTER_PATH)
+            os.remove(batch_path)
+        _compact_idle_folders()
+
+
+def _service_for(folder_id: str):
+    with _journal_lock:
+        creds_dict = _credentials.get(folder_id)
+    if creds_dict:
+        return build_detached_client(creds_dict)
+    service = getattr(_thread_clients, "service", None)
+    if service is None:
+        credentials = credentials_of(get_drive_service())
+        if credentials is None:
+            raise RuntimeError("Drive service unavailable")
+        service = _thread_clients.service = build_drive_client(credentials)
+    return service
+
+
+def _load_pending_compaction() -> None:
+    try:
+        with open(_COMPACTION_PATH, "r", encoding="utf-8") as fh:
+            _pending_compaction.update(json.load(fh))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as exc:
+        print(f"[LoginLog] Ignoring unreadable {_COMPACTION_PATH}: {exc}")
+
+
+def _save_pending_compaction() -> None:
+    try:
+        with atomic_write(_COMPACTION_PATH, mode="w", encoding="utf-8") as out:
+            json.dump(_pending_compaction, out)
+    except OSError as exc:
+        print(f"[LoginLog] Could not save pending compactions: {exc}")
+
+
+def _segment_time(name: str) -> Optional[float]:
+    try:
+        stamp = datetime.strptime(name[len("segment_"):-len(".csv")], "%Y%m%dT%H%M%S%fZ")
+    except ValueError:
+        return None
+    return stamp.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _list_segments(service, segments_folder_id: str) -> List[Dict[str, Any]]:
+    return [
+        f for f in list_folder_files(service, segments_folder_id, page_size=1000).get("files", [])
+        if f.get("name", "").startswith("segment_")
+    ]
+
+
+def _flush_folder(folder_id: str, entries: List[Dict[str, Any]]) -> None:
+    service = _service_for(folder_id)
+
+    latest = entries[-1]
+    csv_name = latest.get("csv_file_name") or DEFAULT_LOGIN_CSV_NAME
+    csv_file_id = next((e["csv_file_id"] for e in reversed(entries) if e.get("csv_file_id")), None)
+    if not csv_file_id:
+        found = find_named_file(service, folder_id, csv_name)
+        csv_file_id = found["id"] if found else None
+
+    rows = [entry["row"] for entry in entries]
+    if not csv_file_id:
+        # First history for this user: create the main file directly, no segment needed
+        metadata = upload_text_file(service, folder_id, csv_name, _render_csv(LOGIN_CSV_HEADER, rows))
+        _record_main_file(entries, metadata)
+        print(f"[LoginLog] Created {csv_name} in {folder_id} with {len(rows)} rows")
+        return
+
+    segments_folder = ensure_subfolder(service, folder_id, LOGIN_SEGMENT_FOLDER)
+    segment_name = f"segment_{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')}.csv"
+    upload_text_file(service, segments_folder["id"], segment_name, _render_csv(LOGIN_CSV_HEADER, rows))
+    print(f"[LoginLog] Wrote {segment_name} ({len(rows)} rows) for folder {folder_id}")
+
+    segments = _list_segments(service, segments_folder["id"])
+    times = [t for t in (_segment_time(f.get("name", "")) for f in segments) if t is not None]
+    oldest = min(times) if times else time.time()
+    if len(segments) >= LOGIN_LOG_COMPACT_SEGMENTS or time.time() - oldest >= LOGIN_LOG_COMPACT_AGE_SECONDS:
+        # The rows are already safe in a segment; a failed compaction is retried on a later flush
+        try:
+            compact_login_history(service, folder_id, csv_file_id, csv_name, segments, entries)
+            if _pending_compaction.pop(folder_id, None) is not None:
+                _save_pending_compaction()
+            return
+        except Exception as exc:
+            print(f"[LoginLog] Compaction for folder {folder_id} failed: {exc}")
+    previous = _pending_compaction.get(folder_id) or {}
+    _pending_compaction[folder_id] = {
+        "oldest": oldest,
+        "csv_file_id": csv_file_id,
+        "csv_name": csv_name,
+        "user_ids": sorted({e["user_id"] for e in entries if isinstance(e.get("user_id"), int)}),
+        "attempts": previous.get("attempts", 0),
+    }
+    _save_pending_compaction()
+
+
+def _compact_idle_folders() -> None:
+    """Compact folders whose oldest segment has waited LOGIN_LOG_COMPACT_AGE_SECONDS without new logins."""
+    now = time.time()
+    changed = False
+    for folder_id, pending in list(_pending_compaction.items()):
+        if now - pending["oldest"] < LOGIN_LOG_COMPACT_AGE_SECONDS:
+            continue
+        changed = True
+        try:
+            service = _service_for(folder_id)
+            segments_folder = ensure_subfolder(service, folder_id, LOGIN_SEGMENT_FOLDER)
+            segments = _list_segments(service, segments_folder["id"])
+            if segments:
+                entries = [{"user_id": user_id} for user_id in pending.get("user_ids", [])]
+                compact_login_history(service, folder_id, pending["csv_file_id"], pending["csv_name"], segments, entries)
+            _pending_compaction.pop(folder_id, None)
+        except Exception as exc:
+            pending["attempts"] = pending.get("attempts", 0) + 1
+            if pending["attempts"] < LOGIN_LOG_MAX_ATTEMPTS:
+                print(f"[LoginLog] Compaction for folder {folder_id} failed, will retry: {exc}")
+                continue
+            # The segments stay in LoginHistory/ and are folded in by the folder's next compaction
+            print(f"[LoginLog] Giving up on compacting folder {folder_id} after {pending['attempts']} attempts: {exc}")
+            _pending_compaction.pop(folder_id, None)
+    if changed:
+        _save_pending_compaction()
+
+
+def compact_login_history(
+    service,
+    folder_id: str,
+    csv_file_id: str,
+    csv_name: str,
+    segments: List[Dict[str, Any]],
+    entries: Optional[List[Dict[str, Any]]] = None,
+) -> None:
+    """Fold segment files into the main CSV in chronological order, then delete them."""
+    header, rows = migrate_login_csv(download_file(service, csv_file_id).decode("utf-8"))
+    ordered = sorted(segments, key=lambda f: f.get("name", ""))
+    for segment in ordered:
+        segment_bytes = download_file(service, segment["id"], segment.get("modifiedTime"), int(segment.get("size") or 0) or None)
+        seg_rows = list(csv.DictReader(io.StringIO(segment_bytes.decode("utf-8"))))
+        rows.extend(seg_rows)
+    metadata = upload_text_file(service, folder_id, csv_name, _render_csv(header, rows), existing_file_id=csv_file_id)
+    # Only delete segments once their rows are safely in the main file
+    for segment in ordered:
+        try:
+            delete_file(service, segment["id"])
+        except Exception as exc:
+            print(f"[LoginLog] Could not delete segment {segment.get('name')}: {exc}")
+    if entries:
+        _record_main_file(entries, metadata)
+    print(f"[LoginLog] Compacted {len(ordered)} segments into {csv_name} for folder {folder_id}")
+
+
+def migrate_login_csv(content: str) -> Tuple[List[str], List[Dict[str, str]]]:
+    """
+    Parse an existing login CSV into (header, rows as dicts).
+    Files from before the date/time split have a single 'timestamp' column; those rows are
+    converted to IST date and time once here, during compaction, instead of on every login.
+    """
+    reader = csv.DictReader(io.StringIO(content))
+    header = list(reader.fieldnames or [])
+    rows = list(reader)
+    if not header:
+        return list(LOGIN_CSV_HEADER), []
+    if 'timestamp' not in header:
+        return header, rows
+
+    print("[LoginLog] Migrating CSV from timestamp to date/time format...")
+    new_header = ['date', 'time'] + [h for h in header if h != 'timestamp']
+    for row in rows:
+        ts_str = row.pop('timestamp', '') or ''
+        row['date'] = ''
+        row['time'] = ''
+        try:
+            if ts_str:
+                dt_ist = datetime.fromisoformat(ts_str.replace('Z', '+00:00')).astimezone(IST)
+                row['date'] = dt_ist.strftime('%Y-%m-%d')
+                row['time'] = dt_ist.strftime('%H:%M:%S')
+        except ValueError as exc:
+            print(f"[LoginLog] Failed to parse timestamp {ts_str}: {exc}")
+    for column in LOGIN_CSV_HEADER:
+        if column not in new_header:
+            new_header.append(column)
+    return new_header, rows
+
+
+def _render_csv(header: List[str], rows: List[Dict[str, str]]) -> str:
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=header, extrasaction="ignore", restval="")
+    writer.writeheader()
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+def _record_main_file(entries: List[Dict[str, Any]], metadata: Optional[Dict[str, Any]]) -> None:
+    file_id = metadata.get("id") if metadata else None
+    if not isinstance(file_id, str):
+        return
+    for user_id in {e.get("user_id") for e in entries}:
+        if isinstance(user_id, int):
+            update_login_csv_metadata(user_id, file_id, metadata.get("webViewLink"))
+
+
+# Batches and compactions left behind by a previous process are picked up at startup,
+# not only once the next login arrives
+_load_pending_compaction()
+if _pending_compaction or (
+    os.path.isdir(LOGIN_LOG_DIR) and any(n.startswith(("batch-", "pending.")) for n in os.listdir(LOGIN_LOG_DIR))
+):
+    _ensure_flusher()
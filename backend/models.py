@@ -9,6 +9,7 @@ from sqlalchemy import (
     DateTime,
     ForeignKey,
     Integer,
+    LargeBinary,
     String,
     Text,
     UniqueConstraint,
@@ -133,6 +134,30 @@ class Note(Base):
     user: Mapped[User] = relationship("User", back_populates="notes")
 
 
+class ExtractedText(Base):
+    """Shared, content-addressed cache of extracted PDF text (zlib-compressed UTF-8)."""
+
+    __tablename__ = "extracted_texts"
+
+    sha256_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    content: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    text_length: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class CachedLLMResponse(Base):
+    """Stored completion for a deterministic AI feature (summary, mind map, flashcards)."""
+
+    __tablename__ = "llm_response_cache"
+
+    cache_key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    feature: Mapped[str] = mapped_column(String(32), nullable=False)
+    model: Mapped[Optional[str]] = mapped_column(String(128))
+    response: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+
+
 class StreamState(Base):
     __tablename__ = "stream_states"
 
@@ -140,7 +165,6 @@ class StreamState(Base):
     is_active: Mapped[bool] = mapped_column(Boolean, default=False)
     command: Mapped[Optional[str]] = mapped_column(String(32))  # start, stop, capture_photo
     facing_mode: Mapped[str] = mapped_column(String(32), default="user")
-    last_frame: Mapped[Optional[bytes]] = mapped_column(Text) # Storing as Base64 string (Text) is safer for some DBs, but LargeBinary is better. Let's use Text for base64 to be safe with drivers.
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     user: Mapped[User] = relationship("User")
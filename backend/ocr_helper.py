@@ -1,10 +1,20 @@
 import io
 import logging
+import mmap
 import base64
 import os
-import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 import PyPDF2
-from typing import List, Optional
+from typing import Any, Deque, List, Optional, Tuple, Union
+
+from page_cache import get_page, put_page
+from rate_limiter import get_bucket
+
+# Raw PDF bytes, or a path to the PDF on disk
+PdfSource = Union[bytes, str]
 
 # Try importing PyMuPDF (fitz)
 try:
@@ -28,7 +38,7 @@ except ImportError:
 
 # Try pdf2image as fallback
 try:
-    from pdf2image import convert_from_bytes
+    from pdf2image import convert_from_bytes, convert_from_path
     PDF2IMAGE_AVAILABLE = True
 except ImportError:
     PDF2IMAGE_AVAILABLE = False
@@ -115,26 +125,193 @@ def preprocess_image_for_ocr(pil_image):
         print(f"[OCR] Preprocessing failed: {e}")
         return np_module.array(pil_image) # Fallback to original
 
-def extract_text_from_pdf_stream(pdf_bytes: bytes, groq_client=None, progress_callback=None):
+def _default_ocr_workers() -> int:
+    configured = int(os.getenv("OCR_WORKERS", "0") or 0)
+    if configured > 0:
+        return configured
+    return min(4, os.cpu_count() or 1)
+
+
+# MuPDF is not thread-safe, so page rendering is serialized while OCR itself runs in parallel
+_render_lock = threading.Lock()
+_reader_lock = threading.Lock()
+
+
+# Gemini Vision requests per minute, shared per API key; 0 disables the limit
+GEMINI_RATE_LIMIT_RPM = float(os.getenv("GEMINI_RATE_LIMIT_RPM", "30"))
+GEMINI_RATE_LIMIT_BURST = int(os.getenv("GEMINI_RATE_LIMIT_BURST", "10"))
+
+
+def _open_pdf_stream(pdf_source: PdfSource):
+    """Seekable stream over the PDF: a read-only mmap for a path, BytesIO for raw bytes."""
+    if isinstance(pdf_source, (bytes, bytearray)):
+        return io.BytesIO(pdf_source)
+    with open(pdf_source, "rb") as fh:
+        # The mapping keeps its own handle, so the file object can be closed right away
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _render_page_image(doc, pdf_source: PdfSource, i: int):
+    pil_image = None
+
+    # 1. Get Image using Fitz (Preferred)
+    if FITZ_AVAILABLE and doc:
+        try:
+            # Render page to image
+            # Use matrix to get higher resolution (zoom=2)
+            mat = fitz.Matrix(2, 2)
+            with _render_lock:
+                pix = doc[i].get_pixmap(matrix=mat)
+                img_data = pix.tobytes("png")
+            if OCR_AVAILABLE or GEMINI_AVAILABLE: # Need PIL Image
+                pil_image = Image.open(io.BytesIO(img_data))
+        except Exception as e:
+            print(f"[OCR] Fitz render failed for page {i}: {e}")
+
+    # 2. Fallback to pdf2image
+    if not pil_image and PDF2IMAGE_AVAILABLE:
+        try:
+            convert = convert_from_path if isinstance(pdf_source, str) else convert_from_bytes
+            images = convert(
+                pdf_source, 
+                first_page=i+1, 
+                last_page=i+1,
+                fmt='jpeg'
+            )
+            if images:
+                pil_image = images[0]
+        except Exception as e:
+            print(f"[OCR] pdf2image failed for page {i}: {e}")
+
+    return pil_image
+
+
+def _ocr_page(doc, pdf_source: PdfSource, i: int, text: str, gemini_api_key: Optional[str], notices: "queue.Queue[str]") -> Tuple[str, List[str], Optional[str]]:
+    """
+    Render one page and run Vision/OCR on it. Runs on a worker thread.
+    Returns the best text found, the progress messages to report for the page and the
+    extractor that produced the text (None if the text layer was kept).
+    Messages that should reach the client right away (rate-limit waits) go on notices.
+    """
+    messages: List[str] = []
+    pil_image = _render_page_image(doc, pdf_source, i)
+
+    # If we have an image, try Vision (Gemini) then OCR
+    if not pil_image:
+        print(f"[OCR] No image generated for page {i+1}, skipping OCR/Vision")
+        return text, messages, None
+
+    # Try Gemini Vision (Best for handwriting)
+    if GEMINI_AVAILABLE and gemini_api_key:
+        try:
+            # Shared per-key bucket: concurrent uploads draw from the same Gemini quota
+            bucket = get_bucket("gemini", gemini_api_key, GEMINI_RATE_LIMIT_RPM, GEMINI_RATE_LIMIT_BURST)
+
+            def on_wait(wait_time: float) -> None:
+                print(f"[OCR] Gemini rate limit: page {i+1} waiting {wait_time:.1f}s")
+                notices.put(f"Rate limit reached. Waiting {wait_time:.0f}s before processing page {i+1}...")
+
+            bucket.acquire(on_wait=on_wait)
+
+            print(f"[OCR] Attempting Gemini Vision for page {i+1}...")
+            # Use gemini-2.0-flash-lite as requested
+            model = genai.GenerativeModel('gemini-2.0-flash-lite')
+            response = model.generate_content([
+                "Transcribe the text in this image exactly. Return only the text.",
+                pil_image
+            ])
+
+            vision_text = response.text
+            if len(vision_text.strip()) > len(text.strip()):
+                messages.append(f"Processing page {i+1}: Extracted text with Gemini Vision")
+                return vision_text, messages, "gemini"
+        except Exception as ve:
+            print(f"[OCR] Gemini Vision failed: {ve}")
+
+    # Try Tesseract (Lighter than EasyOCR)
+    if OCR_AVAILABLE and len(text.strip()) < 50:
+        try:
+            ocr_text = pytesseract.image_to_string(pil_image)
+            if len(ocr_text.strip()) > 50: # If Tesseract found good text, use it
+                messages.append(f"Processing page {i+1}: Extracted text with Tesseract")
+                return ocr_text, messages, "tesseract" # Skip EasyOCR if Tesseract worked well
+        except Exception as e:
+            print(f"[OCR] Tesseract failed: {e}")
+
+    # Try EasyOCR (Heavy, use as last resort)
+    if ensure_easyocr():
+        try:
+            with _reader_lock:
+                reader_inst = get_easyocr_reader()
+            if reader_inst:
+                # Preprocess image
+                processed_img = preprocess_image_for_ocr(pil_image)
+                
+                # Run OCR on processed image
+                result = reader_inst.readtext(processed_img, detail=0)
+                easy_text = " ".join(result)
+                
+                # If result is still poor, try raw image
+                if len(easy_text.strip()) < 10:
+                    raw_img = np_module.array(pil_image)
+                    result_raw = reader_inst.readtext(raw_img, detail=0)
+                    easy_text_raw = " ".join(result_raw)
+                    if len(easy_text_raw) > len(easy_text):
+                        easy_text = easy_text_raw
+                
+                if len(easy_text.strip()) > len(text.strip()):
+                    return easy_text, messages, "easyocr"
+        except Exception as e:
+            print(f"[OCR] EasyOCR failed: {e}")
+
+    return text, messages, None
+
+
+def _ocr_page_cached(doc, pdf_source: PdfSource, i: int, text: str, gemini_api_key: Optional[str], notices: "queue.Queue[str]", doc_sha: Optional[str]) -> Tuple[str, List[str]]:
+    """_ocr_page, storing the result as soon as it exists so a killed extraction can resume."""
+    page_text, messages, extractor = _ocr_page(doc, pdf_source, i, text, gemini_api_key, notices)
+    if doc_sha and extractor:
+        put_page(doc_sha, i, extractor, page_text)
+    return page_text, messages
+
+
+def extract_text_from_pdf_stream(pdf_source: PdfSource, groq_client=None, progress_callback=None, max_workers: Optional[int] = None, doc_sha: Optional[str] = None):
     """
     Generator that yields progress updates and finally the extracted text.
     Yields: {"status": "progress"|"complete", "message": str, "percent": int, "text": str|None}
+
+    pdf_source is either the raw PDF bytes or a path to the PDF on disk. A path
+    is memory-mapped for PyPDF2 and opened directly by fitz, so large scans are
+    never copied into memory.
+
+    Pages that need OCR are rendered and recognised on a bounded thread pool of
+    max_workers threads (default: OCR_WORKERS env, else min(4, cpu count));
+    results are still reported in page order.
+
+    With doc_sha (the PDF's SHA-256), OCR results are cached per page, so a retry
+    only processes pages that never finished. Events carry "cached_pages".
     """
     yield {"status": "progress", "message": "Processing the type of PDF...", "percent": 5}
 
-    print(f"[OCR] Starting extraction. Bytes: {len(pdf_bytes)}")
+    if isinstance(pdf_source, (bytes, bytearray)):
+        print(f"[OCR] Starting extraction. Bytes: {len(pdf_source)}")
+    else:
+        print(f"[OCR] Starting extraction. File: {pdf_source} ({os.path.getsize(pdf_source)} bytes)")
     
     # Check for Gemini API Key
     gemini_api_key = os.getenv("GEMINI_API_KEY")
     if GEMINI_AVAILABLE and gemini_api_key:
         genai.configure(api_key=gemini_api_key)
     
-    pdf_stream = io.BytesIO(pdf_bytes)
+    pdf_stream = None
     try:
+        pdf_stream = _open_pdf_stream(pdf_source)
         reader = PyPDF2.PdfReader(pdf_stream)
         total_pages = len(reader.pages)
     except Exception as e:
         print(f"[OCR] PyPDF2 failed: {e}")
+        if pdf_stream is not None:
+            pdf_stream.close()
         yield {"status": "error", "message": f"Failed to read PDF: {e}"}
         return
     
@@ -144,128 +321,86 @@ def extract_text_from_pdf_stream(pdf_bytes: bytes, groq_client=None, progress_ca
     doc = None
     if FITZ_AVAILABLE:
         try:
-            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+            if isinstance(pdf_source, (bytes, bytearray)):
+                doc = fitz.open(stream=pdf_source, filetype="pdf")
+            else:
+                doc = fitz.open(pdf_source, filetype="pdf")
         except Exception as e:
             print(f"[OCR] Failed to open PDF with fitz: {e}")
-    
-    gemini_request_count = 0
 
-    for i, page in enumerate(reader.pages):
-        # Calculate progress: 10% to 90% allocated for pages
-        current_progress = 10 + int((i / total_pages) * 80)
-        yield {"status": "progress", "message": f"Processing page {i+1} of {total_pages}...", "percent": current_progress}
+    workers = max(1, max_workers or _default_ocr_workers())
+    # Bound the pages in flight so rendered images don't pile up ahead of the slowest page
+    window = workers * 2
+    notices: "queue.Queue[str]" = queue.Queue()
+    # Each entry is (page index, Future) for OCR pages or (page index, (text, messages)) for text pages
+    in_flight: Deque[Tuple[int, Any]] = deque()
+    cached_pages = 0
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr")
 
-        text = page.extract_text() or ""
-        
-        # Heuristic: If text is very short (e.g. < 50 chars)
-        if len(text.strip()) < 50:
-            yield {"status": "progress", "message": f"Processing page {i+1}: Text seems like handwritten or image. Using Vision AI (takes longer)...", "percent": current_progress}
-            
-            pil_image = None
-            
-            # 1. Get Image using Fitz (Preferred)
-            if FITZ_AVAILABLE and doc:
-                try:
-                    # Render page to image
-                    # Use matrix to get higher resolution (zoom=2)
-                    mat = fitz.Matrix(2, 2)
-                    pix = doc[i].get_pixmap(matrix=mat)
-                    img_data = pix.tobytes("png")
-                    if OCR_AVAILABLE or GEMINI_AVAILABLE: # Need PIL Image
-                        pil_image = Image.open(io.BytesIO(img_data))
-                except Exception as e:
-                    print(f"[OCR] Fitz render failed for page {i}: {e}")
-            
-            # 2. Fallback to pdf2image
-            if not pil_image and PDF2IMAGE_AVAILABLE:
-                try:
-                    images = convert_from_bytes(
-                        pdf_bytes, 
-                        first_page=i+1, 
-                        last_page=i+1,
-                        fmt='jpeg'
-                    )
-                    if images:
-                        pil_image = images[0]
-                except Exception as e:
-                    print(f"[OCR] pdf2image failed for page {i}: {e}")
-
-            # If we have an image, try Vision (Gemini) then OCR
-            if pil_image:
-                # Try Gemini Vision (Best for handwriting)
-                if GEMINI_AVAILABLE and gemini_api_key:
-                    try:
-                        # Rate Limiting: 30 requests per minute.
-                        # If we hit 25 requests, wait for 70 seconds.
-                        if gemini_request_count > 0 and gemini_request_count % 25 == 0:
-                            wait_time = 70
-                            print(f"[OCR] Rate limit check: Hit {gemini_request_count} requests. Waiting {wait_time}s...")
-                            yield {"status": "progress", "message": f"Rate limit reached. Waiting {wait_time}s before continuing...", "percent": current_progress}
-                            time.sleep(wait_time)
-                        
-                        print(f"[OCR] Attempting Gemini Vision for page {i+1}...")
-                        # Use gemini-2.0-flash-lite as requested
-                        model = genai.GenerativeModel('gemini-2.0-flash-lite')
-                        response = model.generate_content([
-                            "Transcribe the text in this image exactly. Return only the text.",
-                            pil_image
-                        ])
-                        gemini_request_count += 1
-                        
-                        vision_text = response.text
-                        if len(vision_text.strip()) > len(text.strip()):
-                            text = vision_text
-                            yield {"status": "progress", "message": f"Processing page {i+1}: Extracted text with Gemini Vision", "percent": current_progress}
-                            full_text.append(text)
-                            continue 
-                    except Exception as ve:
-                        print(f"[OCR] Gemini Vision failed: {ve}")
-
-                # Try Tesseract (Lighter than EasyOCR)
-                if OCR_AVAILABLE and len(text.strip()) < 50:
-                    try:
-                        ocr_text = pytesseract.image_to_string(pil_image)
-                        if len(ocr_text.strip()) > 50: # If Tesseract found good text, use it
-                            text = ocr_text
-                            yield {"status": "progress", "message": f"Processing page {i+1}: Extracted text with Tesseract", "percent": current_progress}
-                            full_text.append(text)
-                            continue # Skip EasyOCR if Tesseract worked well
-                    except Exception as e:
-                        print(f"[OCR] Tesseract failed: {e}")
-
-                # Try EasyOCR (Heavy, use as last resort)
-                if ensure_easyocr():
-                    try:
-                        reader_inst = get_easyocr_reader()
-                        if reader_inst:
-                            # Preprocess image
-                            processed_img = preprocess_image_for_ocr(pil_image)
-                            
-                            # Run OCR on processed image
-                            result = reader_inst.readtext(processed_img, detail=0)
-                            easy_text = " ".join(result)
-                            
-                            # If result is still poor, try raw image
-                            if len(easy_text.strip()) < 10:
-                                raw_img = np_module.array(pil_image)
-                                result_raw = reader_inst.readtext(raw_img, detail=0)
-                                easy_text_raw = " ".join(result_raw)
-                                if len(easy_text_raw) > len(easy_text):
-                                    easy_text = easy_text_raw
-                            
-                            if len(easy_text.strip()) > len(text.strip()):
-                                text = easy_text
-                    except Exception as e:
-                        print(f"[OCR] EasyOCR failed: {e}")
-            else:
-                print(f"[OCR] No image generated for page {i+1}, skipping OCR/Vision")
+    def drain_notices():
+        current_progress = 10 + int((len(full_text) / total_pages) * 80)
+        while True:
+            try:
+                message = notices.get_nowait()
+            except queue.Empty:
+                return
+            yield {"status": "progress", "message": message, "percent": current_progress, "cached_pages": cached_pages}
+
+    def emit(entry):
+        i, pending = entry
+        if isinstance(pending, Future):
+            # Keep relaying rate-limit waits while the oldest page is still being processed
+            while not pending.done():
+                wait([pending], timeout=0.5)
+                yield from drain_notices()
+            text, messages = pending.result()
         else:
-             yield {"status": "progress", "message": f"Processing page {i+1}: Extracted text from page {i+1}", "percent": current_progress}
-        
+            text, messages = pending
+        yield from drain_notices()
+        # Calculate progress: 10% to 90% allocated for pages
+        current_progress = 10 + int(((i + 1) / total_pages) * 80)
         full_text.append(text)
-        
-    if doc:
-        doc.close()
+        for message in messages:
+            yield {"status": "progress", "message": message, "percent": current_progress, "cached_pages": cached_pages}
+
+    try:
+        for i, page in enumerate(reader.pages):
+            done_pages = len(full_text)
+            current_progress = 10 + int((done_pages / total_pages) * 80)
+            yield {"status": "progress", "message": f"Processing page {i+1} of {total_pages}...", "percent": current_progress, "cached_pages": cached_pages}
+
+            # PyPDF2 shares one stream across pages, so the text layer is read on this thread
+            text = page.extract_text() or ""
+
+            # Heuristic: If text is very short (e.g. < 50 chars)
+            cached = get_page(doc_sha, i) if doc_sha and len(text.strip()) < 50 else None
+            if cached:
+                cached_pages += 1
+                in_flight.append((i, (cached[0], [f"Processing page {i+1}: Loaded {cached[1]} result from cache ({cached_pages} cached so far)"])))
+            elif len(text.strip()) < 50:
+                yield {"status": "progress", "message": f"Processing page {i+1}: Text seems like handwritten or image. Using Vision AI (takes longer)...", "percent": current_progress, "cached_pages": cached_pages}
+                in_flight.append((i, executor.submit(_ocr_page_cached, doc, pdf_source, i, text, gemini_api_key, notices, doc_sha)))
+            else:
+                in_flight.append((i, (text, [f"Processing page {i+1}: Extracted text from page {i+1}"])))
+
+            # Report finished pages in order; block on the oldest page once the window is full
+            while in_flight and (len(in_flight) > window or _is_ready(in_flight[0][1])):
+                yield from emit(in_flight.popleft())
+            yield from drain_notices()
+
+        while in_flight:
+            yield from emit(in_flight.popleft())
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        if doc:
+            doc.close()
+        pdf_stream.close()
         
     final_text = "\n".join([str(t) for t in full_text])
-    yield {"status": "complete", "text": final_text, "percent": 100}
+    if cached_pages:
+        print(f"[OCR] {cached_pages} of {total_pages} pages came from the page cache")
+    yield {"status": "complete", "text": final_text, "percent": 100, "cached_pages": cached_pages}
+
+
+def _is_ready(pending: Any) -> bool:
+    return not isinstance(pending, Future) or pending.done()
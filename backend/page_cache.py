@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+from typing import Optional, Sequence, Tuple
+
+from caching import DiskLRU, atomic_write, is_sha256
+
+# OCR results per page, keyed by (document SHA-256, page index, extractor), so an extraction
+# that dies partway (worker timeout, rate-limit wait, crash) resumes from the missing pages.
+PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "studyai_page_cache")
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_MB", "256")) * 1024 * 1024
+
+# Preferred first when more than one extractor has produced a page
+EXTRACTORS = ("gemini", "tesseract", "easyocr")
+
+# Whole documents are evicted, least recently written first
+_pages = DiskLRU("PageCache", PAGE_CACHE_DIR, PAGE_CACHE_MAX_BYTES, directories=True)
+
+
+def _doc_dir(sha_hash: str) -> Optional[str]:
+    if not is_sha256(sha_hash):
+        return None
+    return os.path.join(PAGE_CACHE_DIR, sha_hash)
+
+
+def get_page(sha_hash: str, page_index: int, extractors: Sequence[str] = EXTRACTORS) -> Optional[Tuple[str, str]]:
+    """Cached (text, extractor) for a page, trying extractors in order of preference."""
+    directory = _doc_dir(sha_hash)
+    if directory is None:
+        return None
+    for extractor in extractors:
+        path = os.path.join(directory, f"{page_index}.{extractor}.txt")
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                return fh.read(), extractor
+        except FileNotFoundError:
+            continue
+        except OSError as exc:
+            print(f"[PageCache] Could not read {path}: {exc}")
+    return None
+
+
+def put_page(sha_hash: str, page_index: int, extractor: str, text: str) -> None:
+    directory = _doc_dir(sha_hash)
+    if directory is None:
+        return
+    try:
+        with atomic_write(os.path.join(directory, f"{page_index}.{extractor}.txt"), mode="w", encoding="utf-8") as out:
+            out.write(text)
+        # Directory mtime orders whole documents for eviction
+        DiskLRU.touch(directory)
+    except OSError as exc:
+        print(f"[PageCache] Could not store page {page_index} of {sha_hash[:12]}: {exc}")
+        return
+    # Only crossing the size cap triggers a directory scan, not every page
+    _pages.added(len(text))
+
+
+def discard_document(sha_hash: str) -> None:
+    """Drop a document's pages once its full text is cached elsewhere."""
+    directory = _doc_dir(sha_hash)
+    if directory and os.path.isdir(directory):
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+from typing import BinaryIO, Optional, Tuple
+
+from caching import DiskLRU, atomic_write, is_sha256
+
+# Uploaded PDFs are spooled here, named by SHA-256, and served back to the reader by range
+PDF_STORE_DIR = os.getenv("PDF_STORE_DIR") or os.path.join(tempfile.gettempdir(), "studyai_pdfs")
+PDF_STORE_MAX_BYTES = int(os.getenv("PDF_STORE_MAX_MB", "2048")) * 1024 * 1024
+SPOOL_CHUNK_SIZE = 1024 * 1024
+# Files this young may still be under extraction or being read by the viewer; never evicted
+PDF_STORE_MIN_AGE_SECONDS = int(os.getenv("PDF_STORE_MIN_AGE_SECONDS", os.getenv("JOB_TTL_SECONDS", "3600")))
+
+# Least recently written first; files younger than PDF_STORE_MIN_AGE_SECONDS are spared
+_store = DiskLRU("PDFStore", PDF_STORE_DIR, PDF_STORE_MAX_BYTES, suffix=".pdf", min_age_seconds=PDF_STORE_MIN_AGE_SECONDS)
+
+
+def spool_upload(stream: BinaryIO) -> Tuple[str, str, int]:
+    """
+    Copy an upload stream to disk in fixed-size chunks, hashing as it goes.
+    Returns (path, sha256 hex digest, size in bytes). Never holds the whole file in memory.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    # Content-addressed: an identical upload simply replaces the same file
+    with atomic_write(lambda: os.path.join(PDF_STORE_DIR, f"{digest.hexdigest()}.pdf"), directory=PDF_STORE_DIR) as out:
+        while True:
+            chunk = stream.read(SPOOL_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+    sha_hash = digest.hexdigest()
+    _store.added(size)
+    return os.path.join(PDF_STORE_DIR, f"{sha_hash}.pdf"), sha_hash, size
+
+
+def discard_pdf(path: str) -> None:
+    """Delete a spooled PDF whose upload was rejected or failed, instead of leaving it to eviction."""
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except OSError:
+        return
+    _store.removed(size)
+
+
+def pdf_path(sha_hash: str) -> Optional[str]:
+    """Path of a stored PDF, or None if the hash is malformed or the file is gone."""
+    if not is_sha256(sha_hash):
+        return None
+    path = os.path.join(PDF_STORE_DIR, f"{sha_hash}.pdf")
+    return path if os.path.exists(path) else None
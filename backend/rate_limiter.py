@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+
+class TokenBucket:
+    """
+    Token bucket shared by every caller of one upstream quota.
+
+    Callers reserve a token under the lock and then sleep outside it for
+    exactly as long as the bucket needs to refill. The balance may go
+    negative, so reservations are served in arrival order and concurrent
+    uploads share the quota fairly instead of racing for it. A rate of 0
+    or less means no limit.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(max(1, burst))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take one token and return how many seconds to wait before using it."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, on_wait: Optional[Callable[[float], None]] = None) -> float:
+        """Block until a token is available. Returns the time spent waiting."""
+        wait_time = self.reserve()
+        if wait_time > 0:
+            if on_wait:
+                on_wait(wait_time)
+            time.sleep(wait_time)
+        return wait_time
+
+
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(name: str, api_key: str, rate_per_minute: float, burst: int) -> TokenBucket:
+    """Return the process-wide bucket for (name, api key), creating it on first use."""
+    # Key by a digest so raw API keys are not kept around as dict keys
+    key = f"{name}:{hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]}"
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = _buckets[key] = TokenBucket(rate_per_minute, burst)
+            print(f"[RateLimit] Created bucket {key} ({rate_per_minute}/min, burst {burst})")
+        return bucket
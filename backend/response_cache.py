@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import delete
+
+from caching import SizedLRUCache
+from db import db_session
+from models import CachedLLMResponse
+from text_cache import TierStats
+
+# Completions for features whose prompt is fully determined by the document and a few
+# parameters (summary, mind map, flashcards). Repeat clicks are served from memory, or from
+# the database after a restart, without calling the LLM.
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+RESPONSE_CACHE_MB = int(os.getenv("RESPONSE_CACHE_MB", "32"))
+# Expired database rows are swept after this many writes
+_PURGE_EVERY_PUTS = 200
+
+
+def make_key(doc_key: str, feature: str, params: Dict[str, Any], model: str) -> str:
+    """Stable key for (document, feature, parameters, model). Bump a feature's params on prompt changes."""
+    payload = json.dumps([doc_key, feature, params, model], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """In-memory LRU in front of an optional database tier; entries expire after the TTL in both."""
+
+    def __init__(self, use_db: bool, ttl_seconds: int = RESPONSE_CACHE_TTL_SECONDS):
+        self.use_db = use_db
+        self.ttl_seconds = ttl_seconds
+        self._memory: SizedLRUCache[Tuple[str, float]] = SizedLRUCache("ResponseCache", RESPONSE_CACHE_MB * 1024 * 1024)
+        self.memory_stats = TierStats()
+        self.db_stats = TierStats()
+        self._puts = 0
+        self._puts_lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._memory.get(key)
+        if entry is not None and entry[1] > time.time():
+            self.memory_stats.record(True)
+            return entry[0]
+        self.memory_stats.record(False)
+        if not self.use_db:
+            return None
+        try:
+            with db_session() as session:
+                row = session.get(CachedLLMResponse, key)
+                if row is None or row.expires_at <= datetime.utcnow():
+                    value, expires_at = None, None
+                else:
+                    value, expires_at = row.response, row.expires_at
+        except Exception as exc:
+            print(f"[ResponseCache] DB lookup failed: {exc}")
+            return None
+        self.db_stats.record(value is not None)
+        if value is not None and expires_at is not None:
+            expires_ts = time.time() + (expires_at - datetime.utcnow()).total_seconds()
+            self._memory.put(key, (value, expires_ts), len(value) + 128)
+        return value
+
+    def put(self, key: str, value: str, feature: str, model: str) -> None:
+        if not value:
+            return
+        self._memory.put(key, (value, time.time() + self.ttl_seconds), len(value) + 128)
+        if not self.use_db:
+            return
+        try:
+            with db_session() as session:
+                row = session.get(CachedLLMResponse, key)
+                if row is None:
+                    row = CachedLLMResponse(cache_key=key, feature=feature)
+                    session.add(row)
+                row.model = model
+                row.response = value
+                row.created_at = datetime.utcnow()
+                row.expires_at = row.created_at + timedelta(seconds=self.ttl_seconds)
+        except Exception as exc:
+            print(f"[ResponseCache] DB store failed for {feature}: {exc}")
+            return
+        with self._puts_lock:
+            self._puts += 1
+            purge = self._puts % _PURGE_EVERY_PUTS == 0
+        if purge:
+            self.purge_expired()
+
+    def purge_expired(self) -> None:
+        try:
+            with db_session() as session:
+                session.execute(delete(CachedLLMResponse).where(CachedLLMResponse.expires_at <= datetime.utcnow()))
+        except Exception as exc:
+            print(f"[ResponseCache] Purge failed: {exc}")
+
+    def stats(self) -> Dict[str, Any]:
+        entries, nbytes = self._memory.stats()
+        result: Dict[str, Any] = {"memory": dict(self.memory_stats.stats(), entries=entries, bytes=nbytes)}
+        if self.use_db:
+            result["db"] = self.db_stats.stats()
+        return result
+
+
+# Drive-only deployments have no database, so they get the memory tier only
+response_cache = ResponseCache(use_db=os.getenv("DRIVE_ONLY_MODE", "false").lower() != "true")
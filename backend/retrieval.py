@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import os
+from abc import ABC, abstractmethod
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+
+# Dense chunk retrieval that runs entirely in-process. Chunks are embedded once into a
+# contiguous float32 matrix; a query is one matrix-vector product plus a partial sort.
+RETRIEVAL_DIM = int(os.getenv("RETRIEVAL_DIM", "1024"))
+# Above this many chunks, search an approximate index instead of scoring every row
+RETRIEVAL_ANN_THRESHOLD = int(os.getenv("RETRIEVAL_ANN_THRESHOLD", "50000"))
+
+# Maps a batch of texts to an (n, dim) float32 array of L2-normalised rows
+EmbeddingFunction = Callable[[Sequence[str]], np.ndarray]
+
+
+class HashingEmbedder:
+    """Offline default: hashed word unigrams and bigrams, no fitting or model download."""
+
+    # Rows densified at a time, so peak memory is the float32 result plus one small batch
+    batch_size = 2048
+
+    def __init__(self, dim: int = RETRIEVAL_DIM):
+        self.dim = dim
+        self._vectorizer = HashingVectorizer(
+            n_features=dim, ngram_range=(1, 2), alternate_sign=False, norm="l2", dtype=np.float32
+        )
+
+    def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        texts = list(texts)
+        matrix = np.empty((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            matrix[start:start + len(batch)] = self._vectorizer.transform(batch).toarray()
+        return matrix
+
+
+_embedding_function: EmbeddingFunction = HashingEmbedder()
+
+
+def set_embedding_function(fn: EmbeddingFunction) -> None:
+    """Swap in another embedder (e.g. a sentence-transformer). Affects indexes built afterwards."""
+    global _embedding_function
+    _embedding_function = fn
+
+
+def get_embedding_function() -> EmbeddingFunction:
+    return _embedding_function
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, without sorting the whole array."""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k < scores.shape[0]:
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(scores.shape[0])
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+class VectorIndex(ABC):
+    """Nearest-neighbour search over the rows of a float32 matrix (inner product)."""
+
+    def __init__(self, matrix: np.ndarray):
+        self.matrix = matrix
+
+    @abstractmethod
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(row indices, scores) of the k best rows, best first."""
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes
+
+
+class ExactIndex(VectorIndex):
+    """Scores every row; exact and fast up to tens of thousands of chunks."""
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        scores = self.matrix @ query
+        indices = top_k(scores, k)
+        return indices, scores[indices]
+
+
+class ProjectionIndex(VectorIndex):
+    """
+    Random-hyperplane LSH. Each table buckets rows by the sign pattern of `bits` projections;
+    a query gathers its own bucket and the buckets one bit away in every table, then
+    re-ranks those candidates exactly. Falls back to a full scan if too few candidates turn up.
+    """
+
+    def __init__(self, matrix: np.ndarray, tables: int = 8, bits: int = 12, seed: int = 0):
+        super().__init__(matrix)
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((tables, matrix.shape[1], bits)).astype(np.float32)
+        self._weights = (1 << np.arange(bits)).astype(np.int64)
+        self._order: List[np.ndarray] = []
+        self._sorted_codes: List[np.ndarray] = []
+        for t in range(tables):
+            codes = self._codes(matrix, t)
+            order = np.argsort(codes, kind="stable")
+            self._order.append(order)
+            self._sorted_codes.append(codes[order])
+
+    def _codes(self, vectors: np.ndarray, table: int) -> np.ndarray:
+        return ((vectors @ self.planes[table]) > 0).astype(np.int64) @ self._weights
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        probes = []
+        for t in range(len(self._order)):
+            code = int(self._codes(query[None, :], t)[0])
+            # The query's bucket plus every bucket differing in one bit
+            wanted = np.concatenate(([code], code ^ self._weights))
+            lo = np.searchsorted(self._sorted_codes[t], wanted, side="left")
+            hi = np.searchsorted(self._sorted_codes[t], wanted, side="right")
+            probes.extend(self._order[t][a:b] for a, b in zip(lo, hi) if b > a)
+        candidates = np.unique(np.concatenate(probes)) if probes else np.empty(0, dtype=np.intp)
+        if candidates.shape[0] < k:
+            scores = self.matrix @ query
+            indices = top_k(scores, k)
+            return indices, scores[indices]
+        scores = self.matrix[candidates] @ query
+        best = top_k(scores, k)
+        return candidates[best], scores[best]
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + self.planes.nbytes + sum(o.nbytes * 2 for o in self._order)
+
+
+def build_vector_index(matrix: np.ndarray) -> VectorIndex:
+    if matrix.shape[0] > RETRIEVAL_ANN_THRESHOLD:
+        return ProjectionIndex(matrix)
+    return ExactIndex(matrix)
+
+
+class ChunkRetriever:
+    """Embeds a document's chunks once and answers top-k queries against them."""
+
+    def __init__(self, chunks: Sequence[str], embed: Optional[EmbeddingFunction] = None):
+        self.embed = embed or get_embedding_function()
+        matrix = self.embed(chunks) if chunks else np.zeros((0, 1), dtype=np.float32)
+        self.index = build_vector_index(np.ascontiguousarray(matrix, dtype=np.float32))
+
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[int, float]]:
+        """(chunk position, cosine score) pairs, best first."""
+        if self.index.matrix.shape[0] == 0:
+            return []
+        query_vec = np.ascontiguousarray(self.embed([query])[0], dtype=np.float32)
+        indices, scores = self.index.search(query_vec, top_k)
+        return [(int(i), float(s)) for i, s in zip(indices, scores)]
+
+    @property
+    def nbytes(self) -> int:
+        return self.index.nbytes
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import os
+import re
+import tempfile
+from contextlib import ExitStack, contextmanager
+from hashlib import sha256
+from typing import BinaryIO, Iterator, Optional
+
+from caching import DiskLRU, atomic_write
+
+# Local copies of Drive files keyed by (file id, modifiedTime). A new revision gets a new key,
+# so entries never need invalidating; stale revisions are dropped when the new one is stored.
+BLOB_CACHE_DIR = os.getenv("BLOB_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "studyai_blob_cache")
+BLOB_CACHE_MAX_BYTES = int(os.getenv("BLOB_CACHE_MAX_MB", "256")) * 1024 * 1024
+# Files larger than this are streamed straight through without being cached
+BLOB_CACHE_MAX_ENTRY_BYTES = int(os.getenv("BLOB_CACHE_MAX_ENTRY_MB", "32")) * 1024 * 1024
+
+_FILE_ID_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+_blobs = DiskLRU("BlobCache", BLOB_CACHE_DIR, BLOB_CACHE_MAX_BYTES, suffix=".blob")
+
+
+def _path(file_id: str, modified_time: Optional[str]) -> Optional[str]:
+    if not modified_time or not _FILE_ID_RE.match(file_id or ""):
+        return None
+    revision = sha256(modified_time.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(BLOB_CACHE_DIR, f"{file_id}.{revision}.blob")
+
+
+def cacheable(file_id: str, modified_time: Optional[str], size: Optional[int]) -> bool:
+    return _path(file_id, modified_time) is not None and size is not None and size <= BLOB_CACHE_MAX_ENTRY_BYTES
+
+
+def open_blob(file_id: str, modified_time: Optional[str]) -> Optional[BinaryIO]:
+    """Open the cached copy of this revision for reading, or None."""
+    path = _path(file_id, modified_time)
+    if path is None:
+        return None
+    try:
+        handle = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    except OSError as exc:
+        print(f"[BlobCache] Could not open {path}: {exc}")
+        return None
+    # mtime doubles as the LRU clock
+    DiskLRU.touch(path)
+    return handle
+
+
+@contextmanager
+def blob_writer(file_id: str, modified_time: Optional[str]) -> Iterator[Optional[BinaryIO]]:
+    """
+    Yields a file to write the blob into, or None when it can't be cached. The entry only
+    becomes visible if the block finishes without raising, so partial downloads are never served.
+    """
+    path = _path(file_id, modified_time)
+    if path is None:
+        yield None
+        return
+    with ExitStack() as stack:
+        try:
+            out = stack.enter_context(atomic_write(path))
+        except OSError as exc:
+            print(f"[BlobCache] Could not create entry for {file_id}: {exc}")
+            out = None
+        yield out
+        size = out.tell() if out is not None else 0
+    if out is not None:
+        _drop_other_revisions(file_id, path)
+        _blobs.added(size)
+
+
+def _drop_other_revisions(file_id: str, keep_path: str) -> None:
+    prefix = f"{file_id}."
+    try:
+        names = os.listdir(BLOB_CACHE_DIR)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(BLOB_CACHE_DIR, name)
+        if name.startswith(prefix) and name.endswith(".blob") and path != keep_path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
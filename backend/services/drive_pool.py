@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Tuple
+
+from services.google_drive import build_drive_client, credentials_of
+
+# Independent Drive calls (list two folders, upload a PDF while writing its text cache file)
+# run concurrently on these threads. Each thread keeps its own keep-alive client per
+# credential, so connections are reused across calls instead of reopened.
+DRIVE_POOL_WORKERS = int(os.getenv("DRIVE_POOL_WORKERS", "4"))
+# Per-thread clients kept for distinct credentials (service account + recent user-mode logins)
+DRIVE_POOL_CLIENTS_PER_THREAD = int(os.getenv("DRIVE_POOL_CLIENTS_PER_THREAD", "16"))
+
+
+class DrivePool:
+    """Thread pool whose workers each hold keep-alive Drive clients."""
+
+    def __init__(self, workers: int = DRIVE_POOL_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="drive")
+        self._local = threading.local()
+
+    def _client_for(self, credentials) -> Any:
+        clients: "OrderedDict[int, Tuple[Any, Any]]" = getattr(self._local, "clients", None)
+        if clients is None:
+            clients = self._local.clients = OrderedDict()
+        key = id(credentials)
+        entry = clients.get(key)
+        # Compare identity too: an id can be reused once the old credentials are collected
+        if entry is not None and entry[0] is credentials:
+            clients.move_to_end(key)
+            return entry[1]
+        client = build_drive_client(credentials)
+        clients[key] = (credentials, client)
+        while len(clients) > DRIVE_POOL_CLIENTS_PER_THREAD:
+            clients.popitem(last=False)
+        return client
+
+    def submit(self, service, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """
+        Run fn(client, *args, **kwargs) on a pool thread, where client uses the same
+        credentials as service. Clients whose credentials can't be recovered run inline.
+        """
+        credentials = credentials_of(service)
+        if credentials is None:
+            future: Future = Future()
+            try:
+                future.set_result(fn(service, *args, **kwargs))
+            except Exception as exc:
+                future.set_exception(exc)
+            return future
+        return self._executor.submit(lambda: fn(self._client_for(credentials), *args, **kwargs))
+
+    def run_all(self, service, calls: List[Tuple[Callable[..., Any], Tuple[Any, ...]]]) -> List[Any]:
+        """Run (fn, args) pairs concurrently and return their results in order. Re-raises the first failure."""
+        futures = [self.submit(service, fn, *args) for fn, args in calls]
+        return [future.result() for future in futures]
+
+
+drive_pool = DrivePool()
@@ -2,15 +2,24 @@ from __future__ import annotations
 
 import io
 import json
-from typing import Any, Dict, Optional
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Tuple, Union
 
 import os
 from google.oauth2 import service_account
-from googleapiclient.discovery import build  # type: ignore[import-not-found]
+from googleapiclient.discovery import build, build_from_document  # type: ignore[import-not-found]
+from googleapiclient.discovery_cache import get_static_doc  # type: ignore[import-not-found]
 from googleapiclient.errors import HttpError  # type: ignore[import-not-found]
 from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload  # type: ignore[import-not-found]
 
 from google.oauth2.credentials import Credentials
+from google.auth.credentials import AnonymousCredentials
+import google_auth_httplib2
+import httplib2
+
+from services import blob_cache
 
 DRIVE_SCOPES = [
     "https://www.googleapis.com/auth/drive",
@@ -19,6 +28,32 @@ DRIVE_SCOPES = [
 
 _drive_service_cache = None
 
+# Point the client at another Drive-compatible server (e.g. a local fake in tests)
+DRIVE_API_ENDPOINT = (os.getenv("DRIVE_API_ENDPOINT") or "").strip()
+DRIVE_HTTP_TIMEOUT = float(os.getenv("DRIVE_HTTP_TIMEOUT", "60"))
+
+# Payloads at or above the threshold upload in resumable chunks streamed from the file handle;
+# an interrupted chunk is retried from the last offset Drive acknowledged instead of from zero.
+DRIVE_RESUMABLE_THRESHOLD = int(float(os.getenv("DRIVE_RESUMABLE_THRESHOLD_MB", "5")) * 1024 * 1024)
+# Resumable chunks must be a multiple of 256 KiB
+_CHUNK_ALIGN = 256 * 1024
+DRIVE_UPLOAD_CHUNK_SIZE = max(
+    _CHUNK_ALIGN,
+    int(float(os.getenv("DRIVE_UPLOAD_CHUNK_MB", "8")) * 1024 * 1024) // _CHUNK_ALIGN * _CHUNK_ALIGN,
+)
+DRIVE_UPLOAD_MAX_RETRIES = int(os.getenv("DRIVE_UPLOAD_MAX_RETRIES", "5"))
+_RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+# Downloads are fetched in ranged requests of this size and yielded chunk by chunk
+DRIVE_DOWNLOAD_CHUNK_SIZE = int(float(os.getenv("DRIVE_DOWNLOAD_CHUNK_MB", "4")) * 1024 * 1024)
+_LOCAL_READ_SIZE = 256 * 1024
+
+# Process-wide cache of resolved folder ids: (parent id, folder name) -> ({"id", "link"}, expires_at)
+FOLDER_CACHE_TTL = float(os.getenv("DRIVE_FOLDER_CACHE_TTL", "600"))
+_folder_cache: Dict[Tuple[str, str], Tuple[Dict[str, Any], float]] = {}
+_folder_cache_lock = threading.Lock()
+# One lock per key so concurrent requests for the same folder resolve (or create) it only once
+_folder_key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
 
 def _load_credentials():
     # 1. Try Developer Refresh Token (Personal Drive Storage)
@@ -50,10 +85,36 @@ def _load_credentials():
         with open(sa_file, "r", encoding="utf-8") as fh:
             sa_info = json.load(fh)
     if not sa_info:
+        if DRIVE_API_ENDPOINT:
+            # A fake Drive server doesn't check tokens
+            return AnonymousCredentials()
         return None
     return service_account.Credentials.from_service_account_info(sa_info, scopes=DRIVE_SCOPES)
 
 
+def build_drive_client(credentials):
+    """
+    Drive v3 client over its own keep-alive connection. httplib2 connections are not
+    thread-safe, so each thread that talks to Drive concurrently needs its own client.
+    Uses the discovery document bundled with googleapiclient (no discovery fetch).
+    """
+    transport = httplib2.Http(timeout=DRIVE_HTTP_TIMEOUT)
+    # Resumable uploads answer 308 with the committed range; httplib2 must not follow it as a redirect
+    transport.redirect_codes = transport.redirect_codes - {308}
+    http = google_auth_httplib2.AuthorizedHttp(credentials, http=transport)
+    if DRIVE_API_ENDPOINT:
+        # client_options only moves the API base; media uploads are built from rootUrl
+        document = json.loads(get_static_doc("drive", "v3"))
+        document["rootUrl"] = DRIVE_API_ENDPOINT.rstrip("/") + "/"
+        return build_from_document(document, http=http)
+    return build("drive", "v3", http=http, cache_discovery=False, static_discovery=True)
+
+
+def credentials_of(service) -> Optional[Any]:
+    """Credentials a built Drive client authorizes with, if it was built with AuthorizedHttp."""
+    return getattr(getattr(service, "_http", None), "credentials", None)
+
+
 def get_drive_service():
     global _drive_service_cache
     if _drive_service_cache is not None:
@@ -62,14 +123,77 @@ def get_drive_service():
     creds = _load_credentials()
     if not creds:
         return None
-    _drive_service_cache = build("drive", "v3", credentials=creds, cache_discovery=False)
+    _drive_service_cache = build_drive_client(creds)
     return _drive_service_cache
 
 
+def _folder_cache_get(key: Tuple[str, str]) -> Optional[Dict[str, Any]]:
+    with _folder_cache_lock:
+        entry = _folder_cache.get(key)
+        if not entry:
+            return None
+        folder, expires_at = entry
+        if expires_at < time.monotonic():
+            del _folder_cache[key]
+            return None
+        return dict(folder)
+
+
+def _folder_cache_put(key: Tuple[str, str], folder: Dict[str, Any]) -> None:
+    with _folder_cache_lock:
+        _folder_cache[key] = (dict(folder), time.monotonic() + FOLDER_CACHE_TTL)
+
+
+def _folder_key_lock(key: Tuple[str, str]) -> threading.Lock:
+    with _folder_cache_lock:
+        lock = _folder_key_locks.get(key)
+        if lock is None:
+            lock = _folder_key_locks[key] = threading.Lock()
+        return lock
+
+
+def invalidate_folder(folder_id: str) -> None:
+    """Drop cached entries that resolve to folder_id or live directly under it."""
+    with _folder_cache_lock:
+        stale = [
+            key for key, (folder, _) in _folder_cache.items()
+            if folder.get("id") == folder_id or key[0] == folder_id
+        ]
+        for key in stale:
+            del _folder_cache[key]
+    if stale:
+        print(f"[Drive] Invalidated {len(stale)} cached folder(s) for {folder_id}")
+
+
+@contextmanager
+def _invalidate_on_404(folder_id: str):
+    """Evict a cached folder id when Drive reports it no longer exists."""
+    try:
+        yield
+    except HttpError as exc:
+        if getattr(exc.resp, "status", None) == 404:
+            invalidate_folder(folder_id)
+        raise
+
+
+def _cached_folder(key: Tuple[str, str], resolve) -> Optional[Dict[str, Any]]:
+    cached = _folder_cache_get(key)
+    if cached:
+        return cached
+    with _folder_key_lock(key):
+        # Another thread may have resolved the folder while we waited
+        cached = _folder_cache_get(key)
+        if cached:
+            return cached
+        folder = resolve()
+        if folder and folder.get("id"):
+            _folder_cache_put(key, folder)
+        return folder
+
+
 def ensure_user_folder(service, user_email: str, user_name: Optional[str] = None) -> Optional[Dict[str, str]]:
     root_folder_id = (os.getenv("GOOGLE_DRIVE_ROOT_FOLDER_ID") or "").strip()
     drive_user_mode = (os.getenv("DRIVE_USER_MODE", "false").lower() == "true")
-    shared_drive_id = (os.getenv("GOOGLE_DRIVE_SHARED_DRIVE_ID") or "").strip()
     if not root_folder_id:
         # In user OAuth mode, default to the user's My Drive root
         if drive_user_mode:
@@ -78,6 +202,17 @@ def ensure_user_folder(service, user_email: str, user_name: Optional[str] = None
             return None
 
     # Preferred naming: "<Name> (<email>)"; legacy: "<email>"
+    preferred_name_raw = f"{user_name} ({user_email})" if user_name else user_email
+    return _cached_folder(
+        (root_folder_id, preferred_name_raw),
+        lambda: _find_or_create_user_folder(service, root_folder_id, user_email, user_name),
+    )
+
+
+def _find_or_create_user_folder(service, root_folder_id: str, user_email: str, user_name: Optional[str]) -> Dict[str, str]:
+    drive_user_mode = (os.getenv("DRIVE_USER_MODE", "false").lower() == "true")
+    shared_drive_id = (os.getenv("GOOGLE_DRIVE_SHARED_DRIVE_ID") or "").strip()
+
     preferred_name_raw = f"{user_name} ({user_email})" if user_name else user_email
     preferred_name = preferred_name_raw.replace("'", "\\'")
     legacy_name = user_email.replace("'", "\\'")
@@ -144,9 +279,17 @@ def ensure_user_folder(service, user_email: str, user_name: Optional[str] = None
 
 def ensure_subfolder(service, parent_id: str, folder_name: str) -> Dict[str, str]:
     """Ensure a subfolder exists within a parent folder."""
+    return _cached_folder(
+        (parent_id, folder_name),
+        lambda: _find_or_create_subfolder(service, parent_id, folder_name),
+    )  # type: ignore[return-value]
+
+
+def _find_or_create_subfolder(service, parent_id: str, folder_name: str) -> Dict[str, str]:
     safe_name = folder_name.replace("'", "\\'")
     query = f"mimeType='application/vnd.google-apps.folder' and name='{safe_name}' and '{parent_id}' in parents and trashed=false"
-    resp = service.files().list(q=query, spaces='drive', fields='files(id, webViewLink)', supportsAllDrives=True, includeItemsFromAllDrives=True).execute()
+    with _invalidate_on_404(parent_id):
+        resp = service.files().list(q=query, spaces='drive', fields='files(id, webViewLink)', supportsAllDrives=True, includeItemsFromAllDrives=True).execute()
     files = resp.get('files', [])
     if files:
         return {'id': files[0]['id'], 'link': files[0].get('webViewLink')}
@@ -167,7 +310,7 @@ def find_named_file(service, folder_id: str, filename: str) -> Optional[Dict[str
     list_kwargs: Dict[str, Any] = dict(
         q=query,
         spaces="drive",
-        fields="files(id, name, mimeType, webViewLink)",
+        fields="files(id, name, mimeType, webViewLink, modifiedTime, size)",
         includeItemsFromAllDrives=True,
         supportsAllDrives=True,
         pageSize=1,
@@ -175,13 +318,14 @@ def find_named_file(service, folder_id: str, filename: str) -> Optional[Dict[str
     if shared_drive_id:
         list_kwargs["driveId"] = shared_drive_id
         list_kwargs["corpora"] = "drive"
-    resp = service.files().list(**list_kwargs).execute()
+    with _invalidate_on_404(folder_id):
+        resp = service.files().list(**list_kwargs).execute()
     files = resp.get("files", [])
     return files[0] if files else None
 
 
-def read_text_file(service, file_id: str) -> str:
-    data = download_file(service, file_id)
+def read_text_file(service, file_id: str, modified_time: Optional[str] = None, size: Optional[int] = None) -> str:
+    data = download_file(service, file_id, modified_time=modified_time, size=size)
     return data.decode("utf-8")
 
 
@@ -190,7 +334,7 @@ def load_user_json(service, folder_id: str) -> Dict[str, Any]:
         meta = find_named_file(service, folder_id, "user.json")
         if not meta:
             return {}
-        content = read_text_file(service, meta["id"])  # type: ignore[index]
+        content = read_text_file(service, meta["id"], meta.get("modifiedTime"), _int_or_none(meta.get("size")))  # type: ignore[index]
         import json as _json
         return _json.loads(content)
     except Exception:
@@ -224,33 +368,174 @@ def list_folder_files(service, folder_id: str, page_size: int = 100) -> Dict[str
     if shared_drive_id:
         list_kwargs["driveId"] = shared_drive_id
         list_kwargs["corpora"] = "drive"
-    resp = service.files().list(**list_kwargs).execute()
+    with _invalidate_on_404(folder_id):
+        resp = service.files().list(**list_kwargs).execute()
     return {"files": resp.get("files", [])}
 
 
-def upload_pdf(service, folder_id: str, filename: str, file_bytes: bytes, mimetype: str = "application/pdf") -> Dict[str, Any]:
-    media = MediaIoBaseUpload(io.BytesIO(file_bytes), mimetype=mimetype, resumable=False)
+def _stream_size(stream: BinaryIO) -> Optional[int]:
+    """Bytes left in a seekable stream, leaving its position unchanged."""
+    try:
+        position = stream.tell()
+        end = stream.seek(0, io.SEEK_END)
+        stream.seek(position)
+        return end - position
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _media_body(data: Union[bytes, BinaryIO], mimetype: str) -> MediaIoBaseUpload:
+    """Simple upload for small payloads, chunked resumable upload for large or unsized ones."""
+    stream = io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+    size = _stream_size(stream)
+    if size is not None and size < DRIVE_RESUMABLE_THRESHOLD:
+        return MediaIoBaseUpload(stream, mimetype=mimetype, resumable=False)
+    return MediaIoBaseUpload(stream, mimetype=mimetype, chunksize=DRIVE_UPLOAD_CHUNK_SIZE, resumable=True)
+
+
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, HttpError):
+        return getattr(exc.resp, "status", None) in _RETRYABLE_STATUSES
+    return isinstance(exc, (OSError, httplib2.HttpLib2Error))
+
+
+def _execute_upload(request) -> Dict[str, Any]:
+    """
+    Execute a create/update request. Resumable uploads send one chunk at a time; after a failed
+    chunk the client asks Drive for the committed offset and continues from there.
+    """
+    if not request.resumable:
+        return request.execute()
+    failures = 0
+    response = None
+    while response is None:
+        try:
+            _, response = request.next_chunk()
+            failures = 0
+        except Exception as exc:
+            failures += 1
+            if not _is_retryable(exc) or failures > DRIVE_UPLOAD_MAX_RETRIES:
+                raise
+            delay = min(2 ** (failures - 1), 30)
+            print(f"[Drive] Upload chunk failed ({exc}); resuming in {delay}s ({failures}/{DRIVE_UPLOAD_MAX_RETRIES})")
+            time.sleep(delay)
+    return response
+
+
+def upload_pdf(service, folder_id: str, filename: str, file_bytes: Union[bytes, BinaryIO], mimetype: str = "application/pdf") -> Dict[str, Any]:
+    """Upload raw bytes or an open binary file object (e.g. a spooled upload on disk)."""
+    media = _media_body(file_bytes, mimetype)
     metadata = {
         "name": filename,
         "parents": [folder_id],
         "mimeType": mimetype,
     }
-    file = (
-        service.files()
-        .create(body=metadata, media_body=media, fields="id, name, webViewLink, webContentLink", supportsAllDrives=True)
-        .execute()
-    )
+    with _invalidate_on_404(folder_id):
+        file = _execute_upload(
+            service.files()
+            .create(body=metadata, media_body=media, fields="id, name, webViewLink, webContentLink", supportsAllDrives=True)
+        )
     return file
 
 
-def download_file(service, file_id: str) -> bytes:
+def _int_or_none(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_file_metadata(service, file_id: str, fields: str = "id, name, mimeType, size, modifiedTime") -> Dict[str, Any]:
+    return service.files().get(fileId=file_id, fields=fields, supportsAllDrives=True).execute()
+
+
+def _fetch_range(service, file_id: str, start: int, end: int) -> bytes:
+    request = service.files().get_media(fileId=file_id, supportsAllDrives=True)
+    request.headers["range"] = f"bytes={start}-{end}"
+    return request.execute()
+
+
+def _read_local(handle: BinaryIO, start: int, end: int) -> Iterator[bytes]:
+    with handle:
+        handle.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = handle.read(min(_LOCAL_READ_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _iter_uncached(service, file_id: str) -> Iterator[bytes]:
+    """Whole file in ranged chunks; the first response's Content-Range gives the size."""
+    buffer = io.BytesIO()
     request = service.files().get_media(fileId=file_id, supportsAllDrives=True)
-    fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, request)
+    downloader = MediaIoBaseDownload(buffer, request, chunksize=DRIVE_DOWNLOAD_CHUNK_SIZE)
     done = False
     while not done:
-        status, done = downloader.next_chunk()
-    return fh.getvalue()
+        _, done = downloader.next_chunk(num_retries=DRIVE_UPLOAD_MAX_RETRIES)
+        if buffer.tell():
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+
+def iter_file(
+    service,
+    file_id: str,
+    start: int = 0,
+    end: Optional[int] = None,
+    modified_time: Optional[str] = None,
+    size: Optional[int] = None,
+) -> Iterator[bytes]:
+    """
+    Yield a file's bytes [start, end] (inclusive, end defaults to the last byte) in chunks.
+    Served from the local blob cache when this revision is there; otherwise fetched from Drive
+    in DRIVE_DOWNLOAD_CHUNK_SIZE ranges, and full reads of cacheable files are stored on the way.
+    Pass modifiedTime/size from an earlier listing to use the cache; a full read without them
+    streams straight from Drive with no metadata request and bypasses the cache.
+    """
+    if (modified_time is None or size is None) and start == 0 and end is None:
+        yield from _iter_uncached(service, file_id)
+        return
+    if modified_time is None or size is None:
+        meta = get_file_metadata(service, file_id, fields="size, modifiedTime")
+        modified_time = meta.get("modifiedTime")
+        size = _int_or_none(meta.get("size"))
+    if size is None:
+        # Google-native files have no byte size; nothing to range over
+        yield service.files().get_media(fileId=file_id, supportsAllDrives=True).execute()
+        return
+    end = size - 1 if end is None else min(end, size - 1)
+    if start > end:
+        return
+
+    cached = blob_cache.open_blob(file_id, modified_time)
+    if cached is not None:
+        yield from _read_local(cached, start, end)
+        return
+
+    if start == 0 and end == size - 1 and blob_cache.cacheable(file_id, modified_time, size):
+        with blob_cache.blob_writer(file_id, modified_time) as sink:
+            for offset in range(0, size, DRIVE_DOWNLOAD_CHUNK_SIZE):
+                chunk = _fetch_range(service, file_id, offset, min(offset + DRIVE_DOWNLOAD_CHUNK_SIZE, size) - 1)
+                if sink is not None:
+                    sink.write(chunk)
+                yield chunk
+        return
+
+    for offset in range(start, end + 1, DRIVE_DOWNLOAD_CHUNK_SIZE):
+        yield _fetch_range(service, file_id, offset, min(offset + DRIVE_DOWNLOAD_CHUNK_SIZE - 1, end))
+
+
+def download_file(service, file_id: str, modified_time: Optional[str] = None, size: Optional[int] = None) -> bytes:
+    """Whole file as bytes; for small files (CSV, JSON, cached text). Large files should use iter_file."""
+    return b"".join(iter_file(service, file_id, modified_time=modified_time, size=size))
+
+
+def delete_file(service, file_id: str) -> None:
+    service.files().delete(fileId=file_id, supportsAllDrives=True).execute()
 
 
 def upload_text_file(
@@ -261,14 +546,14 @@ def upload_text_file(
     existing_file_id: Optional[str] = None,
     mimetype: str = "text/csv",
 ) -> Dict[str, Any]:
-    media = MediaIoBaseUpload(io.BytesIO(content.encode("utf-8")), mimetype=mimetype, resumable=False)
+    media = _media_body(content.encode("utf-8"), mimetype)
     metadata = {
         "name": filename,
         "parents": [folder_id],
         "mimeType": mimetype,
     }
     if existing_file_id:
-        file = (
+        file = _execute_upload(
             service.files()
             .update(
                 fileId=existing_file_id,
@@ -277,12 +562,11 @@ def upload_text_file(
                 fields="id, name, webViewLink, webContentLink",
                 supportsAllDrives=True,
             )
-            .execute()
         )
     else:
-        file = (
-            service.files()
-            .create(body=metadata, media_body=media, fields="id, name, webViewLink, webContentLink", supportsAllDrives=True)
-            .execute()
-        )
+        with _invalidate_on_404(folder_id):
+            file = _execute_upload(
+                service.files()
+                .create(body=metadata, media_body=media, fields="id, name, webViewLink, webContentLink", supportsAllDrives=True)
+            )
     return file
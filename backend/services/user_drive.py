@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from google.auth.transport.requests import Request as GoogleAuthRequest  # type: ignore[import-not-found]
+from google.oauth2.credentials import Credentials  # type: ignore[import-not-found]
+
+from services.google_drive import build_drive_client
+
+# DRIVE_USER_MODE: built Drive clients are reused across requests instead of rebuilt per request,
+# and a background thread refreshes access tokens before they expire, so request threads never
+# run the OAuth refresh themselves.
+USER_DRIVE_CACHE_SIZE = int(os.getenv("USER_DRIVE_CACHE_SIZE", "256"))
+# Refresh this long before the access token expires
+USER_DRIVE_REFRESH_MARGIN = timedelta(seconds=int(os.getenv("USER_DRIVE_REFRESH_MARGIN", "300")))
+USER_DRIVE_REFRESH_INTERVAL = float(os.getenv("USER_DRIVE_REFRESH_INTERVAL", "60"))
+# Users idle longer than this are no longer refreshed (their next request refreshes lazily)
+USER_DRIVE_IDLE_SECONDS = float(os.getenv("USER_DRIVE_IDLE_SECONDS", "1800"))
+
+
+class _UserCredentials:
+    def __init__(self, credentials: Credentials):
+        self.credentials = credentials
+        self.last_used = time.monotonic()
+        self.refreshing = False
+
+
+class UserDriveCache:
+    """
+    Credentials are shared per user (so one refresh serves every thread); built clients are
+    kept per thread because httplib2 connections can't be used by two threads at once.
+    """
+
+    def __init__(self, max_users: int = USER_DRIVE_CACHE_SIZE):
+        self.max_users = max_users
+        self._users: "OrderedDict[str, _UserCredentials]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._refresher: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _key(creds_dict: Dict[str, Any]) -> Optional[str]:
+        secret = creds_dict.get("refresh_token") or creds_dict.get("token")
+        if not secret:
+            return None
+        return hashlib.sha256(f"{creds_dict.get('client_id')}:{secret}".encode("utf-8")).hexdigest()
+
+    def get(self, creds_dict: Dict[str, Any]) -> Tuple[Optional[Any], Optional[Dict[str, Any]]]:
+        """
+        Drive client for the session's credentials, plus the credentials as a dict when
+        they are newer than what the session holds (so the caller can write them back).
+        """
+        key = self._key(creds_dict)
+        if key is None:
+            return None, None
+
+        with self._lock:
+            entry = self._users.get(key)
+            if entry is None:
+                entry = _UserCredentials(_credentials_from_dict(creds_dict))
+                self._users[key] = entry
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            else:
+                self._users.move_to_end(key)
+            entry.last_used = time.monotonic()
+            credentials = entry.credentials
+            needs_refresh = _due_for_refresh(credentials) and not entry.refreshing
+        self._ensure_refresher()
+        if needs_refresh:
+            # Cold or expired entry: refresh in the background rather than on this thread
+            self._refresh_async(key, entry)
+
+        service = self._client_for(key, credentials)
+        newer = None
+        if credentials.token and credentials.token != creds_dict.get("token"):
+            newer = credentials_to_dict(credentials)
+        return service, newer
+
+    def _client_for(self, key: str, credentials: Credentials) -> Any:
+        clients: "OrderedDict[str, Tuple[Credentials, Any]]" = getattr(self._local, "clients", None)
+        if clients is None:
+            clients = self._local.clients = OrderedDict()
+        entry = clients.get(key)
+        if entry is not None and entry[0] is credentials:
+            clients.move_to_end(key)
+            return entry[1]
+        client = build_drive_client(credentials)
+        clients[key] = (credentials, client)
+        while len(clients) > self.max_users:
+            clients.popitem(last=False)
+        return client
+
+    def _refresh_async(self, key: str, entry: _UserCredentials) -> None:
+        entry.refreshing = True
+        threading.Thread(target=self._refresh, args=(key, entry), name="drive-token-refresh", daemon=True).start()
+
+    def _refresh(self, key: str, entry: _UserCredentials) -> None:
+        try:
+            # Credentials are updated in place, so clients built on them pick up the new token
+            entry.credentials.refresh(GoogleAuthRequest())
+        except Exception as exc:
+            print(f"[Drive] Background token refresh failed for {key[:12]}: {exc}")
+        finally:
+            entry.refreshing = False
+
+    def _ensure_refresher(self) -> None:
+        if self._refresher is not None:
+            return
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._run_refresher, name="drive-token-refresher", daemon=True)
+                self._refresher.start()
+
+    def _run_refresher(self) -> None:
+        while True:
+            time.sleep(USER_DRIVE_REFRESH_INTERVAL)
+            idle_cutoff = time.monotonic() - USER_DRIVE_IDLE_SECONDS
+            with self._lock:
+                due = [
+                    (key, entry) for key, entry in self._users.items()
+                    if entry.last_used >= idle_cutoff and not entry.refreshing and _due_for_refresh(entry.credentials)
+                ]
+                for _, entry in due:
+                    entry.refreshing = True
+            for key, entry in due:
+                self._refresh(key, entry)
+
+
+def build_detached_client(creds_dict: Dict[str, Any]) -> Any:
+    """
+    Drive client on its own copy of the credentials, for work that runs off the request
+    thread (job queue, login log flusher). Build it on the thread that uses it; it is not cached.
+    """
+    return build_drive_client(_credentials_from_dict(creds_dict))
+
+
+def _due_for_refresh(credentials: Credentials) -> bool:
+    if not credentials.refresh_token:
+        return False
+    if not credentials.token or credentials.expiry is None:
+        # Unknown expiry (older sessions): refresh once so the expiry becomes known
+        return True
+    # google-auth keeps expiry as naive UTC
+    return credentials.expiry - USER_DRIVE_REFRESH_MARGIN <= datetime.utcnow()
+
+
+def _credentials_from_dict(creds_dict: Dict[str, Any]) -> Credentials:
+    credentials = Credentials(
+        token=creds_dict.get("token"),
+        refresh_token=creds_dict.get("refresh_token"),
+        token_uri=creds_dict.get("token_uri"),
+        client_id=creds_dict.get("client_id"),
+        client_secret=creds_dict.get("client_secret"),
+        scopes=creds_dict.get("scopes"),
+    )
+    expiry = creds_dict.get("expiry")
+    if expiry:
+        try:
+            credentials.expiry = datetime.fromisoformat(expiry)
+        except ValueError:
+            pass
+    return credentials
+
+
+def credentials_to_dict(credentials: Credentials) -> Dict[str, Any]:
+    return {
+        "token": credentials.token,
+        "refresh_token": credentials.refresh_token,
+        "token_uri": credentials.token_uri,
+        "client_id": credentials.client_id,
+        "client_secret": credentials.client_secret,
+        "scopes": credentials.scopes,
+        "expiry": credentials.expiry.isoformat() if credentials.expiry else None,
+    }
+
+
+user_drive_cache = UserDriveCache()
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from caching import SizedLRUCache
+
+# Map-reduce summarization for documents too long for one prompt. Sections are summarized
+# concurrently (map), then the partial summaries are merged in rounds (reduce), so latency
+# tracks the slowest section instead of one huge call.
+SUMMARY_DIRECT_CHARS = int(os.getenv("SUMMARY_DIRECT_CHARS", "100000"))
+SUMMARY_CHUNK_CHARS = int(os.getenv("SUMMARY_CHUNK_CHARS", "24000"))
+SUMMARY_PARALLELISM = int(os.getenv("SUMMARY_PARALLELISM", "4"))
+# Partial summaries per reduce call, bounded by total size
+SUMMARY_REDUCE_CHARS = int(os.getenv("SUMMARY_REDUCE_CHARS", "24000"))
+SUMMARY_PARTIAL_MAX_TOKENS = int(os.getenv("SUMMARY_PARTIAL_MAX_TOKENS", "800"))
+
+# (messages, max_tokens) -> completion text
+LLMCall = Callable[[List[Dict[str, str]], Optional[int]], str]
+
+# Bump when the map/reduce prompts change so stale partials aren't reused
+_PROMPT_VERSION = "1"
+
+_partials: SizedLRUCache[str] = SizedLRUCache("Summary", int(os.getenv("SUMMARY_CACHE_MB", "32")) * 1024 * 1024)
+_executor = ThreadPoolExecutor(max_workers=max(1, SUMMARY_PARALLELISM), thread_name_prefix="summary")
+
+# Lines that look like the start of a section: "Chapter 3", "2.1 Methods", "# Intro", "RESULTS"
+_HEADING_RE = re.compile(
+    r"^(?:(?i:chapter|part|section|unit|lecture|module|appendix)\s+[\dIVXLC]+\b.*"
+    r"|\d+(?:\.\d+)*\.?\s+[A-Z].{0,80}"
+    r"|#{1,6}\s+\S.*"
+    r"|[A-Z][A-Z0-9 ,:&'-]{3,80})$",
+    re.MULTILINE,
+)
+
+_MAP_PROMPT = """Summarize this part of a longer document as dense study notes.
+Keep every key argument, definition, formula, name and number; drop filler.
+Use short plain-text bullet points grouped under the section titles that appear in the text.
+
+Text:
+{text}
+"""
+
+_REDUCE_PROMPT = """Below are study notes for consecutive parts of one document.
+Merge them into a single set of plain-text notes: keep the document's order, combine
+duplicates, and keep key definitions, names and numbers.
+
+Notes:
+{text}
+"""
+
+
+def split_sections(text: str, max_chars: int = SUMMARY_CHUNK_CHARS) -> List[str]:
+    """
+    Split text into pieces of at most max_chars, cutting at the last section heading in the
+    second half of each window, else at a paragraph, line or sentence break.
+    """
+    pieces: List[str] = []
+    start = 0
+    while len(text) - start > max_chars:
+        window_end = start + max_chars
+        floor = start + max_chars // 2
+        cut = None
+        for match in _HEADING_RE.finditer(text, floor, window_end):
+            cut = match.start()
+        if cut is None or cut <= floor:
+            for separator in ("\n\n", "\n", ". "):
+                position = text.rfind(separator, floor, window_end)
+                if position > floor:
+                    cut = position + len(separator)
+                    break
+        if cut is None or cut <= start:
+            cut = window_end
+        pieces.append(text[start:cut])
+        start = cut
+    if start < len(text):
+        pieces.append(text[start:])
+    return [piece for piece in pieces if piece.strip()]
+
+
+def _cached_call(llm: LLMCall, model: str, prompt: str, max_tokens: int) -> str:
+    key = hashlib.sha256(f"{_PROMPT_VERSION}:{model}:{prompt}".encode("utf-8", "surrogatepass")).hexdigest()
+    cached = _partials.get(key)
+    if cached is not None:
+        return cached
+    result = llm([{"role": "user", "content": prompt}], max_tokens)
+    _partials.put(key, result, len(result) + 128)
+    return result
+
+
+def _run_all(llm: LLMCall, model: str, prompts: List[str]) -> List[str]:
+    futures = [_executor.submit(_cached_call, llm, model, prompt, SUMMARY_PARTIAL_MAX_TOKENS) for prompt in prompts]
+    return [future.result() for future in futures]
+
+
+def _batches(notes: List[str], max_chars: int) -> List[List[str]]:
+    batches: List[List[str]] = [[]]
+    size = 0
+    for note in notes:
+        if batches[-1] and size + len(note) > max_chars:
+            batches.append([])
+            size = 0
+        batches[-1].append(note)
+        size += len(note)
+    return batches
+
+
+def condense(text: str, llm: LLMCall, model: str = "") -> str:
+    """
+    Reduce text to notes short enough for one final prompt. Text under SUMMARY_DIRECT_CHARS
+    is returned unchanged; longer text is mapped section by section and reduced in rounds.
+    Partial results are cached by prompt hash, so re-summarizing a document is mostly free.
+    """
+    if len(text) <= SUMMARY_DIRECT_CHARS:
+        return text
+    sections = split_sections(text)
+    print(f"[Summarize] Map over {len(sections)} sections ({SUMMARY_PARALLELISM} at a time)")
+    notes = _run_all(llm, model, [_MAP_PROMPT.format(text=section) for section in sections])
+    rounds = 0
+    while sum(len(note) for note in notes) > SUMMARY_REDUCE_CHARS and len(notes) > 1:
+        batches = _batches(notes, SUMMARY_REDUCE_CHARS)
+        if len(batches) == len(notes):
+            # Every note fills a batch on its own; merge pairs so the rounds still converge
+            batches = [notes[i:i + 2] for i in range(0, len(notes), 2)]
+        rounds += 1
+        print(f"[Summarize] Reduce round {rounds}: {len(notes)} notes -> {len(batches)}")
+        notes = _run_all(llm, model, [_REDUCE_PROMPT.format(text="\n\n".join(batch)) for batch in batches])
+    return "\n\n".join(notes)
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import os
+import tempfile
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional
+
+from caching import DiskLRU, atomic_write, is_sha256
+from db import db_session
+from models import ExtractedText
+
+# Extracted text is content-addressed by the PDF's SHA-256, so one OCR pass serves every user
+# who uploads the same file. Lookups go local disk first, then the shared DB tier.
+TEXT_CACHE_DIR = os.getenv("TEXT_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "studyai_text_cache")
+TEXT_CACHE_MAX_BYTES = int(os.getenv("TEXT_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+def _compress(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8", "surrogatepass"), 6)
+
+
+def _decompress(data: bytes) -> str:
+    return zlib.decompress(data).decode("utf-8", "surrogatepass")
+
+
+class TierStats:
+    """Hit/miss counters for one cache layer."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def record(self, hit: bool) -> None:
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+class CacheTier(TierStats, ABC):
+    """One layer of the text cache."""
+
+    name = "tier"
+
+    @abstractmethod
+    def get(self, sha_hash: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def put(self, sha_hash: str, text: str) -> None:
+        ...
+
+
+class LocalDiskTier(CacheTier):
+    """zlib-compressed files on local disk, evicted least recently used first once over the size cap."""
+
+    name = "local"
+
+    def __init__(self, directory: str = TEXT_CACHE_DIR, max_bytes: int = TEXT_CACHE_MAX_BYTES):
+        super().__init__()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lru = DiskLRU("TextCache", directory, max_bytes, suffix=".txt.z")
+
+    def _path(self, sha_hash: str) -> str:
+        return os.path.join(self.directory, f"{sha_hash}.txt.z")
+
+    def get(self, sha_hash: str) -> Optional[str]:
+        path = self._path(sha_hash)
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read()
+            # mtime doubles as the LRU clock
+            DiskLRU.touch(path)
+            return _decompress(data)
+        except FileNotFoundError:
+            return None
+        except (OSError, zlib.error) as exc:
+            print(f"[TextCache] Dropping unreadable local entry {sha_hash[:12]}: {exc}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def put(self, sha_hash: str, text: str) -> None:
+        data = _compress(text)
+        with atomic_write(self._path(sha_hash)) as out:
+            out.write(data)
+        self._lru.added(len(data))
+
+
+class DatabaseTier(CacheTier):
+    """Shared tier in the app database, visible to every worker and every user."""
+
+    name = "db"
+
+    def get(self, sha_hash: str) -> Optional[str]:
+        with db_session() as session:
+            row = session.get(ExtractedText, sha_hash)
+            if row is None:
+                return None
+            return _decompress(row.content)
+
+    def put(self, sha_hash: str, text: str) -> None:
+        with db_session() as session:
+            row = session.get(ExtractedText, sha_hash)
+            if row is None:
+                row = ExtractedText(sha256_hash=sha_hash)
+                session.add(row)
+            row.content = _compress(text)
+            row.text_length = len(text)
+
+
+class TextCache:
+    """Checks tiers in order and back-fills the faster tiers on a lower-tier hit."""
+
+    def __init__(self, tiers: List[CacheTier]):
+        self.tiers = tiers
+        self._fallback_stats: Dict[str, TierStats] = {}
+        self._fallback_lock = threading.Lock()
+
+    def get(
+        self,
+        sha_hash: str,
+        fallback: Optional[Callable[[str], Optional[str]]] = None,
+        fallback_name: str = "drive",
+    ) -> Optional[str]:
+        """
+        Look the text up tier by tier. fallback is a request-scoped last resort (e.g. the
+        user's Drive TextCache); a hit there is stored in every tier.
+        """
+        if not is_sha256(sha_hash):
+            return None
+        for depth, tier in enumerate(self.tiers):
+            try:
+                text = tier.get(sha_hash)
+            except Exception as exc:
+                print(f"[TextCache] {tier.name} lookup failed: {exc}")
+                text = None
+            tier.record(text is not None)
+            if text is not None:
+                for upper in self.tiers[:depth]:
+                    self._safe_put(upper, sha_hash, text)
+                return text
+        if fallback is None:
+            return None
+
+        try:
+            text = fallback(sha_hash)
+        except Exception as exc:
+            print(f"[TextCache] {fallback_name} lookup failed: {exc}")
+            text = None
+        self._stats_for(fallback_name).record(bool(text))
+        if text:
+            self.put(sha_hash, text)
+        return text or None
+
+    def _stats_for(self, name: str) -> TierStats:
+        with self._fallback_lock:
+            if name not in self._fallback_stats:
+                self._fallback_stats[name] = TierStats()
+            return self._fallback_stats[name]
+
+    def put(self, sha_hash: str, text: str) -> None:
+        if not text or not is_sha256(sha_hash):
+            return
+        for tier in self.tiers:
+            self._safe_put(tier, sha_hash, text)
+
+    @staticmethod
+    def _safe_put(tier: CacheTier, sha_hash: str, text: str) -> None:
+        try:
+            tier.put(sha_hash, text)
+        except Exception as exc:
+            print(f"[TextCache] {tier.name} store failed for {sha_hash[:12]}: {exc}")
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        result = {tier.name: tier.stats() for tier in self.tiers}
+        with self._fallback_lock:
+            fallbacks = dict(self._fallback_stats)
+        for name, stats in fallbacks.items():
+            result[name] = stats.stats()
+        return result
+
+
+def _build_text_cache() -> TextCache:
+    tiers: List[CacheTier] = [LocalDiskTier()]
+    # Drive-only deployments have no database; their shared tier is the per-user Drive TextCache in app.py
+    if os.getenv('DRIVE_ONLY_MODE', 'false').lower() != 'true':
+        tiers.append(DatabaseTier())
+    return TextCache(tiers)
+
+
+text_cache = _build_text_cache()
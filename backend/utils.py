@@ -3,12 +3,13 @@ from __future__ import annotations
 import base64
 import json
 from datetime import datetime, timezone, timedelta
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 
 from flask import request
 
+from activity_buffer import activity_buffer
 from db import db_session
-from models import DailyUploadStat, LoginEvent, PdfUpload, PhotoCaptureEvent, User, FeatureUsage, StreamState
+from models import DailyUploadStat, LoginEvent, PdfUpload, PhotoCaptureEvent, User, StreamState
 
 
 def decode_user_cookie() -> Optional[Dict[str, Any]]:
@@ -86,7 +87,8 @@ def get_or_create_user(user_info: Dict[str, Any], drive_folder: Optional[Dict[st
                     if drive_file.get('id'):
                         # Use local proxy to serve the image
                         # We use a relative URL which the frontend will resolve against the API base
-                        user.picture = f"/api/file/proxy/{drive_file.get('id')}"
+                        # Avatars render at 32-40px, so ask the proxy for a small cached thumbnail
+                        user.picture = f"/api/file/proxy/{drive_file.get('id')}?w=128"
                         # Store file ID if we want to delete old ones later (optional)
             except Exception as e:
                 print(f"[Profile Pic] Failed to upload profile picture to Drive: {e}")
@@ -267,24 +269,12 @@ def set_photo_capture(user_id: int, enabled: bool) -> None:
 
 
 def update_heartbeat(user_id: int) -> None:
-    with db_session() as session:
-        user = session.query(User).filter_by(id=user_id).first()
-        if not user:
-            return
-        # Use naive UTC for compatibility with TIMESTAMP WITHOUT TIME ZONE
-        setattr(user, "last_heartbeat", datetime.now(timezone.utc).replace(tzinfo=None))
-        session.add(user)
+    # Buffered; last_heartbeat reaches the DB on the next activity flush
+    activity_buffer.record_heartbeat(user_id)
 
 
 def record_feature_usage(user_id: int, feature_type: str, details: str, pdf_filename: Optional[str] = None) -> None:
-    with db_session() as session:
-        usage = FeatureUsage(
-            user_id=user_id,
-            feature_type=feature_type,
-            details=details,
-            pdf_filename=pdf_filename
-        )
-        session.add(usage)
+    activity_buffer.record_usage(user_id, feature_type, details, pdf_filename)
 
 
 def check_duplicate_pdf(sha256_hash: str) -> Optional[PdfUpload]:
@@ -292,14 +282,24 @@ def check_duplicate_pdf(sha256_hash: str) -> Optional[PdfUpload]:
         return session.query(PdfUpload).filter_by(sha256_hash=sha256_hash).first()
 
 
+def user_uploaded_pdf(email: str, sha256_hash: str) -> bool:
+    with db_session() as session:
+        query = session.query(PdfUpload.id).join(User).filter(User.email == email, PdfUpload.sha256_hash == sha256_hash)
+        return query.first() is not None
+
+
 def get_active_users(seconds: int = 30) -> list[User]:
+    # Recency comes from the in-memory heartbeat map; the DB is only read for profile fields
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=seconds)
+    last_seen = activity_buffer.active_since(cutoff)
+    if not last_seen:
+        return []
     with db_session() as session:
-        # Use naive UTC cutoff
-        cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=seconds)
-        users = session.query(User).filter(User.last_heartbeat >= cutoff).all()
-        # Expunge to use outside session
+        users = session.query(User).filter(User.id.in_(list(last_seen))).all()
         for user in users:
             session.expunge(user)
+            # Show the buffered heartbeat even if it hasn't been flushed yet
+            user.last_heartbeat = last_seen[user.id]
         return users
 
 
@@ -314,7 +314,6 @@ def get_streaming_state(user_id: int) -> Optional[Dict[str, Any]]:
             "facingMode": state.facing_mode,
             "command": state.command,
             "updatedAt": state.updated_at,
-            "lastFrame": state.last_frame # Base64 string
         }
 
 
@@ -332,26 +331,17 @@ def update_streaming_state(user_id: int, active: bool, facing_mode: str = "user"
         session.commit()
 
 
-def update_streaming_frame(user_id: int, frame_data: bytes) -> None:
+def poll_streaming_state(user_id: int) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """Pop the pending stream command and read the stream state in one transaction."""
     with db_session() as session:
         state = session.query(StreamState).filter_by(user_id=user_id).first()
         if not state:
-            state = StreamState(user_id=user_id, is_active=True)
-            session.add(state)
-        
-        # Convert bytes to base64 string for Text column
-        b64_frame = base64.b64encode(frame_data).decode('utf-8')
-        state.last_frame = b64_frame
-        state.updated_at = datetime.now(timezone.utc).replace(tzinfo=None)
-        session.commit()
-
-
-def pop_streaming_command(user_id: int) -> Optional[str]:
-    with db_session() as session:
-        state = session.query(StreamState).filter_by(user_id=user_id).first()
-        if state and state.command:
-            cmd = state.command
+            return None, None
+        command = state.command
+        if command:
             state.command = None
-            session.commit()
-            return cmd
-        return None
+        return command, {
+            "active": state.is_active,
+            "facingMode": state.facing_mode,
+            "updatedAt": state.updated_at,
+        }
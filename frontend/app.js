@@ -10,7 +10,7 @@ let appState = {
   isAuthenticated: false,
   user: null,
   chatHistory: [],
-  pdfsList: [], // Array of {name, text, base64}
+  pdfsList: [], // Array of {name, text, base64, pdfUrl, docId}
   processingFiles: {}, // Map of filename -> { progress: 0, status: 'waiting' }
   selectedPdfIndices: [], // Array of indices of selected PDFs (for multi-select)
   hasSentPreciseLocation: false,
@@ -34,6 +34,20 @@ let appState = {
       .map(idx => this.pdfsList[idx]?.text || '')
       .join('\n\n--- Next PDF ---\n\n');
   },
+  get pdfDocId() {
+    // Server-side index id, only meaningful when exactly one PDF is selected
+    if (this.selectedPdfIndices.length !== 1) {
+      return null;
+    }
+    return this.pdfsList[this.selectedPdfIndices[0]]?.docId || null;
+  },
+  get pdfUrl() {
+    // Server URL of the first selected PDF (newer uploads; replaces inline base64)
+    if (this.selectedPdfIndices.length === 0 || this.pdfsList.length === 0) {
+      return '';
+    }
+    return this.pdfsList[this.selectedPdfIndices[0]]?.pdfUrl || '';
+  },
   get pdfBase64() {
     // Return base64 from first selected PDF
     if (this.selectedPdfIndices.length === 0 || this.pdfsList.length === 0) {
@@ -521,38 +535,10 @@ async function uploadFileInBackground(file) {
         throw new Error(errText || 'Upload failed');
     }
 
-    const reader = response.body.getReader();
-    const decoder = new TextDecoder();
-    let buffer = '';
-    let finalData = null;
-
-    while (true) {
-      const { done, value } = await reader.read();
-      if (done) break;
-      
-      buffer += decoder.decode(value, { stream: true });
-      const lines = buffer.split('\n');
-      buffer = lines.pop(); // Keep the last incomplete line
+    // Extraction runs as a background job on the server; follow its progress events
+    const job = await response.json();
+    const finalData = await followUploadJob(job.job_id, filename);
 
-      for (const line of lines) {
-        if (!line.trim()) continue;
-        try {
-          const update = JSON.parse(line);
-          
-          if (update.status === 'progress') {
-              updateProcessingStatus(filename, update.percent, update.message);
-          } else if (update.status === 'success') {
-              finalData = update;
-              updateProcessingStatus(filename, 100, 'Complete');
-          } else if (update.error) {
-              throw new Error(update.error);
-          }
-        } catch (e) {
-          console.warn('Error parsing stream line:', e);
-        }
-      }
-    }
-    
     if (!finalData) throw new Error('No success response received');
     
     const data = finalData;
@@ -562,7 +548,9 @@ async function uploadFileInBackground(file) {
     appState.pdfsList.push({
       name: file.name,
       text: data.pdf_text,
-      base64: data.pdf_base64
+      base64: data.pdf_base64 || '',
+      pdfUrl: data.pdf_url,
+      docId: data.doc_id
     });
     
     // If this is the only PDF, select it automatically
@@ -596,6 +584,38 @@ async function uploadFileInBackground(file) {
   }
 }
 
+async function followUploadJob(jobId, filename) {
+  let next = 0;
+  while (true) {
+    const res = await fetch(`${API_BASE_URL}/api/jobs/${jobId}?after=${next}`, {
+      credentials: 'include',
+    });
+    if (!res.ok) {
+      const errText = await res.text();
+      throw new Error(errText || 'Lost track of upload');
+    }
+    const snapshot = await res.json();
+    next = snapshot.next;
+
+    for (const update of snapshot.events) {
+      if (update.error) {
+        throw new Error(update.error);
+      }
+      if (update.status === 'progress') {
+        updateProcessingStatus(filename, update.percent, update.message);
+      } else if (update.status === 'success') {
+        updateProcessingStatus(filename, 100, 'Complete');
+        return update;
+      }
+    }
+
+    if (snapshot.state === 'succeeded' || snapshot.state === 'failed') {
+      throw new Error('No success response received');
+    }
+    await new Promise(resolve => setTimeout(resolve, 1000));
+  }
+}
+
 function savePdfsToStorage() {
   try {
     localStorage.setItem('pdfs_backup', JSON.stringify(appState.pdfsList));
@@ -605,6 +625,8 @@ function savePdfsToStorage() {
         const lightBackup = appState.pdfsList.map(p => ({
             name: p.name,
             text: p.text,
+            pdfUrl: p.pdfUrl,
+            docId: p.docId,
             base64: '' // Skip heavy base64
         }));
         localStorage.setItem('pdfs_backup', JSON.stringify(lightBackup));
@@ -2160,6 +2182,32 @@ function refreshAdminData() {
   });
 }
 
+// ============================================
+// DOCUMENT REQUESTS
+// ============================================
+
+// POST to an AI endpoint using the server-side document id when one PDF is selected,
+// so the full text isn't uploaded on every call. Falls back to sending the text inline
+// when the server no longer has the document (or several PDFs are combined).
+async function postDocumentRequest(path, body, textKey = 'pdf_text') {
+  const send = (payload) => fetch(`${API_BASE_URL}${path}`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(payload),
+    credentials: 'include',
+  });
+
+  const docId = appState.pdfDocId;
+  if (docId) {
+    const response = await send({ ...body, doc_id: docId });
+    if (response.status !== 404) return response;
+    const data = await response.clone().json().catch(() => ({}));
+    if (data.code !== 'document_not_found') return response;
+    console.log('📄 Document not cached on server, resending text');
+  }
+  return send({ ...body, [textKey]: appState.pdfText });
+}
+
 // ============================================
 // CHAT INTERFACE
 // ============================================
@@ -2191,29 +2239,56 @@ async function handleChat() {
   document.getElementById('chatbot-question').value = '';
 
   try {
-    const response = await fetch(`${API_BASE_URL}/api/chat`, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ 
-        message: question, 
-        history: appState.chatHistory,
-        pdf_text: appState.pdfText 
-      }),
-      credentials: 'include',
+    const response = await postDocumentRequest('/api/chat', { 
+      message: question, 
+      history: appState.chatHistory,
+      stream: true
     });
 
-    const data = await response.json();
-    if (!response.ok) throw new Error(data.error || 'Failed to get answer');
-    
-    // Add assistant response to chat
-    addChatMessage('assistant', data.response);
+    if (!response.ok) {
+      const data = await response.json().catch(() => ({}));
+      throw new Error(data.error || 'Failed to get answer');
+    }
+
+    // Render the answer token by token as it streams in
+    const bubble = addChatMessage('assistant', '', false);
+    const chatHistory = document.getElementById('chat-history');
+    let answer = '';
+    await readNdjsonStream(response, (event) => {
+      if (event.error) throw new Error(event.error);
+      if (event.delta) {
+        answer += event.delta;
+        bubble.textContent = answer;
+        chatHistory.scrollTop = chatHistory.scrollHeight;
+      }
+    });
+    appState.chatHistory.push({ role: 'assistant', content: answer });
     recordUsage('chat', `Q: ${question.substring(0, 50)}...`, appState.currentFileName);
   } catch (error) {
     addChatMessage('assistant', `Error: ${error.message}`);
   }
 }
 
-function addChatMessage(role, content) {
+// Calls onEvent for each JSON line of an NDJSON response body as it arrives
+async function readNdjsonStream(response, onEvent) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let newline;
+    while ((newline = buffer.indexOf('\n')) >= 0) {
+      const line = buffer.slice(0, newline).trim();
+      buffer = buffer.slice(newline + 1);
+      if (line) onEvent(JSON.parse(line));
+    }
+  }
+  if (buffer.trim()) onEvent(JSON.parse(buffer));
+}
+
+function addChatMessage(role, content, record = true) {
   const chatHistory = document.getElementById('chat-history');
   const messageDiv = document.createElement('div');
   messageDiv.className = `chat-message ${role}`;
@@ -2228,7 +2303,10 @@ function addChatMessage(role, content) {
   // Auto-scroll to bottom
   chatHistory.scrollTop = chatHistory.scrollHeight;
   
-  appState.chatHistory.push({ role, content });
+  if (record) {
+    appState.chatHistory.push({ role, content });
+  }
+  return bubble;
 }
 
 // ============================================
@@ -2279,23 +2357,27 @@ async function handleSummarize() {
   console.log('📝 Summarize: Sending PDF of size', appState.pdfText.length);
 
   try {
-    const response = await fetch(`${API_BASE_URL}/api/summarize`, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ pdf_text: appState.pdfText }),
-      credentials: 'include',
-    });
+    const response = await postDocumentRequest('/api/summarize', { stream: true });
 
     console.log('📦 Summarize response status:', response.status);
-    const data = await response.json();
-    if (!response.ok) throw new Error(data.error || 'Failed to summarize');
-    
-    // Render HTML content
-    resultBox.innerHTML = data.summary;
-    
+    if (!response.ok) {
+      const data = await response.json().catch(() => ({}));
+      throw new Error(data.error || 'Failed to summarize');
+    }
+
     // Apply specific classes if needed, or rely on CSS selectors for #summarizer-result elements
     resultBox.classList.add('formatted-summary');
 
+    // Render the HTML as it streams in
+    let summary = '';
+    await readNdjsonStream(response, (event) => {
+      if (event.error) throw new Error(event.error);
+      if (event.delta) {
+        summary += event.delta;
+        resultBox.innerHTML = summary;
+      }
+    });
+
     console.log('✅ Summary generated');
     recordUsage('summary', 'Generated summary', appState.currentFileName);
   } catch (error) {
@@ -2352,12 +2434,7 @@ async function handleQuiz() {
   }
 
   try {
-    const response = await fetch(`${API_BASE_URL}/api/quiz`, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ count: num_questions, pdf_text: appState.pdfText }),
-      credentials: 'include',
-    });
+    const response = await postDocumentRequest('/api/quiz', { count: num_questions });
 
     const data = await response.json();
     if (!response.ok) throw new Error(data.error || 'Failed to generate quiz');
@@ -2530,12 +2607,7 @@ async function handleFlashcards() {
   console.log(`📊 Generating ${num_cards} flashcards from PDF of size ${appState.pdfText?.length || 0} characters`);
 
   try {
-    const response = await fetch(`${API_BASE_URL}/api/flashcards`, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ count: num_cards, pdf_text: appState.pdfText }),
-      credentials: 'include',
-    });
+    const response = await postDocumentRequest('/api/flashcards', { count: num_cards });
 
     console.log('Flashcard API Response Status:', response.status);
     const data = await response.json();
@@ -2688,15 +2760,9 @@ async function handleMindMap() {
   resultBox.innerHTML = '<div class="loading-spinner"><div class="spinner"></div><p>Generating mind map...</p></div>';
   
   try {
-    const response = await fetch(`${API_BASE_URL}/api/generate-mindmap`, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ 
-        text: appState.pdfText,
-        filename: appState.currentFileName
-      }),
-      credentials: 'include'
-    });
+    const response = await postDocumentRequest('/api/generate-mindmap', { 
+      filename: appState.currentFileName
+    }, 'text');
     
     const data = await response.json();
     if (!response.ok) throw new Error(data.error || 'Failed to generate mind map');
@@ -2777,15 +2843,22 @@ async function openBookInReader(index) {
   container.innerHTML = '<div class="loading-spinner"><div class="spinner"></div><p>Opening book...</p></div>';
   
   try {
-    // Convert base64 to Uint8Array for PDF.js
-    const pdfData = atob(appState.pdfBase64);
-    const pdfArray = new Uint8Array(pdfData.length);
-    for (let i = 0; i < pdfData.length; i++) {
-      pdfArray[i] = pdfData.charCodeAt(i);
+    let loadingTask;
+    if (appState.pdfUrl) {
+      // PDF.js fetches the file from the server with Range requests, page by page
+      loadingTask = pdfjsLib.getDocument({
+        url: `${API_BASE_URL}${appState.pdfUrl}`,
+        withCredentials: true
+      });
+    } else {
+      // Older backups still carry the PDF inline as base64
+      const pdfData = atob(appState.pdfBase64);
+      const pdfArray = new Uint8Array(pdfData.length);
+      for (let i = 0; i < pdfData.length; i++) {
+        pdfArray[i] = pdfData.charCodeAt(i);
+      }
+      loadingTask = pdfjsLib.getDocument({data: pdfArray});
     }
-
-    // Load PDF using PDF.js
-    const loadingTask = pdfjsLib.getDocument({data: pdfArray});
     const pdf = await loadingTask.promise;
     
     container.innerHTML = ''; // Clear loading